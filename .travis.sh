@@ -8,5 +8,8 @@ sudo apt-get update -qq
 sudo apt-get install -qq -y python-pip graphviz openhrp openrtm-aist-python python-omniorb omniidl-python omniorb-idl omniidl
 sudo pip install -r requirements-dev.txt
 
+python -m benchmarks.startup --json startup.json
+python -m benchmarks.conversion --json conversion.json
+
 cd doc
 source ./build.sh
@@ -0,0 +1,3 @@
+"""
+Benchmarks of simtrans (not installed with the package)
+"""
@@ -0,0 +1,199 @@
+# -*- coding:utf-8 -*-
+
+"""Benchmark of the readers, writers and the command line interface
+
+Generates a synthetic model (see :mod:`benchmarks.generate`) and measures
+wall time of each reader and writer in the process (the mesh cache is
+cleared before each run) and of end-to-end conversions by the command
+line interface in fresh processes. The VRML reader is measured by the
+pure python parser on the output of the VRML writer (read-vrml is
+reported as skipped if write-vrml is not run before it).
+
+The results are written in JSON format with the commit and parameters,
+and can be compared with the results of another commit.
+
+Usage::
+
+   $ python -m benchmarks.conversion --links 50 --triangles 5000 --json /tmp/after.json --compare /tmp/before.json
+"""
+
+import os
+import sys
+import copy
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+from argparse import ArgumentParser
+from simtrans import cache
+from simtrans import registry
+from .startup import summary
+from .generate import generate
+
+parser = ArgumentParser(description='Measure time of simtrans readers, writers and command line interface on synthetic model.')
+parser.add_argument('-n', '--repeat', dest='repeat', metavar='N', type=int, default=5, help='number of runs for each case (default: 5)')
+parser.add_argument('--links', dest='links', metavar='N', type=int, default=20, help='number of links (default: 20)')
+parser.add_argument('--depth', dest='depth', metavar='N', type=int, default=3, help='maximum depth of the link tree (default: 3)')
+parser.add_argument('--meshes', dest='meshes', metavar='N', type=int, default=1, help='number of meshes per link (default: 1)')
+parser.add_argument('--triangles', dest='triangles', metavar='N', type=int, default=2000, help='approximate number of triangles per mesh (default: 2000)')
+parser.add_argument('--cases', dest='cases', metavar='NAME', nargs='+', help='run only the cases starting with the names (e.g. read write-urdf)')
+parser.add_argument('--json', dest='json', metavar='FILE', help='write the results in JSON format')
+parser.add_argument('--compare', dest='compare', metavar='FILE', help='compare with the results of another run (JSON)')
+
+
+def commit():
+    '''
+    Get the commit of the working tree (None if unknown)
+    '''
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=devnull,
+                                           cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(func, repeat):
+    '''
+    Call the function repeatedly and return the wall times (setup of the
+    function, if any, is called before each run and is not measured)
+    '''
+    times = []
+    for i in range(repeat):
+        cache.clear()
+        args = func.setup() if hasattr(func, 'setup') else ()
+        start = time.time()
+        func(*args)
+        times.append(time.time() - start)
+    return times
+
+
+def _reader(fmt, fname):
+    def run():
+        registry.createreader(fmt).read(fname)
+    return run
+
+
+def _meshreader(spec, fname):
+    def run():
+        registry.load(spec)().read(fname)
+    return run
+
+
+def _writer(fmt, m, fname):
+    # writers may modify the model
+    def run(m):
+        registry.createwriter(fmt).write(m, fname)
+    run.setup = lambda: (copy.deepcopy(m),)
+    return run
+
+
+def _meshwriter(spec, shape, fname):
+    def run(shape):
+        registry.load(spec)().write(shape, fname)
+    run.setup = lambda: (copy.deepcopy(shape),)
+    return run
+
+
+def _cli(args):
+    def run():
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call([sys.executable, '-m', 'simtrans.cli', '--force'] + args, stdout=devnull, stderr=devnull)
+    return run
+
+
+def cases(files, outdir):
+    '''
+    Get list of the cases as (name, function) in the order to run
+    (function is None or raises ImportError or EnvironmentError when the
+    case cannot run)
+    '''
+    m = registry.createreader('urdf').read(files['urdf'])
+    shape = m.links[0].visuals[0]
+    out = lambda f: os.path.join(outdir, f)
+    return [
+        ('read-urdf', _reader('urdf', files['urdf'])),
+        ('read-sdf', _reader('sdf', files['sdf'])),
+        ('read-dae', _meshreader('simtrans.collada:ColladaReader', files['dae'][0])),
+        ('read-stl', _meshreader('simtrans.stl:STLReader', files['stl'][0])),
+        ('write-urdf', _writer('urdf', m, out('write.urdf'))),
+        ('write-sdf', _writer('sdf', m, out('write.sdf'))),
+        ('write-vrml', _writer('vrml', m, out('write.wrl'))),
+        ('read-vrml', _reader('vrml', out('write.wrl'))),
+        ('write-dot', _writer('dot', m, out('write.dot'))),
+        ('write-dae', _meshwriter('simtrans.collada:ColladaWriter', shape, out('write.dae'))),
+        ('write-stl', _meshwriter('simtrans.stl:STLWriter', shape, out('write.stl'))),
+        ('write-glb', _meshwriter('simtrans.gltf:GLTFWriter', shape, out('write.glb'))),
+        ('cli-urdf-to-urdf', _cli(['-i', files['urdf'], '-o', out('cli.urdf')])),
+        ('cli-sdf-to-urdf', _cli(['-i', files['sdf'], '-o', out('clisdf.urdf')])),
+        ('cli-urdf-to-vrml', _cli(['-i', files['urdf'], '-o', out('cli.wrl')])),
+        ('cli-urdf-to-vrml-pipeline', _cli(['-i', files['urdf'], '-o', out('clipipe.wrl'), '--pipeline'])),
+        ('cli-urdf-to-dot', _cli(['-i', files['urdf'], '-o', out('cli.dot')]))
+    ]
+
+
+def compare(results, old):
+    '''
+    Format ratio of the median times to the old results
+    '''
+    lines = ['%-20s %12s %12s %8s' % ('case', 'old[ms]', 'new[ms]', 'ratio')]
+    for name in sorted(results['cases'].keys()):
+        if name not in old['cases']:
+            continue
+        a = old['cases'][name]['median']
+        b = results['cases'][name]['median']
+        lines.append('%-20s %12.1f %12.1f %8.2f' % (name, a * 1000, b * 1000, b / a if a > 0 else 0))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    options = parser.parse_args(argv)
+    results = {
+        'commit': commit(),
+        'python': platform.python_version(),
+        'parameters': {'links': options.links, 'depth': options.depth, 'meshes': options.meshes,
+                       'triangles': options.triangles, 'repeat': options.repeat},
+        'cases': {},
+        'skipped': {}
+    }
+    workdir = tempfile.mkdtemp()
+    try:
+        files = generate(os.path.join(workdir, 'model'), options.links, options.depth, options.meshes, options.triangles)
+        outdir = os.path.join(workdir, 'out')
+        os.mkdir(outdir)
+        for name, func in cases(files, outdir):
+            if options.cases and len([c for c in options.cases if name.startswith(c)]) == 0:
+                continue
+            if func is None:
+                results['skipped'][name] = 'not available'
+                continue
+            try:
+                results['cases'][name] = summary(measure(func, options.repeat))
+            except (ImportError, EnvironmentError), e:
+                results['skipped'][name] = str(e)
+            except subprocess.CalledProcessError, e:
+                results['skipped'][name] = 'exit status %i' % e.returncode
+    finally:
+        shutil.rmtree(workdir)
+
+    print '%-20s %10s %10s %10s' % ('case', 'min[ms]', 'median[ms]', 'max[ms]')
+    for name in sorted(results['cases'].keys()):
+        r = results['cases'][name]
+        print '%-20s %10.1f %10.1f %10.1f' % (name, r['min'] * 1000, r['median'] * 1000, r['max'] * 1000)
+    for name in sorted(results['skipped'].keys()):
+        print '%-20s skipped (%s)' % (name, results['skipped'][name])
+    if options.compare:
+        with open(options.compare) as f:
+            print
+            print compare(results, json.load(f))
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,192 @@
+# -*- coding:utf-8 -*-
+
+"""Generator of synthetic models for the benchmarks
+
+Generates a kinematic tree of links (each link has visual and collision
+meshes of UV spheres) and writes it in URDF and SDF format, together with
+the meshes in COLLADA and binary STL format. No ROS packages, Gazebo
+models or OpenHRP services are needed.
+
+Usage::
+
+   $ python -m benchmarks.generate -o /tmp/fixture --links 50 --depth 4 --meshes 2 --triangles 5000
+"""
+
+import os
+import sys
+import json
+import math
+import struct
+import numpy
+from argparse import ArgumentParser
+from simtrans import model
+from simtrans import collada
+
+parser = ArgumentParser(description='Generate synthetic model for the benchmarks.')
+parser.add_argument('-o', '--output', dest='output', metavar='DIR', required=True, help='output directory')
+parser.add_argument('--links', dest='links', metavar='N', type=int, default=10, help='number of links (default: 10)')
+parser.add_argument('--depth', dest='depth', metavar='N', type=int, default=3, help='maximum depth of the link tree (default: 3)')
+parser.add_argument('--meshes', dest='meshes', metavar='N', type=int, default=1, help='number of meshes per link (default: 1)')
+parser.add_argument('--triangles', dest='triangles', metavar='N', type=int, default=1000, help='approximate number of triangles per mesh (default: 1000)')
+
+
+def sphere(triangles):
+    '''
+    Generate UV sphere with approximately the given number of triangles
+
+    >>> len(sphere(1000).vertex_index)
+    1056
+    '''
+    n = max(3, int(round(math.sqrt(triangles / 4.0))) + 1)
+    th, ph = numpy.meshgrid(numpy.linspace(0, numpy.pi, n), numpy.linspace(0, 2 * numpy.pi, 2 * n))
+    vertex = numpy.column_stack([(numpy.sin(th) * numpy.cos(ph)).reshape(-1),
+                                 (numpy.sin(th) * numpy.sin(ph)).reshape(-1),
+                                 numpy.cos(th).reshape(-1)]) * 0.05
+    idx = numpy.arange(vertex.shape[0]).reshape(2 * n, n)
+    a = idx[:-1, :-1].reshape(-1)
+    b = idx[:-1, 1:].reshape(-1)
+    c = idx[1:, 1:].reshape(-1)
+    d = idx[1:, :-1].reshape(-1)
+    data = model.MeshData()
+    data.vertex = vertex
+    data.vertex_index = numpy.vstack([numpy.column_stack([a, b, c]), numpy.column_stack([a, c, d])])
+    data.normal = vertex / 0.05
+    data.normal_index = data.vertex_index
+    return data
+
+
+def parents(links, depth):
+    '''
+    Get index of the parent of each link in the tree of the given depth
+    (links are distributed in balanced tree, parent of the root is None)
+
+    >>> parents(7, 2)
+    [None, 0, 0, 1, 1, 2, 2]
+    >>> parents(4, 10)
+    [None, 0, 1, 2]
+    '''
+    depth = max(1, depth)
+    branch = 1
+    while sum([branch ** k for k in range(depth + 1)]) < links:
+        branch = branch + 1
+    return [None] + [(i - 1) // branch for i in range(1, links)]
+
+
+def writestl(data, fname):
+    '''
+    Write mesh data in binary STL format
+    '''
+    tri = data.vertex[data.vertex_index]
+    n = numpy.cross(tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0])
+    n = n / numpy.maximum(numpy.linalg.norm(n, axis=1), 1e-12)[:, numpy.newaxis]
+    rec = numpy.zeros(len(tri), dtype=[('normal', '<f4', 3), ('vertex', '<f4', 9), ('attr', '<u2')])
+    rec['normal'] = n
+    rec['vertex'] = tri.reshape(-1, 9)
+    with open(fname, 'wb') as f:
+        f.write('simtrans benchmark'.ljust(80, ' '))
+        f.write(struct.pack('<I', len(tri)))
+        f.write(rec.tostring())
+
+
+def _urdf(name, names, parentidx, meshfiles):
+    lines = ['<robot name="%s">' % name]
+    for i, l in enumerate(names):
+        lines.append('  <link name="%s">' % l)
+        lines.append('    <inertial><mass value="1.0" /><origin xyz="0 0 0" /><inertia ixx="0.01" ixy="0" ixz="0" iyy="0.01" iyz="0" izz="0.01" /></inertial>')
+        for f in meshfiles[i]:
+            for tag in ['visual', 'collision']:
+                lines.append('    <%s><geometry><mesh filename="%s" /></geometry></%s>' % (tag, f, tag))
+        lines.append('  </link>')
+    for i, p in enumerate(parentidx):
+        if p is None:
+            continue
+        lines.append('  <joint name="joint%i" type="revolute">' % i)
+        lines.append('    <parent link="%s" /><child link="%s" />' % (names[p], names[i]))
+        lines.append('    <origin xyz="0 0 0.1" rpy="0 0 0" /><axis xyz="0 0 1" />')
+        lines.append('    <limit lower="-1.57" upper="1.57" effort="10" velocity="1" />')
+        lines.append('  </joint>')
+    lines.append('</robot>')
+    return '\n'.join(lines) + '\n'
+
+
+def _sdf(name, names, parentidx, meshfiles, depths):
+    lines = ['<sdf version="1.5">', '  <model name="%s">' % name]
+    for i, l in enumerate(names):
+        lines.append('    <link name="%s">' % l)
+        lines.append('      <pose>0 0 %g 0 0 0</pose>' % (0.1 * depths[i]))
+        lines.append('      <inertial><mass>1.0</mass><inertia><ixx>0.01</ixx><ixy>0</ixy><ixz>0</ixz><iyy>0.01</iyy><iyz>0</iyz><izz>0.01</izz></inertia></inertial>')
+        for k, f in enumerate(meshfiles[i]):
+            for tag in ['visual', 'collision']:
+                lines.append('      <%s name="%s%i"><geometry><mesh><uri>%s</uri></mesh></geometry></%s>' % (tag, tag, k, f, tag))
+        lines.append('    </link>')
+    for i, p in enumerate(parentidx):
+        if p is None:
+            continue
+        lines.append('    <joint name="joint%i" type="revolute">' % i)
+        lines.append('      <parent>%s</parent><child>%s</child>' % (names[p], names[i]))
+        lines.append('      <axis><xyz>0 0 1</xyz><limit><lower>-1.57</lower><upper>1.57</upper><velocity>1</velocity></limit></axis>')
+        lines.append('    </joint>')
+    lines.extend(['  </model>', '</sdf>'])
+    return '\n'.join(lines) + '\n'
+
+
+def generate(outdir, links=10, depth=3, meshes=1, triangles=1000):
+    '''
+    Generate the model and return the paths of the generated files
+
+    Meshes of even links are written in COLLADA and odd links in STL format.
+
+    >>> import tempfile, shutil
+    >>> d = tempfile.mkdtemp()
+    >>> files = generate(d, links=3, depth=1, meshes=2, triangles=100)
+    >>> sorted(files.keys())
+    ['dae', 'sdf', 'stl', 'urdf']
+    >>> len(files['dae']), len(files['stl'])
+    (4, 2)
+    >>> shutil.rmtree(d)
+    '''
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    name = 'bench%i' % links
+    names = ['link%i' % i for i in range(links)]
+    parentidx = parents(links, depth)
+    depths = []
+    for p in parentidx:
+        depths.append(0 if p is None else depths[p] + 1)
+    data = sphere(triangles)
+    shape = model.ShapeModel()
+    shape.shapeType = model.ShapeModel.SP_MESH
+    shape.data = data
+    files = {'dae': [], 'stl': []}
+    meshfiles = []
+    cwriter = collada.ColladaWriter()
+    for i in range(links):
+        meshfiles.append([])
+        ext = 'dae' if i % 2 == 0 else 'stl'
+        for k in range(meshes):
+            fname = os.path.join(outdir, 'mesh%i-%i.%s' % (i, k, ext))
+            if ext == 'dae':
+                cwriter.write(shape, fname)
+            else:
+                writestl(data, fname)
+            files[ext].append(fname)
+            meshfiles[-1].append(fname)
+    files['urdf'] = os.path.join(outdir, name + '.urdf')
+    with open(files['urdf'], 'w') as f:
+        f.write(_urdf(name, names, parentidx, meshfiles))
+    files['sdf'] = os.path.join(outdir, name + '.sdf')
+    with open(files['sdf'], 'w') as f:
+        f.write(_sdf(name, names, parentidx, meshfiles, depths))
+    return files
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    options = parser.parse_args(argv)
+    files = generate(options.output, options.links, options.depth, options.meshes, options.triangles)
+    print json.dumps(files, indent=2, sort_keys=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
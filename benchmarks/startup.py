@@ -0,0 +1,95 @@
+# -*- coding:utf-8 -*-
+
+"""Benchmark of the startup time of the command line interface
+
+Measures wall time of importing simtrans.cli and of converting a small
+URDF model (primitive shapes only) to graphviz format in fresh processes,
+and lists the heavy modules loaded by the import.
+
+Usage::
+
+   $ python -m benchmarks.startup -n 20 --json /tmp/startup.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+from argparse import ArgumentParser
+
+parser = ArgumentParser(description='Measure startup time of simtrans command line interface.')
+parser.add_argument('-n', '--repeat', dest='repeat', metavar='N', type=int, default=10, help='number of runs for each case (default: 10)')
+parser.add_argument('--json', dest='json', metavar='FILE', help='write the results in JSON format')
+
+HEAVY = ['CORBA', 'collada', 'lxml', 'jinja2', 'scipy', 'stl']
+
+MODEL = '''<robot name="startup">
+  <link name="base">
+    <visual><geometry><box size="1 1 1" /></geometry></visual>
+  </link>
+  <link name="arm">
+    <visual><geometry><cylinder radius="0.1" length="1" /></geometry></visual>
+  </link>
+  <joint name="j1" type="revolute">
+    <parent link="base" />
+    <child link="arm" />
+    <axis xyz="0 0 1" />
+  </joint>
+</robot>
+'''
+
+
+def measure(args, repeat):
+    '''
+    Run the python command repeatedly and return the wall times
+    '''
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        subprocess.check_call([sys.executable] + args, stdout=subprocess.PIPE)
+        times.append(time.time() - start)
+    return times
+
+
+def summary(times):
+    times = sorted(times)
+    return {'min': times[0], 'median': times[len(times) // 2], 'max': times[-1]}
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    options = parser.parse_args(argv)
+    workdir = tempfile.mkdtemp()
+    try:
+        fname = os.path.join(workdir, 'startup.urdf')
+        with open(fname, 'w') as f:
+            f.write(MODEL)
+        cases = [
+            ('python', ['-c', 'pass']),
+            ('import', ['-c', 'import simtrans.cli']),
+            ('urdf-to-dot', ['-m', 'simtrans.cli', '-i', fname, '-o', os.path.join(workdir, 'startup.dot'), '--force'])
+        ]
+        results = {}
+        for name, args in cases:
+            results[name] = summary(measure(args, options.repeat))
+        modules = subprocess.check_output([sys.executable, '-c', 'import sys, simtrans.cli; print " ".join(sys.modules.keys())']).split()
+        results['heavymodules'] = sorted([m for m in HEAVY if m in modules])
+    finally:
+        shutil.rmtree(workdir)
+
+    print '%-12s %10s %10s %10s' % ('case', 'min[ms]', 'median[ms]', 'max[ms]')
+    for name, args in cases:
+        r = results[name]
+        print '%-12s %10.1f %10.1f %10.1f' % (name, r['min'] * 1000, r['median'] * 1000, r['max'] * 1000)
+    print 'heavy modules loaded by import: %s' % (' '.join(results['heavymodules']) or 'none')
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
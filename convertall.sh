@@ -4,34 +4,38 @@ CMD="python -m simtrans.cli"
 
 OPENHRP_MODEL="`pkg-config openhrp3.1 --variable=prefix`/share/OpenHRP-3.1/sample/model"
 
+JOBS=/tmp/simtrans-jobs.csv
+
 # fetch the drc_practice_* models from gazebo model database
 #python -m simtrans.gzfetch -f tests/models.txt
 
-# convert from urdf to wrl
-rosrun xacro xacro.py `rospack find atlas_description`/robots/atlas_v3.urdf.xacro > /tmp/atlas.urdf
-$CMD -i /tmp/atlas.urdf -o /tmp/atlas.wrl
-
-rosrun xacro xacro.py `rospack find pr2_description`/robots/pr2.urdf.xacro > /tmp/pr2.urdf
-$CMD -i /tmp/pr2.urdf -o /tmp/pr2.wrl
+echo "input,output" > $JOBS
 
-$CMD -i `rospack find ur_description`/urdf/ur10_robot.urdf -o /tmp/ur10.wrl
-
-$CMD -i `rospack find baxter_description`/urdf/baxter.urdf -o /tmp/baxter.wrl
-
-#$CMD -i `rospack find nao_description`/urdf/naoV50_generated_urdf/nao.urdf -o /tmp/nao.wrl
+# convert from urdf to wrl
+cat >> $JOBS <<EOF
+package://atlas_description/robots/atlas_v3.urdf.xacro,/tmp/atlas.wrl
+package://pr2_description/robots/pr2.urdf.xacro,/tmp/pr2.wrl
+package://ur_description/urdf/ur10_robot.urdf,/tmp/ur10.wrl
+package://baxter_description/urdf/baxter.urdf,/tmp/baxter.wrl
+#package://nao_description/urdf/naoV50_generated_urdf/nao.urdf,/tmp/nao.wrl
+EOF
 
 # convert from sdf to wrl
 for i in `cat tests/models.txt`; do
-$CMD -i model://$i/model.sdf -o /tmp/$i.wrl
+echo "model://$i/model.sdf,/tmp/$i.wrl" >> $JOBS
 done
 
 # convert from wrl to sdf
 if [ -f $HOME/HRP-4C/HRP4Cmain.wrl ]; then
-$CMD -i $HOME/HRP-4C/HRP4Cmain.wrl -o $HOME/.gazebo/models/hrp4c.world
+echo "$HOME/HRP-4C/HRP4Cmain.wrl,$HOME/.gazebo/models/hrp4c.world" >> $JOBS
 fi
-$CMD -i $OPENHRP_MODEL/PA10/pa10.main.wrl -o $HOME/.gazebo/models/pa10.world
-$CMD -i $OPENHRP_MODEL/closed-link-sample.wrl -o $HOME/.gazebo/models/closed-link-sample.world
-$CMD -i $OPENHRP_MODEL/house/house.main.wrl -o $HOME/.gazebo/models/house.world
-$CMD -i $OPENHRP_MODEL/crawler.wrl -o $HOME/.gazebo/models/crawler.world
-$CMD -i $OPENHRP_MODEL/simple_vehicle_with_camera.wrl -o $HOME/.gazebo/models/simple_vehicle_with_camera.world
-$CMD -i $OPENHRP_MODEL/simple_vehicle_with_rangesensor.wrl -o $HOME/.gazebo/models/simple_vehicle_with_rangesensor.world
+cat >> $JOBS <<EOF
+$OPENHRP_MODEL/PA10/pa10.main.wrl,$HOME/.gazebo/models/pa10.world
+$OPENHRP_MODEL/closed-link-sample.wrl,$HOME/.gazebo/models/closed-link-sample.world
+$OPENHRP_MODEL/house/house.main.wrl,$HOME/.gazebo/models/house.world
+$OPENHRP_MODEL/crawler.wrl,$HOME/.gazebo/models/crawler.world
+$OPENHRP_MODEL/simple_vehicle_with_camera.wrl,$HOME/.gazebo/models/simple_vehicle_with_camera.world
+$OPENHRP_MODEL/simple_vehicle_with_rangesensor.wrl,$HOME/.gazebo/models/simple_vehicle_with_rangesensor.world
+EOF
+
+$CMD batch $JOBS "$@"
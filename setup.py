@@ -28,7 +28,7 @@ setup(name='simtrans',
           'Programming Language :: Python :: 2.7',
           'Topic :: Software Development',
       ],
-      packages=find_packages(exclude=['tests']),
+      packages=find_packages(exclude=['tests', 'benchmarks']),
       package_data={'simtrans': ['template/*']},
       entry_points={
           'console_scripts': [
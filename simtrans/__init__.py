@@ -1,3 +1,21 @@
-from ._version import get_versions
-__version__ = get_versions()['version']
-del get_versions
+import sys
+import types
+
+
+class _Package(types.ModuleType):
+    '''
+    Package module which calculates __version__ on the first access
+    (versioneer may run git to get the version)
+    '''
+    def __getattr__(self, name):
+        if name == '__version__':
+            from ._version import get_versions
+            self.__dict__['__version__'] = get_versions()['version']
+            return self.__dict__['__version__']
+        raise AttributeError(name)
+
+_package = _Package(__name__)
+_package.__dict__.update(sys.modules[__name__].__dict__)
+# keep reference to the original module (its globals are cleared when deleted)
+_package.__dict__['_module'] = sys.modules[__name__]
+sys.modules[__name__] = _package
@@ -0,0 +1,573 @@
+# -*- coding:utf-8 -*-
+
+"""Reading and writing models inside zip and tar archives
+
+Members of the archives are addressed by the paths continuing after the
+archive file (e.g. ``/store/pr2.zip/pr2/model.sdf``), so that the paths
+relative to the document (e.g. the meshes) are joined as usual. The
+resolver and the readers open the files by :func:`open` of this module
+which reads the members without extracting the archives. Archives may
+also be given in ``GAZEBO_MODEL_PATH`` (and in ``ROS_PACKAGE_PATH`` for
+the packages bundled in archives) to resolve ``model://`` and
+``package://`` URIs.
+
+The indexes of the archives are cached until the archive files are
+modified, and the files of the archives used most recently (up to
+``MAXARCHIVES``) are kept open. Members of zip archives are read directly, while compressed tar
+archives are decompressed from the start to read the members before the
+last one read.
+
+Outputs of the writers are written to a single archive while an
+:class:`ArchiveSink` is active (see :mod:`simtrans.sink`). Each output is
+appended to the archive as soon as the writer closes it, so the archive is
+streamed to the file (or to the given file object for tar archives) as the
+conversion goes on.
+
+:Organization:
+ AIST
+
+Examples
+--------
+
+Read the model in the zip archive
+
+>>> import tempfile, zipfile, shutil, numpy
+>>> from . import model, stl, urdf
+>>> d = tempfile.mkdtemp()
+>>> s = model.ShapeModel()
+>>> s.data = model.MeshData()
+>>> s.data.vertex = numpy.array([[0, 0, 0], [1, 0, 0], [0, 1, 0]], dtype=float)
+>>> s.data.vertex_index = numpy.array([[0, 1, 2]])
+>>> mesh = io.BytesIO()
+>>> stl.STLWriter().write(s, mesh)
+>>> with zipfile.ZipFile(os.path.join(d, 'robot.zip'), 'w') as z:
+...     z.writestr('robot/package.xml', '<package/>')
+...     z.writestr('robot/meshes/base.stl', mesh.getvalue())
+...     z.writestr('robot/urdf/robot.urdf', '''<robot name="robot"><link name="base"><visual>
+...       <geometry><mesh filename="package://robot/meshes/base.stl"/></geometry>
+...     </visual></link></robot>''')
+>>> fname = document(os.path.join(d, 'robot.zip'))
+>>> fname.endswith('robot.zip/robot/urdf/robot.urdf')
+True
+>>> os.environ['ROS_PACKAGE_PATH'] = os.path.join(d, 'robot.zip')
+>>> m = urdf.URDFReader().read(fname)
+>>> m.links[0].visuals[0].data.vertex_index.shape
+(1, 3)
+
+Write the model in the tar archive
+
+>>> with ArchiveSink(os.path.join(d, 'out.tar.gz')) as output:
+...     with output.activate():
+...         urdf.URDFWriter().write(m, os.path.join(d, 'out.tar.gz', 'robot.urdf'))
+>>> sorted([os.path.splitext(n)[1] for n in names(os.path.join(d, 'out.tar.gz'))])
+['.dae', '.stl', '.urdf']
+>>> n = [n for n in names(os.path.join(d, 'out.tar.gz')) if n.endswith('.stl')][0]
+>>> stl.STLReader().read(os.path.join(d, 'out.tar.gz', n)).vertex.shape
+(3, 3)
+>>> del os.environ['ROS_PACKAGE_PATH']
+
+Outputs cannot be written twice to the archive
+
+>>> try:
+...     with ArchiveSink(os.path.join(d, 'twice.zip')) as output:
+...         for i in range(2):
+...             with output.open(os.path.join(d, 'twice.zip', 'a.txt')) as f:
+...                 f.write('a')
+... except Exception, e:
+...     print str(e).endswith('twice.zip: a.txt')
+True
+>>> os.path.exists(os.path.join(d, 'twice.zip'))
+False
+
+Files of the archives are kept open up to MAXARCHIVES (archives closed
+in the cache are still read)
+
+>>> for i in range(MAXARCHIVES + 36):
+...     with zipfile.ZipFile(os.path.join(d, 'm%i.zip' % i), 'w') as z:
+...         z.writestr('m/model.config', 'm%i' % i)
+>>> clear()
+>>> fds = len(os.listdir('/proc/self/fd'))
+>>> [open(os.path.join(d, 'm%i.zip' % i, 'm/model.config')).read() for i in range(MAXARCHIVES + 36)][-1]
+'m99'
+>>> len(os.listdir('/proc/self/fd')) - fds <= MAXARCHIVES, stats()['archives']
+(True, 64)
+>>> open(os.path.join(d, 'm0.zip', 'm/model.config')).read()
+'m0'
+>>> clear()
+>>> len(os.listdir('/proc/self/fd')) == fds
+True
+>>> shutil.rmtree(d)
+"""
+
+import os
+import io
+import time
+import hashlib
+import tarfile
+import zipfile
+import threading
+import collections
+import __builtin__
+from . import sink
+
+#: Extensions of the archive files
+ARCHIVES = ['.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2']
+
+#: Extensions of the model documents looked up in the archives (in order of preference)
+DOCUMENTS = ['.world', '.sdf', '.urdf', '.xacro', '.wrl']
+
+MAXARCHIVES = 64  #: Maximum number of archives kept open in the cache
+
+_compressions = {'.tar': '', '.tar.gz': 'gz', '.tgz': 'gz', '.tar.bz2': 'bz2', '.tbz2': 'bz2'}
+
+_lock = threading.Lock()
+_archives = collections.OrderedDict()
+_counts = {'hits': 0, 'misses': 0}
+
+_Stat = collections.namedtuple('_Stat', ['st_mtime', 'st_size'])
+
+
+def archiveext(fname):
+    '''
+    Get the extension of the archive file (None if not an archive)
+
+    >>> archiveext('/tmp/pr2.tar.gz'), archiveext('/tmp/pr2.sdf')
+    ('.tar.gz', None)
+    '''
+    lower = fname.lower()
+    for e in sorted(ARCHIVES, key=len, reverse=True):
+        if lower.endswith(e):
+            return e
+    return None
+
+
+def split(path):
+    '''
+    Split the path into the archive file and the member in it (member is
+    None if the path is not in an archive)
+
+    >>> split('/tmp/pr2.zip/pr2/meshes/../model.sdf')
+    ('/tmp/pr2.zip', 'pr2/model.sdf')
+    >>> split('/tmp/pr2.zip')
+    ('/tmp/pr2.zip', '')
+    >>> split('/tmp/pr2.sdf')
+    ('/tmp/pr2.sdf', None)
+    '''
+    parts = path.split('/')
+    for i in range(len(parts)):
+        if archiveext(parts[i]) is None:
+            continue
+        fname = '/'.join(parts[:i + 1])
+        if os.path.isdir(fname):
+            continue
+        member = os.path.normpath('/'.join(parts[i + 1:]))
+        if member.startswith('..'):
+            return split(os.path.normpath(path))
+        return fname, '' if member == '.' else member
+    return path, None
+
+
+def isarchive(fname):
+    '''
+    Check whether the file is an archive
+    '''
+    return archiveext(fname) is not None and os.path.isfile(fname)
+
+
+def ismember(path):
+    '''
+    Check whether the path refers to a member of an archive
+    '''
+    return bool(split(path)[1])
+
+
+class _Archive(object):
+    '''
+    Index of the members of the archive (members of a directory are also
+    listed as directories)
+    '''
+    def __init__(self, fname):
+        self.fname = fname
+        self.members = collections.OrderedDict()   #: Members (name: size)
+        self.dirs = set([''])
+        self.mtime = os.path.getmtime(fname)
+        self._lock = threading.Lock()
+        self._file = None
+
+    def _add(self, name, size, isdir=False):
+        name = os.path.normpath(name)
+        if isdir:
+            self.dirs.add(name)
+        else:
+            self.members[name] = size
+        while name:
+            name = os.path.dirname(name)
+            self.dirs.add(name)
+
+    def read(self, name):
+        with self._lock:
+            # archives removed from the cache are opened for each read
+            f = self._file or self._open()
+            try:
+                return self._read(f, name)
+            finally:
+                if f is not self._file:
+                    f.close()
+
+    def close(self):
+        '''
+        Close the file of the archive (the index is kept)
+        '''
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class _ZipArchive(_Archive):
+    def __init__(self, fname):
+        _Archive.__init__(self, fname)
+        self._file = self._open()
+        self._infos = {}
+        for i in self._file.infolist():
+            if i.filename.endswith('/'):
+                self._add(i.filename, 0, True)
+                continue
+            self._add(i.filename, i.file_size)
+            self._infos[os.path.normpath(i.filename)] = i
+
+    def _open(self):
+        return zipfile.ZipFile(self.fname)
+
+    def _read(self, f, name):
+        return f.read(self._infos[name])
+
+
+class _TarArchive(_Archive):
+    def __init__(self, fname):
+        _Archive.__init__(self, fname)
+        self._file = self._open()
+        self._infos = {}
+        for i in self._file.getmembers():
+            if i.isdir():
+                self._add(i.name, 0, True)
+            elif i.isfile():
+                self._add(i.name, i.size)
+                self._infos[os.path.normpath(i.name)] = i
+
+    def _open(self):
+        return tarfile.open(self.fname, 'r:*')
+
+    def _read(self, f, name):
+        return f.extractfile(self._infos[name]).read()
+
+
+def _index(fname):
+    st = os.stat(fname)
+    key = (st.st_mtime, st.st_size, st.st_ino)
+    fname = os.path.abspath(fname)
+    with _lock:
+        try:
+            k, a = _archives[fname]
+            if k == key:
+                _counts['hits'] += 1
+                # most recently used at the end
+                _archives[fname] = _archives.pop(fname)
+                return a
+        except KeyError:
+            pass
+    if archiveext(fname) == '.zip':
+        a = _ZipArchive(fname)
+    else:
+        a = _TarArchive(fname)
+    evicted = []
+    with _lock:
+        _counts['misses'] += 1
+        previous = _archives.pop(fname, None)
+        if previous is not None:
+            evicted.append(previous[1])
+        _archives[fname] = (key, a)
+        while len(_archives) > MAXARCHIVES:
+            evicted.append(_archives.popitem(last=False)[1][1])
+    for e in evicted:
+        e.close()
+    return a
+
+
+class _Member(io.BytesIO):
+    '''
+    Contents of the member read from the archive
+    '''
+    def __init__(self, data, name):
+        io.BytesIO.__init__(self, data)
+        self.name = name
+
+
+def open(path, mode='rb'):
+    '''
+    Open the file (or the member of the archive) to read
+    '''
+    fname, member = split(path)
+    if not member:
+        return __builtin__.open(path, mode)
+    if mode not in ['r', 'rb']:
+        raise Exception('members of the archive are read only: %s' % path)
+    a = _index(fname)
+    if member not in a.members:
+        raise IOError('no such member in the archive: %s' % path)
+    return _Member(a.read(member), path)
+
+
+def exists(path):
+    '''
+    Check whether the file, directory or the member of the archive exists
+    '''
+    fname, member = split(path)
+    if not member:
+        return os.path.exists(path)
+    try:
+        a = _index(fname)
+    except (OSError, IOError):
+        return False
+    return member in a.members or member in a.dirs
+
+
+def stat(path):
+    '''
+    Get modification time and size of the file (the modification time of
+    the archive for the members)
+    '''
+    fname, member = split(path)
+    if not member:
+        return os.stat(path)
+    a = _index(fname)
+    try:
+        return _Stat(a.mtime, a.members[member])
+    except KeyError:
+        raise OSError('no such member in the archive: %s' % path)
+
+
+def names(fname):
+    '''
+    Get the names of the members of the archive
+    '''
+    return _index(fname).members.keys()
+
+
+def document(fname):
+    '''
+    Find the model document in the archive (given by model.config or the
+    shallowest file of the model formats) and return the path of it
+    '''
+    import lxml.etree
+    candidates = []
+    for n in names(fname):
+        depth = n.count('/')
+        if os.path.basename(n) == 'model.config':
+            config = lxml.etree.parse(open(os.path.join(fname, n)))
+            sdf = config.find('sdf')
+            if sdf is not None and sdf.text:
+                candidates.append((depth, -1, os.path.join(os.path.dirname(n), sdf.text.strip())))
+            continue
+        for i, e in enumerate(DOCUMENTS):
+            if n.lower().endswith(e):
+                candidates.append((depth, i, n))
+    if len(candidates) == 0:
+        raise Exception('no model found in the archive: %s' % fname)
+    return os.path.join(fname, min(candidates)[2])
+
+
+def outputdocument(fname, fmt):
+    '''
+    Get the path of the document to write the model in the format to the
+    archive (SDF models are written in the model directory)
+
+    >>> outputdocument('/tmp/pr2.zip', 'sdf')
+    '/tmp/pr2.zip/pr2/model.sdf'
+    >>> outputdocument('/tmp/pr2.tar.gz', 'urdf')
+    '/tmp/pr2.tar.gz/pr2.urdf'
+    '''
+    name = os.path.basename(fname)[0:-len(archiveext(fname))]
+    if fmt == 'sdf':
+        return os.path.join(fname, name, 'model.sdf')
+    exts = {'urdf': '.urdf', 'vrml': '.wrl', 'dot': '.dot'}
+    if fmt not in exts:
+        raise Exception('unable to name the document of the format in the archive: %s' % fmt)
+    return os.path.join(fname, name + exts[fmt])
+
+
+def stats():
+    '''
+    Get statistics of the cache of the archive indexes
+    '''
+    with _lock:
+        return {'archives': len(_archives), 'hits': _counts['hits'], 'misses': _counts['misses']}
+
+
+def clear():
+    '''
+    Clear the cache of the archive indexes
+    '''
+    with _lock:
+        archives = [a for k, a in _archives.values()]
+        _archives.clear()
+        _counts['hits'] = 0
+        _counts['misses'] = 0
+    for a in archives:
+        a.close()
+
+
+class _Entry(sink.Buffer):
+    '''
+    Output appended to the archive when it is closed
+    '''
+    def __init__(self, archive, name):
+        sink.Buffer.__init__(self, name)
+        self._archive = archive
+
+    def close(self):
+        if not self.closed:
+            sink.Buffer.close(self)
+            self._archive._append(self)
+
+
+class _Chunks(object):
+    '''
+    File object reading the chunks of the output (passed to tarfile)
+    '''
+    def __init__(self, chunks):
+        self._chunks = collections.deque(chunks)
+        self._data = ''
+        self._pos = 0
+
+    def read(self, size=-1):
+        parts = []
+        while size != 0:
+            if self._pos >= len(self._data):
+                if len(self._chunks) == 0:
+                    break
+                c = self._chunks.popleft()
+                self._data = c if isinstance(c, str) else c.tobytes()
+                self._pos = 0
+                continue
+            n = len(self._data) - self._pos
+            if size > 0:
+                n = min(n, size)
+                size = size - n
+            parts.append(self._data[self._pos:self._pos + n])
+            self._pos = self._pos + n
+        return ''.join(parts)
+
+
+class ArchiveSink(sink.DirectorySink):
+    '''
+    Sink writing the outputs to the archive (the outputs are named
+    relative to the archive file, e.g. ``/tmp/pr2.zip/pr2/model.sdf``)
+
+    The archive is written to a temporary file next to it and renamed
+    when the sink is closed, unless the file object to write is given
+    (zip archives need a seekable file object).
+    '''
+    local = False
+
+    def __init__(self, fname, fileobj=None):
+        '''
+        :param fname: path of the archive file
+        :param fileobj: file object to write the archive to (optional)
+        '''
+        self.ext = archiveext(fname)
+        if self.ext is None:
+            raise Exception('unsupported archive format: %s' % fname)
+        self.fname = os.path.abspath(fname)
+        self._fileobj = fileobj
+        self._file = None
+        self._archive = None
+        self._digests = {}
+        self._lock = threading.Lock()
+
+    def _name(self, fname):
+        name = os.path.relpath(os.path.abspath(fname), self.fname)
+        if name.startswith('..') or name == '.':
+            raise Exception('output is outside of the archive %s: %s' % (self.fname, fname))
+        return name
+
+    def open(self, fname, mode='w'):
+        if mode not in ['w', 'wb']:
+            raise Exception('unsupported mode: %s' % mode)
+        return _Entry(self, self._name(fname))
+
+    def makedirs(self, dirname):
+        pass
+
+    def digest(self, fname):
+        try:
+            return self._digests[self._name(fname)]
+        except KeyError:
+            raise Exception('no such output: %s' % fname)
+
+    def _open(self):
+        # the archive is created when the first output is written
+        self._file = self._fileobj or __builtin__.open(self.fname + '.part', 'wb')
+        if self.ext == '.zip':
+            self._archive = zipfile.ZipFile(self._file, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+        else:
+            self._archive = tarfile.open(fileobj=self._file, mode='w|' + _compressions[self.ext])
+
+    def _append(self, entry):
+        h = hashlib.sha1()
+        for c in entry.chunks:
+            h.update(c)
+        with self._lock:
+            if entry.name in self._digests:
+                # members cannot be replaced in the streamed archive
+                raise Exception('output is written twice to the archive %s: %s' % (self.fname, entry.name))
+            if self._archive is None:
+                self._open()
+            if self.ext == '.zip':
+                info = zipfile.ZipInfo(entry.name, time.localtime()[0:6])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                info.external_attr = 0644 << 16
+                self._archive.writestr(info, _Chunks(entry.chunks).read())
+            else:
+                info = tarfile.TarInfo(entry.name)
+                info.size = entry.size
+                info.mtime = time.time()
+                info.mode = 0644
+                self._archive.addfile(info, _Chunks(entry.chunks))
+            self._digests[entry.name] = h.hexdigest()
+
+    def close(self):
+        '''
+        Finish writing the archive (the archive is not written if no output
+        is written)
+        '''
+        with self._lock:
+            if self._archive is None:
+                return
+            self._archive.close()
+            self._archive = None
+            if self._fileobj is None:
+                self._file.close()
+                os.rename(self.fname + '.part', self.fname)
+
+    def abort(self):
+        '''
+        Stop writing the archive and remove the temporary file
+        '''
+        with self._lock:
+            if self._archive is None:
+                return
+            self._archive = None
+            if self._fileobj is None:
+                self._file.close()
+                os.unlink(self.fname + '.part')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
@@ -0,0 +1,242 @@
+# -*- coding:utf-8 -*-
+
+"""Batch conversion of the models listed in a job file
+
+The conversions are scheduled across a process pool. Caches (package
+paths, templates and meshes) are kept in each worker process and shared
+by the jobs assigned to the worker.
+
+:Organization:
+ AIST
+
+Requirements
+------------
+* pyyaml (optional, to read job files in YAML format)
+
+Examples
+--------
+
+Read jobs from CSV file (header line is optional)
+
+>>> import tempfile
+>>> fd, fname = tempfile.mkstemp(suffix='.csv')
+>>> os.write(fd, 'input,output,format\\n/tmp/pr2.urdf,/tmp/pr2.wrl,vrml\\n# comment\\n/tmp/ur10.urdf,/tmp/ur10.world\\n')
+93
+>>> os.close(fd)
+>>> jobs = readjobs(fname)
+>>> [(j['input'], j['output'], j.get('format')) for j in jobs]
+[('/tmp/pr2.urdf', '/tmp/pr2.wrl', 'vrml'), ('/tmp/ur10.urdf', '/tmp/ur10.world', None)]
+>>> os.unlink(fname)
+
+Arguments passed to the converter
+
+>>> jobargs({'input': '/tmp/pr2.urdf', 'output': '/tmp/pr2.wrl', 'options': '--force'}, ['-v'])
+['-i', '/tmp/pr2.urdf', '-o', '/tmp/pr2.wrl', '--force', '-v']
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import shlex
+import traceback
+import multiprocessing
+from StringIO import StringIO
+from argparse import ArgumentParser
+try:
+    import yaml
+except ImportError:
+    yaml = None
+from . import profiling
+from . import tracing
+
+parser = ArgumentParser(prog='simtrans batch', description='Convert robot simulation models listed in the job file.')
+parser.add_argument('jobfile', metavar='FILE', help='job file (json, csv or yaml) listing input, output and format of each conversion')
+parser.add_argument('-j', '--jobs', dest='jobs', metavar='N', type=int, default=multiprocessing.cpu_count(), help='number of worker processes (default: number of cpus)')
+parser.add_argument('--profile', dest='profile', metavar='JSON', nargs='?', const='', help='show total time of each conversion stage and counters of all the jobs (and save them to JSON file)')
+parser.add_argument('--trace', dest='trace', metavar='JSON', help='save spans of the conversion stages of all the jobs to JSON file in Chrome trace event format')
+parser.add_argument('-v', '--verbose', action='store_true', dest='verbose', default=False, help='show output of each conversion')
+
+_fields = ['input', 'output', 'format']
+
+
+def _expand(path):
+    return os.path.expandvars(os.path.expanduser(path))
+
+
+def readjobs(fname):
+    '''
+    Read list of jobs from the job file
+
+    Each job is a dict which has "input", "output" and optional "format"
+    (output format), "from" (input format) and "options" (additional
+    command line options) keys.
+    '''
+    ext = os.path.splitext(fname)[1].lower()
+    if ext == '.csv':
+        with open(fname) as f:
+            rows = [r for r in csv.reader(f) if len(r) > 0 and not r[0].startswith('#')]
+        header = _fields
+        if len(rows) > 0 and 'input' in rows[0]:
+            header = [h.strip() for h in rows.pop(0)]
+        jobs = []
+        for r in rows:
+            jobs.append(dict([(k, v.strip()) for k, v in zip(header, r) if len(v.strip()) > 0]))
+    elif ext in ['.yaml', '.yml']:
+        if yaml is None:
+            raise Exception('pyyaml is required to read job file: %s' % fname)
+        with open(fname) as f:
+            jobs = yaml.safe_load(f)
+    elif ext == '.json':
+        with open(fname) as f:
+            jobs = json.load(f)
+    else:
+        raise Exception('unsupported job file format: %s' % ext)
+    if isinstance(jobs, dict):
+        jobs = jobs['jobs']
+    for j in jobs:
+        if 'input' not in j or 'output' not in j:
+            raise Exception('input and output should be specified for each job: %s' % j)
+        j['input'] = _expand(j['input'])
+        j['output'] = _expand(j['output'])
+    return jobs
+
+
+def jobargs(job, extra=[]):
+    '''
+    Build command line arguments of the converter for the job
+    '''
+    args = ['-i', job['input'], '-o', job['output']]
+    if job.get('format'):
+        args.extend(['-t', job['format']])
+    if job.get('from'):
+        args.extend(['-f', job['from']])
+    if job.get('options'):
+        args.extend(shlex.split(job['options']))
+    return args + list(extra)
+
+
+def runjob(params):
+    '''
+    Run single conversion job (in the worker process) and return the result
+    '''
+    from . import cli
+    job, extra, profile, trace = params
+    return runconvert(lambda: cli.parser.parse_args(jobargs(job, extra)), job['input'], job['output'], profile, trace)
+
+
+def runconvert(getoptions, input, output, profile=False, trace=False):
+    '''
+    Run the conversion capturing its output and return the result
+
+    :param getoptions: function returning the parsed options of the conversion
+    :param input: input of the conversion (to be reported)
+    :param output: output of the conversion (to be reported)
+    '''
+    from . import cli
+    result = {'input': input, 'output': output, 'status': 'failed', 'message': ''}
+    profiler = profiling.Profiler()
+    tracer = tracing.Tracer()
+    log = StringIO()
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = log
+    start = time.time()
+    try:
+        try:
+            options = getoptions()
+            if profile or trace:
+                with profiler.activate():
+                    with tracer.activate():
+                        with profiling.stage('convert'):
+                            tracing.annotate(input=input, output=output)
+                            ret = cli.convert(options)
+            else:
+                ret = cli.convert(options)
+            if ret == 0:
+                result['status'] = 'ok'
+        except SystemExit:
+            pass
+        except Exception:
+            traceback.print_exc()
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+    result['time'] = time.time() - start
+    result['message'] = log.getvalue()
+    if profile:
+        result['profile'] = profiler.todict()
+    if trace:
+        result['trace'] = tracer.tochrome()
+    return result
+
+
+def runjobs(jobs, processes=1, extra=[], profile=False, trace=False):
+    '''
+    Run the jobs and yield the results in order of completion
+    (results include the profile and the trace of each job if requested)
+    '''
+    params = [(j, extra, profile, trace) for j in jobs]
+    return runpool(runjob, params, processes)
+
+
+def runpool(func, params, processes=1):
+    '''
+    Call the function with each of the parameters in a pool of worker
+    processes and yield the results in order of completion
+    '''
+    if processes <= 1 or len(params) <= 1:
+        for p in params:
+            yield func(p)
+        return
+    pool = multiprocessing.Pool(processes=min(processes, len(params)))
+    try:
+        for r in pool.imap_unordered(func, params):
+            yield r
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    options, extra = parser.parse_known_args(argv)
+    try:
+        jobs = readjobs(options.jobfile)
+    except Exception, e:
+        print >> sys.stderr, 'unable to read job file: %s' % e
+        return 1
+
+    start = time.time()
+    failed = 0
+    profiler = profiling.Profiler()
+    tracer = tracing.Tracer()
+    for r in runjobs(jobs, options.jobs, extra, options.profile is not None, options.trace is not None):
+        if 'profile' in r:
+            profiler.merge(r['profile'])
+        if 'trace' in r:
+            tracer.merge(r['trace'])
+        if r['status'] != 'ok':
+            failed = failed + 1
+        print '[%s] %.2fs %s -> %s' % (r['status'], r['time'], r['input'], r['output'])
+        if options.verbose or r['status'] != 'ok':
+            for l in r['message'].splitlines():
+                print '    ' + l
+        sys.stdout.flush()
+    print '%i jobs, %i succeeded, %i failed in %.2fs' % (len(jobs), len(jobs) - failed, failed, time.time() - start)
+    if options.profile is not None:
+        print profiler.report()
+        if options.profile:
+            with open(options.profile, 'w') as f:
+                json.dump(profiler.todict(), f, indent=2, sort_keys=True)
+    if options.trace:
+        tracer.save(options.trace)
+    if failed > 0:
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,181 @@
+# -*- coding:utf-8 -*-
+
+"""Process wide caches shared by the conversions in the same process
+
+Package paths, template environment and mesh data are cached so that
+batch conversions do not pay for them on every job.
+
+:Organization:
+ AIST
+
+Requirements
+------------
+* jinja2 template engine
+
+Examples
+--------
+
+Template environment is shared
+
+>>> environment() is environment()
+True
+
+Mesh files are read only once until they are modified
+
+>>> import tempfile
+>>> class CountReader(object):
+...     count = 0
+...     def read(self, f, assethandler=None):
+...         CountReader.count += 1
+...         return open(f).read()
+>>> fd, fname = tempfile.mkstemp()
+>>> os.write(fd, 'mesh')
+4
+>>> os.close(fd)
+>>> readmesh(CountReader(), fname)
+'mesh'
+>>> readmesh(CountReader(), fname)
+'mesh'
+>>> CountReader.count
+1
+>>> stats()['meshhits']
+1
+>>> clear()
+>>> readmesh(CountReader(), fname)
+'mesh'
+>>> CountReader.count
+2
+>>> os.unlink(fname)
+"""
+
+import os
+import threading
+import collections
+from . import profiling
+from . import tracing
+from . import memory
+from . import pipeline
+from . import archive
+
+MAXMESHES = 256  #: Maximum number of mesh data kept in the cache
+
+_lock = threading.RLock()
+_packages = {}
+_meshes = collections.OrderedDict()
+_reading = {}
+_environment = []
+_counts = {'hits': 0, 'misses': 0}
+
+
+def packagepath(name):
+    '''
+    Find path of the ROS package (result of rospack is cached)
+    '''
+    with _lock:
+        try:
+            return _packages[name]
+        except KeyError:
+            pass
+    with profiling.stage('rospack', name):
+        path = pipeline.checkoutput(['rospack', 'find', name]).rstrip()
+    with _lock:
+        _packages[name] = path
+    return path
+
+
+def environment():
+    '''
+    Get jinja2 environment to load the templates (compiled templates are
+    cached in the environment)
+    '''
+    with _lock:
+        if len(_environment) == 0:
+            import jinja2
+
+            class Template(jinja2.Template):
+                def render(self, *args, **kwargs):
+                    with profiling.stage('render template', self.name):
+                        return jinja2.Template.render(self, *args, **kwargs)
+
+                def generate(self, *args, **kwargs):
+                    # used by stream() (measured time includes writing the output)
+                    with profiling.stage('render template', self.name):
+                        for s in jinja2.Template.generate(self, *args, **kwargs):
+                            yield s
+
+            loader = jinja2.PackageLoader(__name__, 'template')
+            env = jinja2.Environment(loader=loader)
+            env.template_class = Template
+            _environment.append(env)
+        return _environment[0]
+
+
+def readmesh(reader, fname, assethandler=None, **kwargs):
+    '''
+    Read mesh file using the reader unless the same file is already read
+    (mesh data returned from the cache is shared and should not be modified,
+    meshes are not cached while the memory limit is active)
+
+    :param reader: mesh reader (ColladaReader, STLReader)
+    :param fname: path of the mesh file
+    :param assethandler: asset handler passed to the reader
+    '''
+    if memory.streaming():
+        with profiling.stage('read mesh', fname):
+            return reader.read(fname, assethandler=assethandler, **kwargs)
+    st = archive.stat(fname)
+    key = (reader.__class__, os.path.abspath(fname), st.st_mtime, st.st_size,
+           assethandler, tuple(sorted(kwargs.items())))
+    while True:
+        with _lock:
+            try:
+                data = _meshes.pop(key)
+                _meshes[key] = data
+                _counts['hits'] += 1
+                profiling.count('mesh cache hits')
+                return data
+            except KeyError:
+                pass
+            reading = _reading.get(key)
+            if reading is None:
+                reading = _reading[key] = threading.Event()
+                break
+        # the same file is being read in another thread
+        reading.wait()
+    try:
+        with profiling.stage('read mesh', fname):
+            data = reader.read(fname, assethandler=assethandler, **kwargs)
+            if tracing.current() is not None:
+                from .decimate import counttriangles
+                tracing.annotate(triangles=counttriangles(data))
+        with _lock:
+            _counts['misses'] += 1
+            _meshes[key] = data
+            while len(_meshes) > MAXMESHES:
+                _meshes.popitem(last=False)
+    finally:
+        with _lock:
+            del _reading[key]
+        reading.set()
+    return data
+
+
+def stats():
+    '''
+    Get statistics of the caches
+    '''
+    with _lock:
+        return {'packages': len(_packages), 'meshes': len(_meshes),
+                'meshhits': _counts['hits'], 'meshmisses': _counts['misses']}
+
+
+def clear():
+    '''
+    Clear all the caches
+    '''
+    with _lock:
+        _packages.clear()
+        _meshes.clear()
+        del _environment[:]
+        _counts['hits'] = 0
+        _counts['misses'] = 0
@@ -1,18 +1,159 @@
 # -*- coding:utf-8 -*-
 
 """Utility command to concatinate two or more xml files to one
+
+The children of the root elements of the files are appended to the root
+element of the first file (or the elements at the given level are
+appended to the parent element in the first file, e.g. the models of SDF
+worlds to the world of the first file). The files are read by iterparse
+and the elements are written one by one as soon as they are parsed, so
+that memory usage does not grow with the size of the files.
+
+:Organization:
+ AIST
+
+Examples
+--------
+
+Concatenate the files skipping the elements of the same tag and name
+
+>>> import tempfile
+>>> from StringIO import StringIO
+>>> d = tempfile.mkdtemp()
+>>> with open(os.path.join(d, 'a.world'), 'w') as f:
+...     f.write('<world name="a"><model name="box"/><!-- light --><light name="sun"/></world>')
+>>> with open(os.path.join(d, 'b.world'), 'w') as f:
+...     f.write('<world name="b"><model name="box"/><model name="ball"/><include/></world>')
+>>> out = StringIO()
+>>> concatenate([os.path.join(d, 'a.world'), os.path.join(d, 'b.world')], out, unique=True)
+1
+>>> print out.getvalue()
+<world name="a">
+<model name="box"/>
+<!-- light -->
+<light name="sun"/>
+<model name="ball"/>
+<include/>
+</world>
+
+Merge the worlds of SDF files
+
+>>> with open(os.path.join(d, 'c.world'), 'w') as f:
+...     f.write('<sdf><world name="c"><model name="box"/></world></sdf>')
+>>> with open(os.path.join(d, 'd.world'), 'w') as f:
+...     f.write('<sdf><world name="d"><model name="ball"/></world></sdf>')
+>>> out = StringIO()
+>>> concatenate([os.path.join(d, 'c.world'), os.path.join(d, 'd.world')], out, level=2)
+0
+>>> print out.getvalue()
+<sdf>
+<world name="c">
+<model name="box"/>
+<model name="ball"/>
+</world>
+</sdf>
+>>> import shutil
+>>> shutil.rmtree(d)
 """
 
+import os
 import sys
 from optparse import OptionParser, OptionError
 import lxml.etree
 from . import utils
 
 
+def iterchildren(fname, level=1, ancestors=None):
+    '''
+    Generate the elements (and comments) at the level of the xml file one
+    by one (each element is cleared after the next one is generated)
+
+    :param fname: path of the xml file
+    :param level: level of the elements (1 for the children of the root element)
+    :param ancestors: list to which the elements above the level (without children) are appended when they are parsed
+    '''
+    depth = 0
+    previous = None
+    for event, e in lxml.etree.iterparse(fname, events=('start', 'end', 'comment'), huge_tree=True):
+        if event == 'start':
+            depth = depth + 1
+            if depth <= level and ancestors is not None and len(ancestors) < depth:
+                ancestors.append(e)
+            continue
+        if event == 'end':
+            depth = depth - 1
+        if depth != level:
+            continue
+        if previous is not None:
+            # release the elements already written
+            previous.clear()
+            parent = previous.getparent()
+            while parent is not None and len(parent) > 0 and parent[0] is not e:
+                del parent[0]
+        yield e
+        previous = e
+
+
+def concatenate(fnames, output, unique=False, level=1):
+    '''
+    Concatenate the xml files writing the elements incrementally and
+    return the number of elements skipped
+
+    :param fnames: paths of the xml files
+    :param output: path or file object to write
+    :param unique: skip the elements of the same tag and name as the elements already written
+    :param level: level of the elements concatenated (e.g. 2 to merge the worlds of SDF files into the world of the first file)
+    '''
+    seen = set()
+    skipped = [0]
+    ancestors = []
+    first = iterchildren(utils.resolveFile(fnames[0]), level, ancestors)
+    head = next(first, None)
+    sources = [first] + [iterchildren(utils.resolveFile(f), level) for f in fnames[1:]]
+    if head is not None:
+        sources[0] = _prepend(head, first)
+
+    def write(xf):
+        for children in sources:
+            for e in children:
+                if isinstance(e.tag, basestring) and unique and e.get('name') is not None:
+                    key = (e.tag, e.get('name'))
+                    if key in seen:
+                        skipped[0] = skipped[0] + 1
+                        continue
+                    seen.add(key)
+                xf.write(e, with_tail=False)
+                xf.write('\n')
+
+    with lxml.etree.xmlfile(output) as xf:
+        _writein(xf, ancestors, write)
+    return skipped[0]
+
+
+def _writein(xf, ancestors, write):
+    if len(ancestors) == 0:
+        return write(xf)
+    e = ancestors[0]
+    with xf.element(e.tag, dict(e.attrib), nsmap=e.nsmap):
+        xf.write('\n')
+        _writein(xf, ancestors[1:], write)
+        if len(ancestors) > 1:
+            xf.write('\n')
+
+
+def _prepend(head, children):
+    yield head
+    for e in children:
+        yield e
+
+
 def main():
     usage = '''Usage: %prog [options] xmlfile1 xmlfile2 ...
 Concatinate multiple xml files.'''
     parser = OptionParser(usage=usage)
+    parser.add_option('-o', '--output', dest='output', metavar='FILE', help='write to FILE instead of stdout')
+    parser.add_option('-l', '--level', dest='level', metavar='N', type='int', default=1, help='concatenate elements at level N (default: 1 for children of the root, 2 to merge SDF worlds)')
+    parser.add_option('-u', '--unique', action='store_true', dest='unique', default=False, help='skip elements of the same tag and name as the elements already written')
     parser.add_option('-v', '--verbose', action='store_true', dest='verbose', default=False, help='verbose output')
     try:
         options, args = parser.parse_args()
@@ -25,13 +166,9 @@ Concatinate multiple xml files.'''
         print >> sys.stderr, parser.print_help()
         return 1
 
-    d = lxml.etree.parse(utils.resolveFile(args[0]))
-    r = d.getroot()
-    for f in args[1:]:
-        d2 = lxml.etree.parse(utils.resolveFile(f))
-        r.extend(d2.getroot())
-
-    print(lxml.etree.tostring(r, pretty_print=True))
+    skipped = concatenate(args, options.output or sys.stdout, options.unique, options.level)
+    if options.verbose and options.unique:
+        print >> sys.stderr, 'skipped %i duplicated elements' % skipped
 
     return 0
 
@@ -1,99 +1,385 @@
 # -*- coding:utf-8 -*-
 
 """simtrans command line interface
+
+Examples
+--------
+
+Simplify the mesh of one shape named by LINK/NAME
+
+>>> import tempfile, shutil, StringIO, lxml.etree
+>>> from . import model, stl, decimate
+>>> d = tempfile.mkdtemp()
+>>> for i in [1, 2]:
+...     m = model.ShapeModel()
+...     m.shapeType = model.ShapeModel.SP_MESH
+...     m.data = decimate.grid(16)
+...     stl.STLWriter().write(m, os.path.join(d, 'mesh%i.stl' % i))
+>>> with open(os.path.join(d, 'robot.urdf'), 'w') as f:
+...     f.write('''<robot name="robot">
+...   <link name="l1"><visual><geometry><mesh filename="%s/mesh1.stl"/></geometry></visual></link>
+...   <link name="l2"><visual><geometry><mesh filename="%s/mesh2.stl"/></geometry></visual></link>
+...   <joint name="j1" type="fixed"><parent link="l1"/><child link="l2"/></joint>
+... </robot>''' % (d, d))
+>>> os.mkdir(os.path.join(d, 'out'))
+>>> stdout, sys.stdout = sys.stdout, StringIO.StringIO()
+>>> ret = main(['-i', os.path.join(d, 'robot.urdf'), '-o', os.path.join(d, 'out', 'robot.urdf'),
+...             '--mesh-format', 'glb', '--shape-budget', 'l1/visual0=8'])
+>>> sys.stdout = stdout
+>>> ret
+0
+>>> for l in lxml.etree.parse(os.path.join(d, 'out', 'robot.urdf')).findall('link'):
+...     fname = os.path.join(d, 'out', os.path.basename(l.find('collision/geometry/mesh').attrib['filename']))
+...     print l.attrib['name'], decimate.counttriangles(stl.STLReader().read(fname))
+l1 8
+l2 512
+>>> shutil.rmtree(d)
+
+Profiling and tracing are not available for the conversions on the server
+
+>>> main(['-i', 'robot.urdf', '-o', 'robot.wrl', '--remote', '--profile'])
+1
 """
 
 import os
 import sys
+import json
+import time
 import subprocess
 from argparse import ArgumentParser, ArgumentError
 
-from . import vrml
-from . import urdf
-from . import sdf
-from . import graphviz
+from . import registry
+from . import manifest
+from . import profiling
+from . import tracing
+from . import memory
+from . import stream
+from . import pipeline
+from . import sink
+from . import archive
 
 parser = ArgumentParser(description='Convert robot simulation model from one another.')
-parser.add_argument('-i', '--input', dest='fromfile', metavar='FILE', help='convert from FILE')
-parser.add_argument('-o', '--output', dest='tofile', metavar='FILE', help='convert to FILE')
+parser.add_argument('-i', '--input', dest='fromfile', metavar='FILE', help='convert from FILE (or the model in zip/tar archive FILE, or the file in it as FILE/PATH)')
+parser.add_argument('-o', '--output', dest='tofile', metavar='FILE', help='convert to FILE (or to zip/tar archive FILE, or to the file in it as FILE/PATH)')
 parser.add_argument('-f', '--from', dest='fromformat', metavar='FORMAT', help='convert from FORMAT (optional)')
 parser.add_argument('-t', '--to', dest='toformat', metavar='FORMAT', help='convert to FORMAT (optional)')
+parser.add_argument('--mesh-format', dest='meshformat', metavar='FORMAT', default='dae', choices=['dae', 'glb'], help='format of visual mesh files for urdf and sdf output (dae or glb)')
+parser.add_argument('--quantize', action='store_true', dest='quantize', default=False, help='quantize vertex attributes of glb mesh files')
+parser.add_argument('--visual-budget', dest='visualbudget', metavar='N', type=int, help='simplify visual meshes to N triangles in total')
+parser.add_argument('--collision-budget', dest='collisionbudget', metavar='N', type=int, help='simplify collision meshes to N triangles in total')
+parser.add_argument('--shape-budget', dest='shapebudgets', metavar='NAME=N', action='append', default=[], help='simplify mesh of shape NAME (or LINK/NAME) to N triangles (can be specified multiple times)')
+parser.add_argument('--fit-primitives', action='store_true', dest='fitprimitives', default=False, help='replace collision meshes with box, cylinder or sphere where they fit')
+parser.add_argument('--primitive-tolerance', dest='primitivetolerance', metavar='RATIO', type=float, default=0.1, help='allowed volume error of fitted primitives (default: 0.1)')
+parser.add_argument('--convex-hull', action='store_true', dest='convexhull', default=False, help='replace collision meshes with their convex hulls')
+parser.add_argument('--convex-pieces', dest='convexpieces', metavar='K', type=int, help='decompose collision meshes into K convex pieces at most')
+parser.add_argument('--max-memory', dest='maxmemory', metavar='SIZE', help='load meshes one by one while writing and fail when resident memory exceeds SIZE (e.g. 512M, 2G)')
+parser.add_argument('--pipeline', dest='pipeline', metavar='N', type=int, nargs='?', const=4, help='overlap mesh reads, mesh writes and external tools using N worker threads (default: 4)')
+parser.add_argument('--max-tools', dest='maxtools', metavar='N', type=int, default=2, help='maximum number of external tools run at the same time with --pipeline (default: 2)')
+parser.add_argument('-j', '--jobs', dest='jobs', metavar='N', type=int, help='number of worker processes converting the bodies of world files (default: number of cpus)')
+parser.add_argument('--force', action='store_true', dest='force', default=False, help='convert even if the output is up to date')
+parser.add_argument('--profile', dest='profile', metavar='JSON', nargs='?', const='', help='show time of each conversion stage and counters (and save them to JSON file)')
+parser.add_argument('--trace', dest='trace', metavar='JSON', help='save spans of the conversion stages to JSON file in Chrome trace event format')
+parser.add_argument('--remote', dest='remote', metavar='SOCKET', nargs='?', const='', help='submit the conversion to the server started by "simtrans serve" (listening on SOCKET)')
 parser.add_argument('-v', '--verbose', action='store_true', dest='verbose', default=False, help='verbose output')
+# mesh files shared with the other bodies when converting the body of a world (see simtrans.project)
+parser.set_defaults(sharedmeshes=None)
+
+
+def getreader(fname, fmt=None):
+    '''
+    Get reader for the format (or detected from the file extension)
+    '''
+    name = registry.readerformat(fname, fmt)
+    if name is None:
+        return None
+    return registry.createreader(name)
 
 
-def main():
+def getwriter(fname, fmt=None, meshformat='dae', quantize=False):
+    '''
+    Get writer and asset handler for the format (or detected from the file
+    extension)
+    '''
+    name = registry.writerformat(fname, fmt)
+    if name is None:
+        return None, None
+    writer = registry.createwriter(name, meshformat=meshformat, quantize=quantize)
+    handler = None
+    if name == 'vrml' and fmt != 'vrml':
+        dirname = os.path.dirname(fname)
+        def jpegconvert(f):
+            fname = os.path.join(dirname, os.path.splitext(os.path.basename(f))[0] + '.jpg')
+            def convert():
+                with profiling.stage('imagemagick', f):
+                    if sink.current().local and not archive.ismember(f):
+                        pipeline.checkcall(['convert', f, fname], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                        return
+                    # pass the texture in the archive and keep the converted texture in the sink by pipes
+                    with archive.open(f) as src:
+                        image = src.read()
+                    with pipeline.toolslot():
+                        p = subprocess.Popen(['convert', '-', 'jpg:-'], stdin=subprocess.PIPE,
+                                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                        data, err = p.communicate(image)
+                    if p.returncode != 0:
+                        raise subprocess.CalledProcessError(p.returncode, 'convert %s' % f, err)
+                    with sink.open(fname, 'wb') as ofile:
+                        ofile.write(data)
+            pipeline.submit(convert)
+            return fname
+        handler = jpegconvert
+    return writer, handler
+
+
+def convert(options, checkpoint=None):
+    '''
+    Convert the model as specified by the parsed options and return the
+    exit status
+
+    :param options: parsed options
+    :param checkpoint: function called between the conversion steps (may raise exception to abort the conversion)
+    '''
+    if checkpoint is None:
+        checkpoint = lambda: None
+    if not options.maxmemory:
+        return _archived(options, checkpoint)
+
     try:
-        options = parser.parse_args()
-    except ArgumentError, e:
-        print >> sys.stderr, 'OptionError: ', e
-        print >> sys.stderr, parser.print_help()
+        cap = memory.parsesize(options.maxmemory)
+    except ValueError, e:
+        print >> sys.stderr, e
         return 1
-
-    if options.tofile is None or options.fromfile is None:
-        print >> sys.stderr, parser.print_help()
+    if options.fitprimitives or options.convexhull or options.convexpieces or \
+       options.visualbudget or options.collisionbudget or options.shapebudgets:
+        print >> sys.stderr, '--max-memory cannot be combined with the options processing all the meshes in memory'
+        return 1
+    limit = memory.Limit(cap)
+    try:
+        limit.check('starting the conversion')
+        with limit.activate():
+            return _archived(options, checkpoint)
+    except memory.MemoryCapExceeded, e:
+        print >> sys.stderr, e
         return 1
 
-    reader = None
-    if options.fromformat == "vrml":
-        reader = vrml.VRMLReader()
-    if options.fromformat == "urdf":
-        reader = urdf.URDFReader()
-    if options.fromformat == "sdf":
-        reader = sdf.SDFReader()
-    if reader is None:
-        ext = os.path.splitext(options.fromfile)[1]
-        if ext == '.wrl':
-            reader = vrml.VRMLReader()
-        elif ext == '.urdf':
-            reader = urdf.URDFReader()
-        elif ext == '.sdf':
-            reader = sdf.SDFReader()
-        else:
-            print >> sys.stderr, 'unable to detect input format (may be not supported?)'
+
+def _archived(options, checkpoint):
+    if archive.isarchive(options.fromfile):
+        options.fromfile = archive.document(options.fromfile)
+    fname, member = archive.split(options.tofile)
+    if member is None:
+        return _pipelined(options, checkpoint)
+    if member == '':
+        # name the document after the archive
+        try:
+            options.tofile = archive.outputdocument(fname, registry.writerformat(fname, options.toformat))
+        except Exception, e:
+            print >> sys.stderr, '%s (specify the format by -t or the file in the archive as %s/PATH)' % (e, fname)
             return 1
+    with archive.ArchiveSink(fname) as output:
+        with output.activate():
+            return _pipelined(options, checkpoint)
 
-    writer = None
-    handler = None
-    if options.toformat == "vrml":
-        writer = vrml.VRMLWriter()
-    if options.toformat == "urdf":
-        writer = urdf.URDFWriter()
-    if options.toformat == "sdf":
-        writer = sdf.SDFWriter()
-    if options.toformat == "dot":
-        writer = graphviz.GraphvizWriter()
+
+def _pipelined(options, checkpoint):
+    if not options.pipeline:
+        return _convert(options, checkpoint)
+    with pipeline.Pipeline(workers=options.pipeline, tools=options.maxtools).activate():
+        return _convert(options, checkpoint)
+
+
+def _convert(options, checkpoint):
+    reader = getreader(options.fromfile, options.fromformat)
+    if reader is None:
+        print >> sys.stderr, 'unable to detect input format (may be not supported?)'
+        return 1
+
+    writer, handler = getwriter(options.tofile, options.toformat, options.meshformat, options.quantize)
     if writer is None:
-        ext = os.path.splitext(options.tofile)[1]
-        if ext == '.wrl':
-            writer = vrml.VRMLWriter()
-            dirname = os.path.dirname(options.tofile)
-            def jpegconvert(f):
-                fname = os.path.join(dirname, os.path.splitext(os.path.basename(f))[0] + '.jpg')
-                subprocess.check_call(['convert', f, fname], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                return fname
-            handler = jpegconvert
-        elif ext == '.urdf':
-            writer = urdf.URDFWriter()
-        elif ext == '.sdf':
-            writer = sdf.SDFWriter()
-        elif ext == '.world':
-            writer = sdf.SDFWriter()
-        elif ext == '.dot':
-            writer = graphviz.GraphvizWriter()
-        else:
-            print >> sys.stderr, 'unable to detect output format (may be not supported?)'
+        print >> sys.stderr, 'unable to detect output format (may be not supported?)'
+        return 1
+
+    from . import project
+    if project.isproject(reader, options.fromfile):
+        if archive.ismember(options.tofile):
+            print >> sys.stderr, 'unable to write the world with many bodies to the archive'
             return 1
+        return project.convert(options, reader, writer, checkpoint)
+    if options.sharedmeshes:
+        writer.sharedmeshes = options.sharedmeshes
+
+    # manifest of the model written in the archive is placed next to the archive
+    mf = manifest.Manifest(manifest.manifestpath(archive.split(options.tofile)[0]))
+    mf.options = {
+        'input': options.fromfile,
+        'from': reader.__class__.__name__,
+        'to': writer.__class__.__name__,
+        'meshformat': options.meshformat,
+        'quantize': options.quantize,
+        'visualbudget': options.visualbudget,
+        'collisionbudget': options.collisionbudget,
+        'shapebudgets': options.shapebudgets,
+        'fitprimitives': options.fitprimitives,
+        'primitivetolerance': options.primitivetolerance,
+        'convexhull': options.convexhull,
+        'convexpieces': options.convexpieces,
+        'sharedmeshes': options.sharedmeshes
+    }
+    with profiling.stage('check manifest'):
+        uptodate = options.force is False and mf.isuptodate()
+    if uptodate:
+        print "up to date: %s" % options.tofile
+        return 0
 
     print "converting from: %s" % options.fromfile
     print "             to: %s" % options.tofile
 
-    model = reader.read(options.fromfile, assethandler=handler)
+    checkpoint()
+    passes = options.fitprimitives or options.convexhull or options.convexpieces or \
+        options.visualbudget or options.collisionbudget or options.shapebudgets
+    if not passes:
+        # no mesh passes: stream the links from the reader to the writer
+        start = int(time.time())
+        events = stream.iterread(reader, options.fromfile, assethandler=handler)
+        if pipeline.current() is not None:
+            events = pipeline.current().prefetch(events)
+        events = _checked(events, options.fromfile, checkpoint)
+        try:
+            with profiling.stage('read and write'):
+                tracing.annotate(path=options.fromfile, reader=reader.__class__.__name__,
+                                 output=options.tofile, writer=writer.__class__.__name__)
+                stream.writestream(writer, events, options.tofile, manifest=mf)
+        except _NoLinks:
+            print "cannot read links at all (probably the model refers to another model by <include> tag)"
+            return 1
+        return _finish(mf, events.model, start)
+
+    with profiling.stage('read'):
+        tracing.annotate(path=options.fromfile, reader=reader.__class__.__name__)
+        model = reader.read(options.fromfile, assethandler=handler)
+    memory.check('reading %s' % options.fromfile)
     if len(model.links) == 0:
         print "cannot read links at all (probably the model refers to another model by <include> tag)"
         return 1
-    writer.write(model, options.tofile)
+    checkpoint()
+    if options.fitprimitives:
+        from . import primitive
+        with profiling.stage('fit primitives'):
+            primitive.fitprimitives(model, options.primitivetolerance)
+        checkpoint()
+    # simplify before the convex hulls so that the hulls are not collapsed
+    if options.visualbudget or options.collisionbudget or options.shapebudgets:
+        targets = {}
+        for b in options.shapebudgets:
+            name, count = b.rsplit('=', 1)
+            targets[name] = int(count)
+        from . import decimate
+        with profiling.stage('decimate'):
+            decimate.decimate(model, options.visualbudget, options.collisionbudget, targets)
+        checkpoint()
+    if options.convexhull or options.convexpieces:
+        from . import convex
+        with profiling.stage('convex'):
+            convex.convexcollisions(model, options.convexpieces or 1)
+        checkpoint()
+    profiling.countmodel(model)
+    start = int(time.time())
+    with profiling.stage('write'):
+        tracing.annotate(path=options.tofile, writer=writer.__class__.__name__)
+        writer.write(model, options.tofile, manifest=mf)
+    return _finish(mf, model, start)
+
 
+class _NoLinks(Exception):
+    pass
+
+
+class _checked(object):
+    '''
+    Pass through the events of the reader calling checkpoint between them
+    (the complete model is kept in model attribute at the end)
+    '''
+    def __init__(self, events, fname, checkpoint):
+        self._events = events
+        self._fname = fname
+        self._checkpoint = checkpoint
+        self.model = None
+
+    def __iter__(self):
+        for kind, obj in self._events:
+            if kind == stream.END:
+                memory.check('reading %s' % self._fname)
+                if len(obj.links) == 0:
+                    raise _NoLinks()
+                profiling.countmodel(obj)
+                self.model = obj
+            yield (kind, obj)
+            self._checkpoint()
+
+
+def _finish(mf, model, start):
+    if pipeline.current() is not None:
+        with profiling.stage('wait for workers'):
+            pipeline.current().join()
+    for f in model.sources:
+        mf.addinput(f)
+    with profiling.stage('save manifest'):
+        mf.save()
+    for f in mf.outputs:
+        if os.path.exists(f) and os.path.getmtime(f) >= start:
+            profiling.count('bytes written', os.path.getsize(f))
     return 0
 
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if len(argv) > 0 and argv[0] == 'batch':
+        from . import batch
+        return batch.main(argv[1:])
+    if len(argv) > 0 and argv[0] == 'serve':
+        from . import daemon
+        return daemon.main(argv[1:])
+    if len(argv) > 0 and argv[0] == 'info':
+        from . import info
+        return info.main(argv[1:])
+
+    try:
+        options = parser.parse_args(argv)
+    except ArgumentError, e:
+        print >> sys.stderr, 'OptionError: ', e
+        print >> sys.stderr, parser.print_help()
+        return 1
+
+    if options.tofile is None or options.fromfile is None:
+        print >> sys.stderr, parser.print_help()
+        return 1
+
+    if options.remote is not None:
+        if options.profile is not None or options.trace is not None:
+            # the conversion runs in the server (or in the fallback of the client)
+            print >> sys.stderr, '--profile and --trace cannot be combined with --remote'
+            return 1
+        from . import daemon
+        return daemon.submit(options.remote, options)
+
+    if options.profile is None and options.trace is None:
+        return convert(options)
+
+    p = profiling.Profiler()
+    t = tracing.Tracer()
+    with p.activate():
+        with t.activate():
+            with profiling.stage('convert'):
+                ret = convert(options)
+    if options.profile is not None:
+        print p.report()
+        if options.profile:
+            with open(options.profile, 'w') as f:
+                json.dump(p.todict(), f, indent=2, sort_keys=True)
+    if options.trace:
+        t.save(options.trace)
+    return ret
+
 if __name__ == '__main__':
     sys.exit(main())
@@ -23,6 +23,9 @@ Read collada model data given the file path
 
 from __future__ import absolute_import
 from . import model
+from . import utils
+from . import sink
+from . import archive
 import warnings
 with warnings.catch_warnings():
     warnings.simplefilter('ignore')
@@ -30,16 +33,18 @@ with warnings.catch_warnings():
 import os
 import collada
 import numpy
-import uuid
 import lxml
 from StringIO import StringIO
 
 
-class ColladaReader(object):
+class ColladaReader(utils.Reentrant):
     '''
     Collada reader class
     '''
     def __init__(self):
+        self._reset()
+
+    def _reset(self):
         self._basepath = None
         self._assethandler = None
         self._materials = {}
@@ -48,13 +53,16 @@ class ColladaReader(object):
         '''
         Read collada model data given the file path
         '''
+        return self._context()._read(f, assethandler, submesh)
+
+    def _read(self, f, assethandler, submesh):
         self._basepath = os.path.dirname(f)
         self._assethandler = assethandler
         try:
-            d = collada.Collada(f)
+            d = collada.Collada(archive.open(f))
         except:
             # workaround for pycollada's handling of xml comments
-            xdoc = lxml.etree.parse(f)
+            xdoc = lxml.etree.parse(archive.open(f))
             for c in xdoc.xpath('//comment()'):
                 p = c.getparent()
                 p.remove(c)
@@ -68,7 +76,7 @@ class ColladaReader(object):
             mm.name = m.id
             if type(m.effect.diffuse) == collada.material.Map:
                 fname = os.path.abspath(os.path.join(self._basepath, m.effect.diffuse.sampler.surface.image.path))
-                if not os.path.exists(fname):
+                if not archive.exists(fname):
                     if fname.count('/meshes/') > 0:
                         fname = fname.replace('/meshes/', '/materials/textures/')
                 if self._assethandler:
@@ -79,7 +87,8 @@ class ColladaReader(object):
                 mm.diffuse = m.effect.diffuse
             self._materials[mm.name] = mm
         m = model.MeshTransformData()
-        unitmeter = d.assetInfo.unitmeter
+        # unit is 1 meter if not specified in the asset
+        unitmeter = d.assetInfo.unitmeter or 1.0
         m.matrix = tf.scale_matrix(unitmeter)
         m.children = []
         rootnodes = d.scene.nodes
@@ -176,25 +185,34 @@ class ColladaReader(object):
         return m
 
 
-class ColladaWriter(object):
+class ColladaWriter(utils.Reentrant):
     '''
     Collada writer class
     '''
     def __init__(self):
+        self._reset()
+
+    def _reset(self):
         self._mesh = None
         self._matnode = None
+        self._count = 0
 
     def write(self, m, f):
         '''
         Write simulation model in collada format
         '''
+        self._context()._write(m, f)
+
+    def _write(self, m, f):
         # we use pycollada to generate the dae file
         self._mesh = collada.Collada()
+        self._count = 0
 
-        # create effect and material
-        if m.data.material:
-            if m.data.material.texture:
-                image = collada.material.CImage("material0-image", m.data.material.texture)
+        # create effect and material (scene graph read from collada has no material at the root)
+        material = getattr(m.data, 'material', None)
+        if material:
+            if material.texture:
+                image = collada.material.CImage("material0-image", material.texture)
                 surface = collada.material.Surface("material0-image-surface", image)
                 sampler2d = collada.material.Sampler2D("material0-image-sampler", surface)
                 map1 = collada.material.Map(sampler2d, "UVSET0")
@@ -208,9 +226,9 @@ class ColladaWriter(object):
             else:
                 effect = collada.material.Effect("effect0", [], "phong",
                                                  double_sided=True,
-                                                 diffuse=m.data.material.diffuse,
-                                                 specular=m.data.material.specular,
-                                                 transparency=m.data.material.transparency)
+                                                 diffuse=material.diffuse,
+                                                 specular=material.specular,
+                                                 transparency=material.transparency)
         else:
             effect = collada.material.Effect("effect0", [], "phong",
                                              double_sided=True,
@@ -228,12 +246,13 @@ class ColladaWriter(object):
         myscene = collada.scene.Scene("myscene", [node])
         self._mesh.scenes.append(myscene)
         self._mesh.scene = myscene
-        self._mesh.write(f)
+        with sink.open(f, 'wb') as ofile:
+            self._mesh.write(ofile)
 
     def convertchild(self, m):
         if type(m) == model.MeshTransformData:
             children = []
-            name = 'node-' + str(uuid.uuid1()).replace('-', '')
+            name = 'node-%i' % self.nextid()
             for c in m.children:
                 cn = self.convertchild(c)
                 if cn:
@@ -241,7 +260,7 @@ class ColladaWriter(object):
             node = collada.scene.Node(name, children=children)
             return node
         elif type(m) == model.MeshData:
-            name = 'shape-' + str(uuid.uuid1()).replace('-', '')
+            name = 'shape-%i' % self.nextid()
             vertexname = name + '-vertex'
             normalname = name + '-normal'
             uvmapname = name + '-uvmap'
@@ -266,3 +285,11 @@ class ColladaWriter(object):
             node = collada.scene.GeometryNode(geom, [self._matnode])
             return node
         return None
+
+    def nextid(self):
+        '''
+        Generate id unique inside the document (ids are numbered in the
+        order of the scene graph so that the output is deterministic)
+        '''
+        self._count = self._count + 1
+        return self._count
@@ -0,0 +1,409 @@
+# -*- coding:utf-8 -*-
+
+"""Convex hull and approximate convex decomposition for collision shapes
+
+Convex hulls are calculated using scipy (qhull) if it is installed,
+otherwise using the quickhull implementation in this module.
+
+:Organization:
+ AIST
+
+Requirements
+------------
+* numpy
+* scipy (optional)
+
+Examples
+--------
+
+Convex hull of a cube with an extra point inside
+
+>>> points = numpy.array([[x, y, z] for x in [0, 1] for y in [0, 1] for z in [0, 1]] + [[0.5, 0.5, 0.5]], dtype=float)
+>>> h = quickhull(points)
+>>> len(h.vertex), len(h.vertex_index)
+(8, 12)
+>>> round(volume(h.vertex, h.vertex_index), 6)
+1.0
+
+Decompose L-shaped mesh into two convex pieces
+
+>>> m = model.MeshTransformData()
+>>> m.children = [box([0, 0, 0], [2, 1, 1]), box([0, 1, 0], [1, 2, 1])]
+>>> h = hull(m)
+>>> round(volume(h.vertex, h.vertex_index), 6)
+3.5
+>>> pieces = decompose(m, 2)
+>>> len(pieces)
+2
+>>> round(sum([volume(p.vertex, p.vertex_index) for p in pieces]), 6)
+3.0
+"""
+
+from __future__ import absolute_import
+from . import model
+import copy
+import numpy
+try:
+    from scipy.spatial import ConvexHull
+except ImportError:
+    ConvexHull = None
+
+SPLITS = 7  #: Number of candidate planes along each axis for decomposition
+SAMPLES = 300  #: Number of points used to evaluate the candidate planes
+
+
+def box(lower, upper):
+    '''
+    Create box shaped MeshData (used for testing)
+    '''
+    m = model.MeshData()
+    m.vertex = numpy.array([[x, y, z] for x in [lower[0], upper[0]]
+                            for y in [lower[1], upper[1]]
+                            for z in [lower[2], upper[2]]], dtype=float)
+    m.vertex_index = numpy.array([[0, 1, 3], [0, 3, 2], [4, 6, 7], [4, 7, 5],
+                                  [0, 4, 5], [0, 5, 1], [2, 3, 7], [2, 7, 6],
+                                  [0, 2, 6], [0, 6, 4], [1, 5, 7], [1, 7, 3]])
+    return m
+
+
+def flatten(data, matrix=None):
+    '''
+    Collect vertices and triangles of MeshData or MeshTransformData tree
+    in the coordinate of the shape
+
+    :returns: vertex ([x,y,z] * N array) and vertex_index ([p1,p2,p3] * M array)
+    '''
+    if matrix is None:
+        matrix = numpy.identity(4)
+    vertices = []
+    indices = []
+    count = 0
+    if type(data) == model.MeshTransformData:
+        if data.matrix is not None:
+            matrix = numpy.dot(matrix, numpy.asarray(data.matrix, dtype=float))
+        for c in data.children:
+            v, i = flatten(c, matrix)
+            vertices.append(v)
+            indices.append(i + count)
+            count = count + len(v)
+    elif type(data) == model.MeshData:
+        idx = numpy.asarray(data.vertex_index)
+        if len(data.vertex) > 0 and idx.ndim == 2 and idx.shape[1] == 3:
+            v = numpy.asarray(data.vertex, dtype=float)
+            vertices.append(numpy.dot(v, matrix[0:3, 0:3].T) + matrix[0:3, 3])
+            indices.append(idx)
+    if len(vertices) == 0:
+        return numpy.zeros((0, 3)), numpy.zeros((0, 3), dtype=int)
+    return numpy.vstack(vertices), numpy.vstack(indices).astype(int)
+
+
+def volume(vertex, faces):
+    '''
+    Calculate volume enclosed by the (closed and outward oriented) triangles
+    '''
+    v = numpy.asarray(vertex)[numpy.asarray(faces)]
+    return numpy.einsum('ij,ij->i', v[:, 0], numpy.cross(v[:, 1], v[:, 2])).sum() / 6.0
+
+
+def _orient(points, faces):
+    # make all the faces pointing outward from the centroid
+    center = points.mean(axis=0)
+    v = points[faces]
+    n = numpy.cross(v[:, 1] - v[:, 0], v[:, 2] - v[:, 0])
+    inward = numpy.einsum('ij,ij->i', n, v[:, 0] - center) < 0
+    faces[inward] = faces[inward][:, [0, 2, 1]]
+    return faces
+
+
+def _meshdata(points, faces):
+    used, remap = numpy.unique(faces, return_inverse=True)
+    m = model.MeshData()
+    m.vertex = points[used]
+    m.vertex_index = remap.reshape(-1, 3)
+    return m
+
+
+def quickhull(points):
+    '''
+    Calculate convex hull of the points using quickhull algorithm
+
+    :param points: [x,y,z] * N array
+    :returns: MeshData of the hull (None if the points are degenerated)
+    '''
+    points = numpy.unique(numpy.asarray(points, dtype=float), axis=0)
+    if len(points) < 4:
+        return None
+    scale = max(numpy.abs(points).max(), 1e-12)
+    eps = 1e-10 * scale
+
+    # initial tetrahedron
+    a = points[:, 0].argmin()
+    b = points[:, 0].argmax()
+    if a == b:
+        return None
+    ab = points[b] - points[a]
+    c = numpy.sqrt((numpy.cross(points - points[a], ab) ** 2).sum(axis=1)).argmax()
+    n = numpy.cross(ab, points[c] - points[a])
+    if numpy.sqrt((n * n).sum()) <= eps * scale:
+        return None
+    dist = numpy.dot(points - points[a], n)
+    d = numpy.abs(dist).argmax()
+    if abs(dist[d]) <= eps * numpy.sqrt((n * n).sum()):
+        return None
+    if dist[d] > 0:
+        b, c = c, b
+
+    faces = {}
+    edges = {}
+    counter = [0]
+
+    def addfaces(tris, candidates):
+        # register faces and distribute the candidate points to them
+        t = numpy.array(tris)
+        v = points[t]
+        normals = numpy.cross(v[:, 1] - v[:, 0], v[:, 2] - v[:, 0])
+        normals = normals / numpy.sqrt((normals * normals).sum(axis=1))[:, numpy.newaxis]
+        offsets = numpy.einsum('ij,ij->i', normals, v[:, 0])
+        if len(candidates) > 0:
+            dist = numpy.dot(points[candidates], normals.T) - offsets
+            best = dist.argmax(axis=1)
+            outside = dist[numpy.arange(len(candidates)), best] > eps
+        fids = []
+        for k, (i, j, l) in enumerate(tris):
+            fid = counter[0]
+            counter[0] = fid + 1
+            if len(candidates) > 0:
+                sel = outside & (best == k)
+                faces[fid] = [(i, j, l), normals[k], offsets[k], candidates[sel], dist[sel, k]]
+            else:
+                faces[fid] = [(i, j, l), normals[k], offsets[k], candidates, candidates]
+            edges[(i, j)] = fid
+            edges[(j, l)] = fid
+            edges[(l, i)] = fid
+            fids.append(fid)
+        return fids
+
+    initial = addfaces([(a, b, c), (a, c, d), (a, d, b), (b, d, c)],
+                       numpy.setdiff1d(numpy.arange(len(points)), [a, b, c, d]))
+
+    pending = list(initial)
+    while len(pending) > 0:
+        fid = pending.pop()
+        if fid not in faces or len(faces[fid][3]) == 0:
+            continue
+        f = faces[fid]
+        p = f[3][f[4].argmax()]
+        # find faces visible from the point
+        visible = set([fid])
+        stack = [fid]
+        while len(stack) > 0:
+            g = faces[stack.pop()]
+            i, j, k = g[0]
+            for e in [(j, i), (k, j), (i, k)]:
+                h = edges.get(e)
+                if h is None or h in visible:
+                    continue
+                if numpy.dot(points[p], faces[h][1]) - faces[h][2] > eps:
+                    visible.add(h)
+                    stack.append(h)
+        # collect horizon edges and remove visible faces
+        horizon = []
+        candidates = []
+        for h in visible:
+            i, j, k = faces[h][0]
+            for e in [(i, j), (j, k), (k, i)]:
+                if edges.get((e[1], e[0])) not in visible:
+                    horizon.append(e)
+            candidates.append(faces[h][3])
+        for h in visible:
+            i, j, k = faces[h][0]
+            for e in [(i, j), (j, k), (k, i)]:
+                if edges.get(e) == h:
+                    del edges[e]
+            del faces[h]
+        candidates = numpy.concatenate(candidates)
+        candidates = candidates[candidates != p]
+        pending.extend(addfaces([(e[0], e[1], p) for e in horizon], candidates))
+
+    return _meshdata(points, numpy.array([f[0] for f in faces.values()]))
+
+
+def convexhull(points):
+    '''
+    Calculate convex hull of the points (using qhull if available)
+
+    :param points: [x,y,z] * N array
+    :returns: MeshData of the hull (None if the points are degenerated)
+    '''
+    if ConvexHull is None:
+        return quickhull(points)
+    points = numpy.asarray(points, dtype=float)
+    try:
+        h = ConvexHull(points)
+    except Exception:
+        return None
+    return _meshdata(points, _orient(points, h.simplices.copy()))
+
+
+def hull(data):
+    '''
+    Calculate convex hull of MeshData or MeshTransformData tree
+    '''
+    vertex, faces = flatten(data)
+    return convexhull(vertex[numpy.unique(faces)])
+
+
+def _clip(tri, normal, offset):
+    '''
+    Split triangles ([[p1,p2,p3]] * N array) by the plane and return the
+    triangles on each side (the cross section is closed by a cap)
+    '''
+    s = numpy.dot(tri, normal) - offset
+    below = (s <= 0).all(axis=1)
+    above = (s >= 0).all(axis=1)
+    lower = [tri[below]]
+    upper = [tri[above & ~below]]
+    section = []
+    for t, d in zip(tri[~(below | above)], s[~(below | above)]):
+        polys = ([], [])
+        for k in range(3):
+            p, q = t[k], t[(k + 1) % 3]
+            dp, dq = d[k], d[(k + 1) % 3]
+            if dp <= 0:
+                polys[0].append(p)
+            if dp >= 0:
+                polys[1].append(p)
+            if dp == 0:
+                section.append(p)
+            if (dp < 0 and dq > 0) or (dp > 0 and dq < 0):
+                x = p + (q - p) * (dp / (dp - dq))
+                polys[0].append(x)
+                polys[1].append(x)
+                section.append(x)
+        for poly, out in zip(polys, (lower, upper)):
+            for k in range(1, len(poly) - 1):
+                out.append(numpy.array([[poly[0], poly[k], poly[k + 1]]]))
+    if len(section) >= 3:
+        # fan of the section points sorted by the angle around the center
+        section = numpy.array(section)
+        center = section.mean(axis=0)
+        u = numpy.cross(normal, numpy.identity(3)[numpy.abs(normal).argmin()])
+        v = numpy.cross(normal, u)
+        order = numpy.arctan2(numpy.dot(section - center, v), numpy.dot(section - center, u)).argsort()
+        ring = section[order]
+        cap = numpy.array([[center, p, q] for p, q in zip(ring, numpy.roll(ring, -1, axis=0))])
+        lower.append(cap)
+        upper.append(cap[:, [0, 2, 1]])
+    return numpy.vstack(lower), numpy.vstack(upper)
+
+
+def _hullvolume(points):
+    if len(points) < 4:
+        return 0.0
+    h = convexhull(points)
+    if h is None:
+        return 0.0
+    return volume(h.vertex, h.vertex_index)
+
+
+def _samples(tri):
+    # subsampled vertices and edges used to estimate hull volumes of splits
+    points = numpy.unique(tri.reshape(-1, 3), axis=0)
+    edges = numpy.concatenate([tri[:, [0, 1]], tri[:, [1, 2]], tri[:, [2, 0]]])
+    return points[::max(1, len(points) // SAMPLES)], edges[::max(1, len(edges) // SAMPLES)]
+
+
+def _splitvolumes(points, edges, axis, offset):
+    # estimate hull volumes of the both sides of the plane
+    s = numpy.dot(points, axis) - offset
+    se = numpy.dot(edges, axis) - offset
+    crossing = se[:, 0] * se[:, 1] < 0
+    p = edges[crossing, 0]
+    q = edges[crossing, 1]
+    t = se[crossing, 0] / (se[crossing, 0] - se[crossing, 1])
+    section = p + (q - p) * t[:, numpy.newaxis]
+    return (_hullvolume(numpy.vstack([points[s <= 0], section])),
+            _hullvolume(numpy.vstack([points[s >= 0], section])))
+
+
+def decompose(data, pieces):
+    '''
+    Approximately decompose MeshData or MeshTransformData tree into
+    convex pieces
+
+    The piece with the largest hull volume is split recursively by the
+    plane (perpendicular to one of its principal or coordinate axes)
+    which minimizes the total volume of hulls of the both sides.
+
+    :param data: MeshData or MeshTransformData
+    :param pieces: maximum number of convex pieces
+    :returns: list of MeshData
+    '''
+    vertex, faces = flatten(data)
+    parts = [vertex[faces]]
+    volumes = [_hullvolume(_samples(parts[0])[0])]
+    while len(parts) < pieces:
+        k = int(numpy.argmax(volumes))
+        tri = parts[k]
+        points, edges = _samples(tri)
+        center = points.mean(axis=0)
+        u, s, axes = numpy.linalg.svd(points - center, full_matrices=False)
+        best = None
+        for axis in numpy.vstack([axes, numpy.identity(3)]):
+            d = numpy.dot(points, axis)
+            for offset in numpy.linspace(d.min(), d.max(), SPLITS + 2)[1:-1]:
+                vl, vu = _splitvolumes(points, edges, axis, offset)
+                if best is None or vl + vu < best[0]:
+                    best = (vl + vu, axis, offset, vl, vu)
+        if best is None or best[0] >= volumes[k] * (1 - 1e-6):
+            break
+        lower, upper = _clip(tri, best[1], best[2])
+        if len(lower) == 0 or len(upper) == 0:
+            break
+        parts[k:k + 1] = [lower, upper]
+        volumes[k:k + 1] = [best[3], best[4]]
+    result = []
+    for tri in parts:
+        h = convexhull(tri.reshape(-1, 3))
+        if h is not None:
+            result.append(h)
+    return result
+
+
+def convexcollisions(bm, pieces=1):
+    '''
+    Replace collision meshes of the body with their convex hulls (or
+    convex pieces). Visual shapes are used for the links without
+    collision shapes.
+
+    :param bm: BodyModel
+    :param pieces: maximum number of convex pieces for each mesh
+    '''
+    for l in bm.links:
+        shapes = l.collisions
+        if len(shapes) == 0:
+            shapes = l.visuals
+        collisions = []
+        for s in shapes:
+            if s.shapeType != model.ShapeModel.SP_MESH or s.data is None:
+                collisions.append(s)
+                continue
+            if pieces > 1:
+                meshes = decompose(s.data, pieces)
+            else:
+                meshes = [hull(s.data)]
+            meshes = [m for m in meshes if m is not None]
+            if len(meshes) == 0:
+                collisions.append(s)
+                continue
+            for i, m in enumerate(meshes):
+                c = copy.copy(s)
+                if len(meshes) > 1:
+                    c.name = '%s-convex%i' % (s.name, i)
+                    c.meshname = '%s-convex%i' % (s.getmeshname(), i)
+                else:
+                    c.name = s.name + '-convex'
+                    c.meshname = s.getmeshname() + '-convex'
+                c.data = m
+                collisions.append(c)
+        l.collisions = collisions
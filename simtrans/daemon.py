@@ -0,0 +1,411 @@
+# -*- coding:utf-8 -*-
+
+"""Conversion server keeping the caches warm between the conversions
+
+``simtrans serve`` starts the server listening on a unix domain socket and
+``simtrans --remote`` submits the conversion to the server. Requests and
+responses are JSON objects, one per line.
+
+Requests:
+
+* ``{"command": "convert", "options": {...}}`` -- convert the model (same options as the command line). The server replies ``{"id": ID, "status": "queued"}`` first and ``{"id": ID, "status": STATUS, "time": T, "output": OUTPUT}`` when finished (STATUS is "ok", "failed" or "cancelled").
+* ``{"command": "cancel", "id": ID}`` -- cancel the queued or running conversion (running conversion is cancelled at the end of the current step).
+* ``{"command": "stats"}`` -- get statistics of the jobs and the caches.
+* ``{"command": "stop"}`` -- cancel all the conversions and stop the server.
+
+:Organization:
+ AIST
+
+Examples
+--------
+
+Start the server and ask statistics
+
+>>> import tempfile, threading
+>>> path = os.path.join(tempfile.mkdtemp(), 'simtrans.sock')
+>>> server = ConversionServer(path, maxjobs=2)
+>>> t = threading.Thread(target=server.serve_forever)
+>>> t.start()
+>>> s = request(path, {'command': 'stats'})
+>>> s['jobs']['running'], s['jobs']['queued'], s['maxjobs']
+(0, 0, 2)
+>>> request(path, {'command': 'cancel', 'id': 10})
+{u'cancelled': False}
+>>> request(path, {'command': 'stop'})
+{u'stopped': True}
+>>> t.join()
+>>> os.path.exists(path)
+False
+"""
+
+import os
+import sys
+import json
+import time
+import errno
+import socket
+import tempfile
+import threading
+import traceback
+import SocketServer
+from StringIO import StringIO
+from argparse import ArgumentParser, Namespace
+from . import cache
+from . import xacro
+from . import archive
+from . import tracing
+
+parser = ArgumentParser(prog='simtrans serve', description='Run conversion server which keeps the caches warm.')
+parser.add_argument('-s', '--socket', dest='socket', metavar='PATH', default='', help='path of the unix domain socket (default: $SIMTRANS_SOCKET or simtrans-UID.sock in the temporary directory)')
+parser.add_argument('-j', '--max-jobs', dest='maxjobs', metavar='N', type=int, default=2, help='maximum number of conversions run at the same time (default: 2)')
+parser.add_argument('--trace', dest='trace', metavar='JSON', help='save spans of all the conversions to JSON file in Chrome trace event format when the server stops')
+parser.add_argument('--stats', action='store_true', dest='stats', default=False, help='show statistics of the running server')
+parser.add_argument('--cancel', dest='cancel', metavar='ID', type=int, help='cancel the conversion on the running server')
+parser.add_argument('--stop', action='store_true', dest='stop', default=False, help='stop the running server')
+
+
+def socketpath(path=None):
+    '''
+    Get path of the socket (use default path if not specified)
+    '''
+    if path:
+        return path
+    try:
+        return os.environ['SIMTRANS_SOCKET']
+    except KeyError:
+        return os.path.join(tempfile.gettempdir(), 'simtrans-%i.sock' % os.getuid())
+
+
+class Cancelled(Exception):
+    '''
+    Raised in the conversion thread when the job is cancelled
+    '''
+    pass
+
+
+class Job(object):
+    '''
+    Conversion job
+    '''
+    def __init__(self, jobid, options):
+        self.id = jobid
+        self.options = options
+        self.status = 'queued'
+        self.time = 0
+        self.output = ''
+        self.cancelled = threading.Event()
+
+    def checkpoint(self):
+        if self.cancelled.is_set():
+            raise Cancelled()
+
+
+class _OutputRouter(object):
+    '''
+    Route the output of each conversion thread to its own buffer
+    '''
+    def __init__(self, stream):
+        self._stream = stream
+        self._local = threading.local()
+
+    def capture(self, buf):
+        self._local.buf = buf
+
+    def write(self, s):
+        buf = getattr(self._local, 'buf', None)
+        if buf is None:
+            self._stream.write(s)
+        else:
+            buf.write(s)
+
+    def flush(self):
+        if getattr(self._local, 'buf', None) is None:
+            self._stream.flush()
+
+
+class ConversionServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    '''
+    Conversion server listening on unix domain socket
+    '''
+    daemon_threads = True
+
+    def __init__(self, path, maxjobs=2):
+        if os.path.exists(path):
+            # remove the socket left by the server which is not running
+            try:
+                request(path, {'command': 'stats'})
+            except socket.error:
+                os.unlink(path)
+            else:
+                raise Exception('server is already running on %s' % path)
+        SocketServer.UnixStreamServer.__init__(self, path, RequestHandler)
+        self.path = path
+        self.maxjobs = maxjobs
+        self.started = time.time()
+        self._slots = threading.BoundedSemaphore(maxjobs)
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._outputs = {}
+        self._count = 0
+        self._finished = {'ok': 0, 'failed': 0, 'cancelled': 0}
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def serve_forever(self, poll_interval=0.5):
+        '''
+        Handle requests until shutdown, then cancel the remaining jobs and
+        close the socket
+        '''
+        try:
+            SocketServer.UnixStreamServer.serve_forever(self, poll_interval)
+        finally:
+            with self._lock:
+                jobs = self._jobs.values()
+            for j in jobs:
+                j.cancelled.set()
+            while len(self._jobs) > 0:
+                time.sleep(0.1)
+            self.server_close()
+
+    def submit(self, options):
+        '''
+        Register new job
+        '''
+        with self._lock:
+            self._count = self._count + 1
+            job = Job(self._count, options)
+            self._jobs[job.id] = job
+        return job
+
+    def run(self, job):
+        '''
+        Run the job in the current thread when the slot is available
+        '''
+        from . import cli
+        buf = StringIO()
+        start = time.time()
+        routers = [r for r in [sys.stdout, sys.stderr] if isinstance(r, _OutputRouter)]
+        for r in routers:
+            r.capture(buf)
+        try:
+            while not self._slots.acquire(False):
+                if job.cancelled.wait(0.1):
+                    raise Cancelled()
+            try:
+                # conversions to the same output are serialized
+                with self._lock:
+                    lock = self._outputs.setdefault(os.path.abspath(job.options.tofile), threading.Lock())
+                with lock:
+                    job.checkpoint()
+                    job.status = 'running'
+                    with tracing.span('convert', job=job.id, input=job.options.fromfile, output=job.options.tofile):
+                        ret = cli.convert(job.options, checkpoint=job.checkpoint)
+                    if ret == 0:
+                        job.status = 'ok'
+                    else:
+                        job.status = 'failed'
+            finally:
+                self._slots.release()
+        except Cancelled:
+            job.status = 'cancelled'
+        except Exception:
+            traceback.print_exc(file=buf)
+            job.status = 'failed'
+        finally:
+            for r in routers:
+                r.capture(None)
+        job.time = time.time() - start
+        job.output = buf.getvalue()
+        return job
+
+    def release(self, job):
+        '''
+        Unregister the finished job
+        '''
+        with self._lock:
+            del self._jobs[job.id]
+            self._finished[job.status] += 1
+
+    def cancel(self, jobid):
+        '''
+        Cancel the job (returns False if the job is not found)
+        '''
+        with self._lock:
+            job = self._jobs.get(jobid)
+        if job is None:
+            return False
+        job.cancelled.set()
+        return True
+
+    def stats(self):
+        '''
+        Get statistics of the jobs and the caches
+        '''
+        with self._lock:
+            jobs = dict(self._finished)
+            jobs['running'] = len([j for j in self._jobs.values() if j.status == 'running'])
+            jobs['queued'] = len([j for j in self._jobs.values() if j.status == 'queued'])
+        return {'uptime': time.time() - self.started, 'maxjobs': self.maxjobs,
+                'jobs': jobs, 'cache': cache.stats(), 'xacro': xacro.stats(),
+                'archive': archive.stats()}
+
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+    '''
+    Handle JSON requests from the client
+    '''
+    def reply(self, obj):
+        self.wfile.write(json.dumps(obj) + '\n')
+        self.wfile.flush()
+
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            try:
+                req = json.loads(line)
+                command = req['command']
+                if command == 'convert':
+                    options = vars(_defaults())
+                    for k, v in req['options'].items():
+                        if isinstance(v, unicode):
+                            v = v.encode('utf-8')
+                        elif isinstance(v, list):
+                            v = [i.encode('utf-8') if isinstance(i, unicode) else i for i in v]
+                        options[str(k)] = v
+                    options['remote'] = None
+                    job = self.server.submit(Namespace(**options))
+                    self.reply({'id': job.id, 'status': job.status})
+                    try:
+                        self.server.run(job)
+                        self.reply({'id': job.id, 'status': job.status, 'time': job.time, 'output': job.output})
+                    finally:
+                        self.server.release(job)
+                elif command == 'cancel':
+                    self.reply({'cancelled': self.server.cancel(req['id'])})
+                elif command == 'stats':
+                    self.reply(self.server.stats())
+                elif command == 'stop':
+                    self.reply({'stopped': True})
+                    threading.Thread(target=self.server.shutdown).start()
+                else:
+                    raise Exception('unsupported command: %s' % command)
+            except Exception, e:
+                self.reply({'error': str(e)})
+
+
+def _defaults():
+    from . import cli
+    return cli.parser.parse_args([])
+
+
+def _connect(path):
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.connect(path)
+    return s
+
+
+def request(path, req):
+    '''
+    Send the request to the server and return the response
+    '''
+    s = _connect(path)
+    try:
+        f = s.makefile('rw')
+        f.write(json.dumps(req) + '\n')
+        f.flush()
+        return json.loads(f.readline())
+    finally:
+        s.close()
+
+
+def submit(path, options):
+    '''
+    Submit the conversion to the server and return the exit status
+    (the model is converted locally if the server is not running)
+    '''
+    path = socketpath(path)
+    opts = dict(vars(options))
+    del opts['remote']
+    for k in ['fromfile', 'tofile']:
+        if opts[k].count('://') == 0:
+            opts[k] = os.path.abspath(opts[k])
+    try:
+        s = _connect(path)
+    except socket.error, e:
+        if e.errno not in [errno.ENOENT, errno.ECONNREFUSED]:
+            raise
+        print >> sys.stderr, 'server is not running on %s (converting locally)' % path
+        from . import cli
+        return cli.convert(options)
+    try:
+        f = s.makefile('rw')
+        f.write(json.dumps({'command': 'convert', 'options': opts}) + '\n')
+        f.flush()
+        res = json.loads(f.readline())
+        if options.verbose:
+            print "job id: %i" % res['id']
+        try:
+            line = f.readline()
+        except KeyboardInterrupt:
+            request(path, {'command': 'cancel', 'id': res['id']})
+            line = f.readline()
+        if line == '':
+            res = {'error': 'connection closed by the server'}
+        else:
+            res = json.loads(line)
+    finally:
+        s.close()
+    if 'error' in res:
+        print >> sys.stderr, res['error']
+        return 1
+    sys.stdout.write(res['output'])
+    if res['status'] != 'ok':
+        print >> sys.stderr, 'conversion %s' % res['status']
+        return 1
+    return 0
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    options = parser.parse_args(argv)
+    path = socketpath(options.socket)
+
+    if options.stats or options.cancel is not None or options.stop:
+        try:
+            if options.stats:
+                print json.dumps(request(path, {'command': 'stats'}), indent=2, sort_keys=True)
+            if options.cancel is not None:
+                if not request(path, {'command': 'cancel', 'id': options.cancel})['cancelled']:
+                    print >> sys.stderr, 'job not found: %i' % options.cancel
+                    return 1
+            if options.stop:
+                request(path, {'command': 'stop'})
+        except socket.error, e:
+            print >> sys.stderr, 'unable to connect to the server on %s: %s' % (path, e)
+            return 1
+        return 0
+
+    server = ConversionServer(path, options.maxjobs)
+    sys.stdout = _OutputRouter(sys.stdout)
+    sys.stderr = _OutputRouter(sys.stderr)
+    print "listening on: %s" % path
+    tracer = tracing.Tracer()
+    try:
+        if options.trace:
+            with tracer.activate():
+                server.serve_forever()
+        else:
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    if options.trace:
+        tracer.save(options.trace)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
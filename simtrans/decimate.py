@@ -0,0 +1,496 @@
+# -*- coding:utf-8 -*-
+
+"""Mesh simplification using quadric edge collapse
+
+Implements the quadric error metric simplification (Garland and
+Heckbert) on MeshData and utilities to apply triangle budgets to the
+visual and collision shapes of a body. Edges are collapsed in rounds:
+the cheapest edges far enough apart from each other are collapsed at
+once, and costs are updated only around the moved vertices.
+
+:Organization:
+ AIST
+
+Requirements
+------------
+* numpy
+
+Examples
+--------
+
+Simplify a tessellated plane to 32 triangles
+
+>>> data = grid(16)
+>>> len(data.vertex_index)
+512
+>>> s = simplify(data, 32)
+>>> len(s.vertex_index) <= 32
+True
+>>> numpy.allclose(s.vertex[:, 2], 0)
+True
+
+Apply triangle budget to the visual shapes of a body
+
+>>> bm = model.BodyModel()
+>>> l = model.LinkModel()
+>>> for i in range(2):
+...     v = model.ShapeModel()
+...     v.name = 'visual%i' % i
+...     v.shapeType = model.ShapeModel.SP_MESH
+...     v.data = grid(16)
+...     l.visuals.append(v)
+>>> bm.links.append(l)
+>>> decimate(bm, visualbudget=200)
+>>> [counttriangles(v.data) <= 100 for v in l.visuals]
+[True, True]
+"""
+
+from __future__ import absolute_import
+from . import model
+import numpy
+
+BOUNDARY_WEIGHT = 1000.0  #: Weight of the penalty quadric to preserve boundary edges
+ROUND_DIVISOR = 4  #: Edges collapsed in a round are chosen from the cheapest 1/ROUND_DIVISOR of the edges
+
+
+def grid(n):
+    '''
+    Generate tessellated unit plane (n x n quads) for testing
+    '''
+    x, y = numpy.meshgrid(numpy.linspace(0, 1, n + 1), numpy.linspace(0, 1, n + 1))
+    data = model.MeshData()
+    data.vertex = numpy.column_stack([x.reshape(-1), y.reshape(-1), numpy.zeros((n + 1) * (n + 1))])
+    idx = numpy.arange((n + 1) * (n + 1)).reshape(n + 1, n + 1)
+    a = idx[:-1, :-1].reshape(-1)
+    b = idx[:-1, 1:].reshape(-1)
+    c = idx[1:, 1:].reshape(-1)
+    d = idx[1:, :-1].reshape(-1)
+    data.vertex_index = numpy.vstack([numpy.column_stack([a, b, c]), numpy.column_stack([a, c, d])])
+    return data
+
+
+def counttriangles(data):
+    '''
+    Count triangles in MeshData or MeshTransformData tree
+    '''
+    if type(data) == model.MeshTransformData:
+        return sum([counttriangles(c) for c in data.children])
+    elif type(data) == model.MeshData:
+        return len(data.vertex_index)
+    return 0
+
+
+def _facequadrics(vertex, faces):
+    v0 = vertex[faces[:, 0]]
+    n = numpy.cross(vertex[faces[:, 1]] - v0, vertex[faces[:, 2]] - v0)
+    area = numpy.sqrt((n * n).sum(axis=1))
+    valid = area > 0
+    n[valid] /= area[valid][:, None]
+    p = numpy.column_stack([n, -(n * v0).sum(axis=1)])
+    return p[:, :, None] * p[:, None, :] * (area / 2)[:, None, None], n
+
+
+def _boundaryquadrics(vertex, faces, normals, Q):
+    edges = numpy.vstack([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]])
+    owner = numpy.tile(numpy.arange(len(faces)), 3)
+    key = numpy.sort(edges, axis=1)
+    uniq, inverse, counts = numpy.unique(key, axis=0, return_inverse=True, return_counts=True)
+    boundary = counts[inverse] == 1
+    if not boundary.any():
+        return
+    a = edges[boundary, 0]
+    b = edges[boundary, 1]
+    d = vertex[b] - vertex[a]
+    n = numpy.cross(d, normals[owner[boundary]])
+    length = numpy.sqrt((n * n).sum(axis=1))
+    valid = length > 0
+    n[valid] /= length[valid][:, None]
+    p = numpy.column_stack([n, -(n * vertex[a]).sum(axis=1)])
+    K = p[:, :, None] * p[:, None, :] * (BOUNDARY_WEIGHT * (d * d).sum(axis=1))[:, None, None]
+    numpy.add.at(Q, a, K)
+    numpy.add.at(Q, b, K)
+
+
+def _quadriccost(Q, p):
+    # error of the quadrics at the positions
+    h = numpy.column_stack([p, numpy.ones(len(p))])
+    return numpy.einsum('ki,kij,kj->k', h, Q, h)
+
+
+def _edgecosts(Q, vertex, i, j):
+    '''
+    Calculate collapse cost and optimal position for edges (i, j)
+    '''
+    Qs = Q[i] + Q[j]
+    candidates = [vertex[i], vertex[j], (vertex[i] + vertex[j]) / 2]
+    A = Qs[:, 0:3, 0:3]
+    det = numpy.linalg.det(A)
+    scale = numpy.trace(A, axis1=1, axis2=2) / 3
+    solvable = numpy.abs(det) > 1e-6 * numpy.abs(scale) ** 3
+    if solvable.any():
+        opt = candidates[2].copy()
+        opt[solvable] = numpy.linalg.solve(A[solvable], -Qs[solvable, 0:3, 3][:, :, None])[:, :, 0]
+        # reject solutions far away from the edge (nearly singular quadric)
+        length = numpy.sqrt(((vertex[i] - vertex[j]) ** 2).sum(axis=1))
+        far = numpy.sqrt(((opt - candidates[2]) ** 2).sum(axis=1)) > length
+        opt[far] = candidates[2][far]
+        candidates.append(opt)
+    costs = numpy.array([_quadriccost(Qs, c) for c in candidates])
+    best = costs.argmin(axis=0)
+    pos = numpy.array(candidates)[best, numpy.arange(len(i))]
+    return costs[best, numpy.arange(len(i))], pos
+
+
+def _normals(tri):
+    '''
+    Calculate (unnormalized) normals of triangles given as [[p1,p2,p3]] * N array
+    '''
+    u = tri[:, 1] - tri[:, 0]
+    v = tri[:, 2] - tri[:, 0]
+    return numpy.column_stack([u[:, 1] * v[:, 2] - u[:, 2] * v[:, 1],
+                               u[:, 2] * v[:, 0] - u[:, 0] * v[:, 2],
+                               u[:, 0] * v[:, 1] - u[:, 1] * v[:, 0]])
+
+
+def _groups(index, size):
+    # order of the index and the size of each group (see _groupmin)
+    return numpy.argsort(index, kind='mergesort'), numpy.bincount(index, minlength=size)
+
+
+def _groupmin(groups, values, fill):
+    # minimum of the values for each index (fill for the index not given)
+    order, counts = groups
+    result = numpy.full(len(counts), fill, dtype=values.dtype)
+    given = counts > 0
+    result[given] = numpy.minimum.reduceat(values[order], (numpy.cumsum(counts) - counts)[given])
+    return result
+
+
+def _independent(faces, edges, nv, passes=16):
+    '''
+    Select the edges (given in order of the costs) which can be collapsed
+    at the same time (no face has the end points of two selected edges),
+    greedily in the order: each pass selects the cheapest of the remaining
+    edges around their end points and removes the edges next to them
+    '''
+    n = len(edges)
+    # only the faces around the end points can have two of them
+    ends = numpy.zeros(nv, dtype=bool)
+    ends[edges.reshape(-1)] = True
+    faces = faces[ends[faces].any(axis=1)]
+    rank = numpy.arange(n)
+    remaining = numpy.ones(n, dtype=bool)
+    taken = numpy.zeros(nv, dtype=bool)
+    endgroups = _groups(edges.T.reshape(-1), nv)
+    facegroups = _groups(faces.T.reshape(-1), nv)
+    selected = []
+    for p in range(passes):
+        # cheapest remaining edge having the end point in each face
+        r = numpy.where(remaining, rank, n)
+        facerank = _groupmin(endgroups, numpy.concatenate([r, r]), n)[faces].min(axis=1)
+        best = _groupmin(facegroups, numpy.tile(facerank, 3), n)
+        new = remaining & (best[edges[:, 0]] == rank) & (best[edges[:, 1]] == rank)
+        selected.append(numpy.flatnonzero(new))
+        # vertices next to the end points of the selected edges
+        ends = numpy.zeros(nv, dtype=bool)
+        ends[edges[new].reshape(-1)] = True
+        taken[faces[ends[faces].any(axis=1)].reshape(-1)] = True
+        remaining = remaining & ~taken[edges[:, 0]] & ~taken[edges[:, 1]]
+        if not remaining.any():
+            break
+    return numpy.sort(numpy.concatenate(selected))
+
+
+def _ragged(start, length):
+    # owner and index of start[k] ... start[k] + length[k] - 1 for each k
+    owner = numpy.repeat(numpy.arange(len(start)), length)
+    offset = numpy.arange(len(owner)) - numpy.repeat(numpy.cumsum(length) - length, length)
+    return owner, numpy.repeat(start, length) + offset
+
+
+def _manifold(edges, shared, nv, i, j):
+    '''
+    Check whether the edges (i, j) can be collapsed keeping the surface
+    manifold (link condition): the end points have no common neighbors
+    other than the vertices of the shared faces
+
+    :param edges: all the edges of the mesh
+    :param shared: number of the faces sharing each edge (i, j)
+    '''
+    m = len(i)
+    ends = numpy.zeros(nv, dtype=bool)
+    ends[i] = True
+    ends[j] = True
+    edges = edges[ends[edges].any(axis=1)]
+    u = numpy.concatenate([edges[:, 0], edges[:, 1]])
+    w = numpy.concatenate([edges[:, 1], edges[:, 0]])
+    w = w[numpy.argsort(u, kind='mergesort')]
+    degree = numpy.bincount(u, minlength=nv)
+    start = numpy.cumsum(degree) - degree
+    ends = numpy.concatenate([i, j])
+    owner, idx = _ragged(start[ends], degree[ends])
+    owner = owner % m
+    keys, counts = numpy.unique(owner * nv + w[idx], return_counts=True)
+    common = numpy.bincount(keys[counts > 1] // nv, minlength=m)
+    return common <= shared
+
+
+def _unflipped(faces, vertex, i, j, positions):
+    '''
+    Choose the positions to collapse the independent edges (i, j) to,
+    rejecting the positions which flip the neighbor faces
+
+    :param positions: positions to collapse the edges to in order of preference (nan if not allowed)
+    :returns: whether any of the positions is allowed for each edge and the position
+    '''
+    nv = len(vertex)
+    m = len(i)
+    # each face is around one edge at most
+    vowner = numpy.full(nv, -1)
+    vowner[i] = numpy.arange(m)
+    vowner[j] = numpy.arange(m)
+    fowner = vowner[faces].max(axis=1)
+    around = fowner >= 0
+    f, o = faces[around], fowner[around]
+    moved = (f == i[o][:, None]) | (f == j[o][:, None])
+    keep = moved.sum(axis=1) == 1
+    f, o, moved = f[keep], o[keep], moved[keep]
+    before = vertex[f]
+    normals = _normals(before)
+    rows = numpy.nonzero(moved)[0]
+    done = numpy.zeros(m, dtype=bool)
+    pos = numpy.zeros((m, 3))
+    for p in positions:
+        after = before.copy()
+        after[moved] = numpy.nan_to_num(p)[o][rows]
+        flipped = numpy.isnan(p[:, 0])
+        flipped[o[(normals * _normals(after)).sum(axis=1) <= 0]] = True
+        use = ~done & ~flipped
+        pos[use] = p[use]
+        done = done | use
+    return done, pos
+
+
+def simplify(data, target):
+    '''
+    Simplify MeshData to the target number of triangles using quadric
+    edge collapse
+
+    Vertices with the same position (and texture coordinate) are welded
+    before simplification. Texture coordinates are kept when they share
+    the index with vertices, vertex normals are recalculated.
+
+    :param data: MeshData to simplify (not modified)
+    :param target: target number of triangles
+    :returns: simplified MeshData
+    '''
+    faces = numpy.asarray(data.vertex_index)
+    if faces.ndim != 2 or faces.shape[1] != 3 or len(faces) <= target:
+        return data
+    vertex = numpy.asarray(data.vertex, dtype=float)
+    uv = None
+    if data.uvmap is not None and numpy.array_equal(data.uvmap_index, faces):
+        uv = numpy.asarray(data.uvmap, dtype=float)
+
+    # weld vertices
+    key = vertex if uv is None else numpy.hstack([vertex, uv])
+    uniq, inverse = numpy.unique(key, axis=0, return_inverse=True)
+    vertex = uniq[:, 0:3].copy()
+    if uv is not None:
+        uv = uniq[:, 3:5]
+    faces = inverse[faces]
+    faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 2] != faces[:, 0])]
+
+    K, normals = _facequadrics(vertex, faces)
+    Q = numpy.zeros((len(vertex), 4, 4))
+    for k in range(3):
+        numpy.add.at(Q, faces[:, k], K)
+    _boundaryquadrics(vertex, faces, normals, Q)
+
+    # edges are collapsed in rounds: the cheapest edges of which no face
+    # has the end points of two are collapsed at the same time
+    nv = len(vertex)
+    tolerance = 1e-12 * numpy.ptp(vertex, axis=0).max() ** 4
+    blocked = numpy.zeros(0, dtype=int)
+    moved = numpy.ones(nv, dtype=bool)
+    cachekeys, cachecosts, cachepos = numpy.zeros(0, dtype=int), numpy.zeros(0), numpy.zeros((0, 3))
+    while len(faces) > target:
+        pairs = numpy.sort(numpy.vstack([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]]), axis=1)
+        keys, counts = numpy.unique(pairs[:, 0] * nv + pairs[:, 1], return_counts=True)
+        edges = numpy.column_stack([keys // nv, keys % nv])
+        # costs are calculated again only for the edges around the moved vertices
+        hit = ~moved[edges[:, 0]] & ~moved[edges[:, 1]]
+        cached = numpy.searchsorted(cachekeys, keys[hit])
+        costs = numpy.empty(len(keys))
+        pos = numpy.empty((len(keys), 3))
+        costs[hit], pos[hit] = cachecosts[cached], cachepos[cached]
+        if not hit.all():
+            costs[~hit], pos[~hit] = _edgecosts(Q, vertex, edges[~hit, 0], edges[~hit, 1])
+        cachekeys, cachecosts, cachepos = keys, costs, pos
+        # edges failed to collapse are skipped until their neighborhoods change
+        candidates = numpy.flatnonzero(~numpy.in1d(keys, blocked))
+        if len(candidates) == 0:
+            break
+        # collapse the cheapest edges in the round (edges of the same cost
+        # are taken in hashed order to spread them over the surface)
+        spread = (keys[candidates] * 2654435761) % 4294967296
+        order = numpy.lexsort((spread, costs[candidates]))[0:len(candidates) // ROUND_DIVISOR + 1]
+        e = candidates[order]
+        # edges breaking the surface are rejected before the selection so
+        # that they do not keep the edges next to them from collapsing
+        manifold = _manifold(edges, counts[e], nv, edges[e, 0], edges[e, 1])
+        rejected = e[~manifold]
+        e = e[manifold]
+        e = e[_independent(faces, edges[e], nv)]
+        i, j, pos = edges[e, 0], edges[e, 1], pos[e]
+        # end points are tried when the optimal position flips the faces
+        # (as good as the optimal position on flat surfaces)
+        Qs = Q[i] + Q[j]
+        positions = [pos]
+        for v in (vertex[i], vertex[j]):
+            worse = _quadriccost(Qs, v) > costs[e] + tolerance
+            positions.append(numpy.where(worse[:, None], numpy.nan, v))
+        ok, pos = _unflipped(faces, vertex, i, j, positions)
+        # stop collapsing at the target
+        removes = counts[e] * ok
+        ok = ok & (len(faces) - (numpy.cumsum(removes) - removes) > target)
+        touched = numpy.zeros(nv, dtype=bool)
+        touched[faces[numpy.in1d(faces, numpy.concatenate([i[ok], j[ok]])).reshape(-1, 3).any(axis=1)]] = True
+        blocked = numpy.concatenate([blocked, keys[rejected], i[~ok] * nv + j[~ok]])
+        blocked = blocked[~(touched[blocked // nv] | touched[blocked % nv])]
+        # collapse j into i
+        i, j = i[ok], j[ok]
+        vertex[i] = pos[ok]
+        moved[:] = False
+        moved[i] = True
+        Q[i] += Q[j]
+        remap = numpy.arange(nv)
+        remap[j] = i
+        faces = remap[faces]
+        faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 2] != faces[:, 0])]
+
+    # compact the result
+    used, remap = numpy.unique(faces, return_inverse=True)
+    s = model.MeshData()
+    s.vertex = vertex[used]
+    s.vertex_index = remap.reshape(-1, 3)
+    s.material = data.material
+    if uv is not None:
+        s.uvmap = uv[used]
+        s.uvmap_index = s.vertex_index
+    if data.normal is not None:
+        s.normal = vertexnormals(s.vertex, s.vertex_index)
+        s.normal_index = s.vertex_index
+    return s
+
+
+def vertexnormals(vertex, faces):
+    '''
+    Calculate area weighted vertex normals
+
+    >>> data = grid(2)
+    >>> numpy.allclose(vertexnormals(data.vertex, data.vertex_index), [0, 0, 1])
+    True
+    '''
+    v0 = vertex[faces[:, 0]]
+    n = numpy.cross(vertex[faces[:, 1]] - v0, vertex[faces[:, 2]] - v0)
+    vn = numpy.zeros((len(vertex), 3))
+    for k in range(3):
+        numpy.add.at(vn, faces[:, k], n)
+    length = numpy.sqrt((vn * vn).sum(axis=1))
+    length[length == 0] = 1
+    return vn / length[:, None]
+
+
+def simplifydata(data, target):
+    '''
+    Simplify MeshData or MeshTransformData tree to the target number of
+    triangles (distributed to each mesh in proportion to its size)
+
+    The tree is copied so that meshes shared with other shapes are not
+    modified.
+    '''
+    total = counttriangles(data)
+    if total <= target:
+        return data
+    return _simplifytree(data, float(target) / total)
+
+
+def _simplifytree(data, ratio):
+    if type(data) == model.MeshTransformData:
+        m = model.MeshTransformData()
+        m.matrix = data.matrix
+        m.trans = data.trans
+        m.rot = data.rot
+        m.scale = data.scale
+        m.children = [_simplifytree(c, ratio) for c in data.children]
+        return m
+    elif type(data) == model.MeshData:
+        return simplify(data, max(int(len(data.vertex_index) * ratio), 4))
+    return data
+
+
+def applybudget(shapes, budget, targets=None):
+    '''
+    Simplify mesh shapes in the list so that the total number of
+    triangles fits in the budget
+
+    :param shapes: list of ShapeModel
+    :param budget: total number of triangles (None to apply only per shape targets)
+    :param targets: dictionary of target number of triangles for each shape name (optional)
+    '''
+    if targets is None:
+        targets = {}
+    meshes = [s for s in shapes if s.shapeType == model.ShapeModel.SP_MESH and s.data is not None]
+    for s in meshes:
+        if s.name in targets:
+            s.data = simplifydata(s.data, targets[s.name])
+    if budget is None:
+        return
+    total = sum([counttriangles(s.data) for s in meshes])
+    if total <= budget:
+        return
+    ratio = float(budget) / total
+    for s in meshes:
+        s.data = simplifydata(s.data, int(counttriangles(s.data) * ratio))
+
+
+def shapetarget(targets, linkname, shape):
+    '''
+    Find target number of triangles of the shape
+
+    :param targets: dictionary of target number of triangles keyed by LINK/NAME or NAME of the shapes
+    :param linkname: name of the link the shape belongs to
+    :param shape: ShapeModel
+    :returns: target number of triangles (None if not given)
+
+    >>> s = model.ShapeModel()
+    >>> s.name = 'visual0'
+    >>> [shapetarget(t, 'l1', s) for t in [{'l1/visual0': 8, 'visual0': 16}, {'visual0': 16}, {'l2/visual0': 8}]]
+    [8, 16, None]
+    '''
+    if linkname is not None and '%s/%s' % (linkname, shape.name) in targets:
+        return targets['%s/%s' % (linkname, shape.name)]
+    return targets.get(shape.name)
+
+
+def decimate(bm, visualbudget=None, collisionbudget=None, targets=None):
+    '''
+    Simplify mesh shapes of the body to fit in the triangle budgets
+
+    :param bm: BodyModel
+    :param visualbudget: total number of triangles for visual shapes (optional)
+    :param collisionbudget: total number of triangles for collision shapes (optional)
+    :param targets: dictionary of target number of triangles keyed by LINK/NAME or NAME of the shapes (optional)
+    '''
+    visuals = []
+    collisions = []
+    for l in bm.links:
+        for s in l.visuals + l.collisions:
+            target = shapetarget(targets or {}, l.name, s)
+            if target is not None and s.shapeType == model.ShapeModel.SP_MESH and s.data is not None:
+                s.data = simplifydata(s.data, target)
+        visuals.extend(l.visuals)
+        collisions.extend(l.collisions)
+    applybudget(visuals, visualbudget)
+    applybudget(collisions, collisionbudget)
@@ -0,0 +1,314 @@
+# -*- coding:utf-8 -*-
+
+"""Writer for binary glTF (GLB) format
+
+:Organization:
+ AIST
+
+Requirements
+------------
+* numpy
+
+Examples
+--------
+
+Write mesh shape in GLB format
+
+>>> import tempfile
+>>> s = model.ShapeModel()
+>>> s.shapeType = model.ShapeModel.SP_MESH
+>>> s.data = model.MeshData()
+>>> s.data.vertex = numpy.array([[0, 0, 0], [1, 0, 0], [0, 1, 0]], dtype=float)
+>>> s.data.vertex_index = numpy.array([[0, 1, 2]])
+>>> s.data.material = model.MaterialModel()
+>>> fd, fname = tempfile.mkstemp(suffix='.glb')
+>>> os.close(fd)
+>>> GLTFWriter().write(s, fname)
+>>> header = open(fname, 'rb').read(12)
+>>> header[0:4], struct.unpack('<I', header[4:8])[0]
+('glTF', 2)
+>>> struct.unpack('<I', header[8:12])[0] == os.path.getsize(fname)
+True
+
+Quantized attributes use KHR_mesh_quantization extension
+
+>>> GLTFWriter(quantize=True).write(s, fname)
+>>> data = open(fname, 'rb').read()
+>>> 'KHR_mesh_quantization' in data
+True
+
+Chunks are padded to 4 bytes (odd number of 16 bit indices here)
+
+>>> jsonlength = struct.unpack('<I', data[12:16])[0]
+>>> binlength = struct.unpack('<I', data[20 + jsonlength:24 + jsonlength])[0]
+>>> len(data) % 4, binlength % 4, len(data) == 28 + jsonlength + binlength
+(0, 0, True)
+>>> os.unlink(fname)
+"""
+
+from __future__ import absolute_import
+from . import model
+from . import utils
+from . import sink
+import os
+import json
+import struct
+import numpy
+
+# component types defined in glTF specification
+GL_BYTE = 5120
+GL_UNSIGNED_BYTE = 5121
+GL_SHORT = 5122
+GL_UNSIGNED_SHORT = 5123
+GL_UNSIGNED_INT = 5125
+GL_FLOAT = 5126
+
+GL_ARRAY_BUFFER = 34962
+GL_ELEMENT_ARRAY_BUFFER = 34963
+
+_componenttypes = {
+    numpy.dtype(numpy.int8): GL_BYTE,
+    numpy.dtype(numpy.uint8): GL_UNSIGNED_BYTE,
+    numpy.dtype(numpy.int16): GL_SHORT,
+    numpy.dtype(numpy.uint16): GL_UNSIGNED_SHORT,
+    numpy.dtype(numpy.uint32): GL_UNSIGNED_INT,
+    numpy.dtype(numpy.float32): GL_FLOAT
+}
+
+_accessortypes = {1: 'SCALAR', 2: 'VEC2', 3: 'VEC3', 4: 'VEC4'}
+
+
+def _align(n, alignment=4):
+    return (n + alignment - 1) // alignment * alignment
+
+
+class GLTFWriter(utils.Reentrant):
+    '''
+    GLTF (binary) writer class
+    '''
+    def __init__(self, quantize=False):
+        self.quantize = quantize  #: Store vertex attributes in quantized integer format
+        self._reset()
+
+    def _reset(self):
+        self._doc = None
+        self._chunks = []
+        self._offset = 0
+        self._materialmap = {}
+
+    def write(self, m, f):
+        '''
+        Write mesh shape in GLB format
+        '''
+        self._context()._write(m, f)
+
+    def _write(self, m, f):
+        self._doc = {
+            'asset': {'version': '2.0', 'generator': 'simtrans'},
+            'scene': 0,
+            'scenes': [{'nodes': []}],
+            'nodes': [],
+            'meshes': [],
+            'materials': [],
+            'accessors': [],
+            'bufferViews': [],
+            'buffers': []
+        }
+        self._chunks = []
+        self._offset = 0
+        self._materialmap = {}
+        root = self.convertchild(m.data)
+        if root is not None:
+            self._doc['scenes'][0]['nodes'].append(root)
+        if self.quantize:
+            self._doc['extensionsUsed'] = ['KHR_mesh_quantization']
+            self._doc['extensionsRequired'] = ['KHR_mesh_quantization']
+        # the chunk (and the buffer) is padded to 4 bytes at the end
+        self._offset = _align(self._offset)
+        self._doc['buffers'].append({'byteLength': self._offset})
+        for k in ['meshes', 'materials', 'accessors', 'bufferViews', 'images', 'samplers', 'textures']:
+            if k in self._doc and len(self._doc[k]) == 0:
+                del self._doc[k]
+
+        header = json.dumps(self._doc, separators=(',', ':'))
+        header = header + ' ' * (_align(len(header)) - len(header))
+        total = 12 + 8 + len(header) + 8 + self._offset
+        with sink.open(f, 'wb') as ofile:
+            ofile.write(struct.pack('<4sII', 'glTF', 2, total))
+            ofile.write(struct.pack('<I4s', len(header), 'JSON'))
+            ofile.write(header)
+            ofile.write(struct.pack('<I4s', self._offset, 'BIN\0'))
+            # array buffers are passed to the file without intermediate copies
+            pos = 0
+            for offset, a in self._chunks:
+                ofile.write('\0' * (offset - pos))
+                ofile.write(memoryview(a))
+                pos = offset + a.nbytes
+            ofile.write('\0' * (self._offset - pos))
+
+    def convertchild(self, d):
+        '''
+        Convert MeshTransformData or MeshData to glTF node and return the
+        node index
+        '''
+        node = {}
+        if type(d) == model.MeshTransformData:
+            if d.matrix is not None:
+                node['matrix'] = numpy.asarray(d.matrix, dtype=float).T.reshape(16).tolist()
+            children = []
+            for c in d.children:
+                cn = self.convertchild(c)
+                if cn is not None:
+                    children.append(cn)
+            if len(children) > 0:
+                node['children'] = children
+        elif type(d) == model.MeshData:
+            primitive = self.convertmesh(d, node)
+            if primitive is None:
+                return None
+            self._doc['meshes'].append({'primitives': [primitive]})
+            node['mesh'] = len(self._doc['meshes']) - 1
+        else:
+            return None
+        self._doc['nodes'].append(node)
+        return len(self._doc['nodes']) - 1
+
+    def convertmesh(self, d, node):
+        '''
+        Convert MeshData to glTF primitive (dequantization transform will
+        be stored in the node)
+        '''
+        vertex_index = numpy.asarray(d.vertex_index)
+        if len(d.vertex) == 0 or vertex_index.ndim != 2 or vertex_index.shape[1] != 3:
+            return None
+        vertex = numpy.asarray(d.vertex)
+        normal = None
+        uvmap = None
+        if d.normal is not None:
+            normal = numpy.asarray(d.normal)
+        if d.uvmap is not None:
+            uvmap = numpy.asarray(d.uvmap)
+
+        # glTF uses single index for all attributes
+        unified = True
+        if normal is not None and not numpy.array_equal(d.normal_index, vertex_index):
+            unified = False
+        if uvmap is not None and not numpy.array_equal(d.uvmap_index, vertex_index):
+            unified = False
+        if unified:
+            indices = vertex_index.reshape(-1)
+        else:
+            vertex = vertex[vertex_index.reshape(-1)]
+            if normal is not None:
+                normal = normal[numpy.asarray(d.normal_index).reshape(-1)]
+            if uvmap is not None:
+                uvmap = uvmap[numpy.asarray(d.uvmap_index).reshape(-1)]
+            indices = numpy.arange(len(vertex))
+
+        attributes = {}
+        if self.quantize:
+            # positions are stored in unsigned short with uniform scale
+            # (dequantized by the node transform to keep normals intact)
+            minv = vertex.min(axis=0)
+            scale = max((vertex.max(axis=0) - minv).max() / 65535.0, 1e-12)
+            q = numpy.zeros((len(vertex), 4), dtype=numpy.uint16)
+            q[:, 0:3] = numpy.rint((vertex - minv) / scale)
+            attributes['POSITION'] = self.addaccessor(q, GL_ARRAY_BUFFER, 3, minmax=True)
+            matrix = numpy.identity(4) * scale
+            matrix[0:3, 3] = minv
+            matrix[3, 3] = 1.0
+            node['matrix'] = matrix.T.reshape(16).tolist()
+            if normal is not None:
+                n = numpy.zeros((len(normal), 4), dtype=numpy.int8)
+                n[:, 0:3] = numpy.rint(numpy.clip(normal, -1, 1) * 127)
+                attributes['NORMAL'] = self.addaccessor(n, GL_ARRAY_BUFFER, 3, normalized=True)
+            if uvmap is not None:
+                uv = numpy.column_stack([uvmap[:, 0], 1.0 - uvmap[:, 1]])
+                if uv.min() >= 0 and uv.max() <= 1:
+                    attributes['TEXCOORD_0'] = self.addaccessor(numpy.rint(uv * 65535).astype(numpy.uint16), GL_ARRAY_BUFFER, normalized=True)
+                else:
+                    attributes['TEXCOORD_0'] = self.addaccessor(uv.astype(numpy.float32), GL_ARRAY_BUFFER)
+        else:
+            attributes['POSITION'] = self.addaccessor(numpy.ascontiguousarray(vertex, dtype=numpy.float32), GL_ARRAY_BUFFER, minmax=True)
+            if normal is not None:
+                attributes['NORMAL'] = self.addaccessor(numpy.ascontiguousarray(normal, dtype=numpy.float32), GL_ARRAY_BUFFER)
+            if uvmap is not None:
+                uv = numpy.column_stack([uvmap[:, 0], 1.0 - uvmap[:, 1]])
+                attributes['TEXCOORD_0'] = self.addaccessor(uv.astype(numpy.float32), GL_ARRAY_BUFFER)
+
+        if self.quantize and len(vertex) < 65536:
+            indices = numpy.ascontiguousarray(indices, dtype=numpy.uint16)
+        else:
+            indices = numpy.ascontiguousarray(indices, dtype=numpy.uint32)
+        primitive = {
+            'attributes': attributes,
+            'indices': self.addaccessor(indices, GL_ELEMENT_ARRAY_BUFFER, 1),
+            'mode': 4
+        }
+        if d.material is not None:
+            primitive['material'] = self.convertmaterial(d.material)
+        return primitive
+
+    def convertmaterial(self, m):
+        '''
+        Convert MaterialModel to glTF material and return the index
+        '''
+        try:
+            return self._materialmap[id(m)]
+        except KeyError:
+            pass
+        pbr = {'metallicFactor': 0.0, 'roughnessFactor': 1.0}
+        if m.diffuse is not None:
+            color = [float(c) for c in m.diffuse][0:4]
+            if len(color) == 3:
+                color.append(1.0)
+            pbr['baseColorFactor'] = color
+        if m.texture is not None:
+            self._doc.setdefault('images', []).append({'uri': m.texture})
+            self._doc.setdefault('samplers', [{}])
+            self._doc.setdefault('textures', []).append({'source': len(self._doc['images']) - 1, 'sampler': 0})
+            pbr['baseColorTexture'] = {'index': len(self._doc['textures']) - 1}
+            pbr['baseColorFactor'] = [1.0, 1.0, 1.0, 1.0]
+        mat = {'pbrMetallicRoughness': pbr, 'doubleSided': True}
+        if m.name is not None:
+            mat['name'] = m.name
+        self._doc['materials'].append(mat)
+        self._materialmap[id(m)] = len(self._doc['materials']) - 1
+        return self._materialmap[id(m)]
+
+    def addaccessor(self, a, target, components=None, normalized=False, minmax=False):
+        '''
+        Register the array to the binary chunk and return the accessor index
+
+        :param a: contiguous numpy array ([element] * N)
+        :param target: GL_ARRAY_BUFFER or GL_ELEMENT_ARRAY_BUFFER
+        :param components: number of components actually used in each element (optional)
+        :param normalized: whether integer values are normalized
+        :param minmax: whether to store min and max values
+        '''
+        offset = _align(self._offset)
+        self._chunks.append((offset, a))
+        self._offset = offset + a.nbytes
+        view = {'buffer': 0, 'byteOffset': offset, 'byteLength': a.nbytes, 'target': target}
+        width = 1
+        if a.ndim == 2:
+            width = a.shape[1]
+        if components is None:
+            components = width
+        if target == GL_ARRAY_BUFFER:
+            view['byteStride'] = width * a.itemsize
+        self._doc['bufferViews'].append(view)
+        accessor = {
+            'bufferView': len(self._doc['bufferViews']) - 1,
+            'componentType': _componenttypes[a.dtype],
+            'count': len(a),
+            'type': _accessortypes[components]
+        }
+        if normalized:
+            accessor['normalized'] = True
+        if minmax:
+            used = a.reshape(len(a), width)[:, 0:components]
+            accessor['min'] = used.min(axis=0).tolist()
+            accessor['max'] = used.max(axis=0).tolist()
+        self._doc['accessors'].append(accessor)
+        return len(self._doc['accessors']) - 1
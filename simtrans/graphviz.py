@@ -29,6 +29,9 @@ Write simulation model in graphviz dot format
 >>> w.write(m, '/tmp/pa10.dot')
 """
 
+from . import sink
+
+
 class GraphvizWriter(object):
     '''
     Graphviz writer class
@@ -36,12 +39,14 @@ class GraphvizWriter(object):
     def __init__(self):
         self._linkmap = {}
 
-    def write(self, mdata, fname):
+    def write(self, mdata, fname, manifest=None):
         '''
         Write simulation model in graphviz dot format
         '''
-        with open(fname, 'w') as f:
+        with sink.open(fname, 'w') as f:
             f.write("digraph model {\n")
             for j in mdata.joints:
                 f.write('   %s -> %s [label="%s"]\n' % (j.parent, j.child, j.name))
             f.write("}\n")
+        if manifest is not None:
+            manifest.addoutput(fname)
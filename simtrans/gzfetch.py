@@ -1,39 +1,492 @@
 # -*- coding:utf-8 -*-
 
 """Utility command to fetch simulation model from gazebo's model database
+
+The models are downloaded from the model database (``model.tar.gz`` of
+each model under the database URI, as gazebo does) and unpacked into
+``~/.gazebo/models`` by a pool of threads. The models which the fetched
+models depend on (``<depend>`` in model.config) are also fetched.
+
+Interrupted downloads are resumed by HTTP range requests, archives are
+verified by MD5 checksum (ETag or Content-MD5 given by the server) and
+models are skipped when the server tells they are not modified. The
+database can also be a local directory of the same layout, and the
+downloaded archives can be kept in a mirror directory which can be used
+as the database later.
+
+:Organization:
+ AIST
+
+Examples
+--------
+
+Fetch the model and the model it depends on from a local mirror
+
+>>> import tempfile, tarfile, StringIO
+>>> mirror = tempfile.mkdtemp()
+>>> def addmodel(name, config):
+...     os.mkdir(os.path.join(mirror, name))
+...     with tarfile.open(os.path.join(mirror, name, 'model.tar.gz'), 'w:gz') as t:
+...         info = tarfile.TarInfo(name + '/model.config')
+...         info.size = len(config)
+...         t.addfile(info, StringIO.StringIO(config))
+>>> addmodel('table', '<model><name>table</name><depend><model><uri>model://wood</uri></model></depend></model>')
+>>> addmodel('wood', '<model><name>wood</name></model>')
+>>> dest = tempfile.mkdtemp()
+>>> f = Fetcher(uri=mirror, dest=dest)
+>>> sorted([(r['name'], r['status']) for r in f.fetchall(['table'])])
+[('table', 'fetched'), ('wood', 'fetched')]
+>>> os.path.exists(os.path.join(dest, 'wood', 'model.config'))
+True
+
+Models not modified are skipped
+
+>>> [r['status'] for r in f.fetchall(['table'])]
+['uptodate', 'uptodate']
+
+Members written outside of the model directory are not unpacked
+
+>>> os.mkdir(os.path.join(mirror, 'evil'))
+>>> with tarfile.open(os.path.join(mirror, 'evil', 'model.tar.gz'), 'w:gz') as t:
+...     link = tarfile.TarInfo('evil/link')
+...     link.type, link.linkname = tarfile.SYMTYPE, dest
+...     t.addfile(link)
+...     info = tarfile.TarInfo('evil/link/owned.txt')
+...     t.addfile(info, StringIO.StringIO(''))
+>>> r = f.fetch('evil')
+>>> r['status'], r['message'].startswith('unsafe path in the archive')
+('error', True)
+>>> os.path.exists(os.path.join(dest, 'owned.txt'))
+False
+
+Fetch the model from HTTP server (serving ETag and byte ranges as the
+model database does)
+
+>>> import threading, BaseHTTPServer, SocketServer
+>>> class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+...     cut = False
+...     corrupt = False
+...     def do_GET(self):
+...         with open(os.path.join(mirror, self.path.lstrip('/')), 'rb') as f:
+...             data = f.read()
+...         etag = '"%s"' % hashlib.md5(data).hexdigest()
+...         if self.headers.get('If-None-Match') == etag:
+...             self.send_response(304)
+...             self.end_headers()
+...             return
+...         start = int(self.headers.get('Range', 'bytes=0-')[6:-1])
+...         if start >= len(data):
+...             self.send_response(416)
+...             self.end_headers()
+...             return
+...         self.send_response(206 if start > 0 else 200)
+...         if start > 0:
+...             self.send_header('Content-Range', 'bytes %i-%i/%i' % (start, len(data) - 1, len(data)))
+...         self.send_header('ETag', etag)
+...         self.send_header('Content-Length', str(len(data) - start))
+...         self.end_headers()
+...         if Handler.corrupt:
+...             data = data[:-1] + chr(ord(data[-1]) ^ 1)
+...         if Handler.cut:
+...             # close the connection in the middle of the download
+...             Handler.cut = False
+...             data = data[:len(data) // 2]
+...         self.wfile.write(data[start:])
+...     def log_message(self, *args):
+...         pass
+>>> server = SocketServer.TCPServer(('127.0.0.1', 0), Handler)
+>>> t = threading.Thread(target=server.serve_forever)
+>>> t.start()
+>>> uri = 'http://127.0.0.1:%i' % server.server_address[1]
+>>> dest2 = tempfile.mkdtemp()
+>>> f2 = Fetcher(uri=uri, dest=dest2)
+>>> [r['status'] for r in f2.fetchall(['wood'])]
+['fetched']
+>>> os.path.exists(os.path.join(dest2, 'wood', 'model.config'))
+True
+
+Models not modified on the server are skipped (If-None-Match)
+
+>>> [r['status'] for r in f2.fetchall(['wood'])]
+['uptodate']
+
+Interrupted download is resumed by the range request
+
+>>> Handler.cut = True
+>>> r = Fetcher(uri=uri, dest=dest2, force=True).fetch('table')
+>>> r['status'], 'is interrupted' in r['message']
+('error', True)
+>>> r = Fetcher(uri=uri, dest=dest2, force=True).fetch('table')
+>>> r['status'], r['bytes'] < os.path.getsize(os.path.join(mirror, 'table', 'model.tar.gz'))
+('resumed', True)
+>>> os.path.exists(os.path.join(dest2, 'table', 'model.config'))
+True
+
+Archive not matching the checksum is discarded
+
+>>> Handler.corrupt = True
+>>> r = Fetcher(uri=uri, dest=dest2, force=True).fetch('wood')
+>>> r['status'], r['message'].startswith('checksum of')
+('error', True)
+>>> os.path.exists(f2.workfile('wood') + '.part')
+False
+>>> Handler.corrupt = False
+
+Partial download longer than the archive (416 to the range request) is
+downloaded again
+
+>>> with open(f2.workfile('wood') + '.part', 'wb') as part:
+...     part.write(' ' * 65536)
+>>> Fetcher(uri=uri, dest=dest2, force=True).fetch('wood')['status']
+'fetched'
+>>> server.shutdown()
+>>> server.server_close()
+>>> import shutil
+>>> for d in [mirror, dest, dest2]:
+...     shutil.rmtree(d)
 """
 
 import os
+import re
 import sys
+import time
+import json
+import base64
+import shutil
+import hashlib
+import tarfile
+import urllib2
+import threading
+import lxml.etree
+from multiprocessing.pool import ThreadPool
 from optparse import OptionParser, OptionError
-import subprocess
-import tempfile
-import jinja2
-
-
-def renderworld(models):
-    fd, worldfile = tempfile.mkstemp(suffix='.world')
-    os.close(fd)
-    with open(worldfile, 'w') as ofile:
-        ofile.write(jinja2.Template('''<?xml version="1.0" ?>
-<sdf version="1.5">
-  <world name="default">
-{%- for m in models %}
-    <include>
-      <uri>model://{{m}}</uri>
-    </include>
-{%- endfor %}
-  </world>
-</sdf>
-''').render({'models': models}))
-    return worldfile
+
+DATABASE = 'http://models.gazebosim.org'  #: Default URI of the model database
+STATEFILE = '.gzfetch.json'  #: File in the model directory recording the fetched archive
+CHUNKSIZE = 1 << 16
+
+
+def databaseuri():
+    '''
+    Get URI of the model database (GAZEBO_MODEL_DATABASE_URI or the default)
+    '''
+    return os.environ.get('GAZEBO_MODEL_DATABASE_URI', DATABASE).rstrip('/')
+
+
+def modeluri(name):
+    '''
+    Get name of the model from model:// URI
+
+    >>> modeluri('model://table')
+    'table'
+    >>> modeluri('model://table/meshes/table.dae')
+    'table'
+    '''
+    return name.replace('model://', '').strip('/').split('/')[0]
+
+
+def worldmodels(fname):
+    '''
+    Get names of the models included in the world file
+    '''
+    d = lxml.etree.parse(fname)
+    return [modeluri(u.text.strip()) for u in d.findall('.//include/uri') if u.text.strip().startswith('model://')]
+
+
+def dependencies(dirname):
+    '''
+    Get names of the models which the model depends on (listed in model.config)
+    '''
+    config = os.path.join(dirname, 'model.config')
+    if not os.path.exists(config):
+        return []
+    d = lxml.etree.parse(config)
+    return [modeluri(u.text.strip()) for u in d.findall('depend/model/uri')]
+
+
+def md5sum(fname):
+    '''
+    Calculate MD5 checksum of the file
+    '''
+    h = hashlib.md5()
+    with open(fname, 'rb') as f:
+        while True:
+            b = f.read(CHUNKSIZE)
+            if not b:
+                break
+            h.update(b)
+    return h.hexdigest()
+
+
+def _checksum(headers):
+    # md5 given by the server: ETag of the plain upload (e.g. Amazon S3) or Content-MD5
+    etag = (headers.get('ETag') or '').strip('"')
+    if re.match('^[0-9a-f]{32}$', etag):
+        return etag
+    md5 = headers.get('Content-MD5')
+    if md5:
+        return base64.b64decode(md5).encode('hex')
+    return None
+
+
+def _resolve(path, links):
+    # resolve the path in the archive (None if it goes out of the archive
+    # or through the link)
+    resolved = []
+    for p in path.split('/'):
+        if p in ('', '.'):
+            continue
+        if '/'.join(resolved) in links:
+            return None
+        if p == '..':
+            if len(resolved) == 0:
+                return None
+            resolved.pop()
+        else:
+            resolved.append(p)
+    return '/'.join(resolved)
+
+
+def _unsafemember(members):
+    '''
+    Find the member of the archive which would be written outside of the
+    directory to unpack (None if all the members are safe)
+
+    >>> def member(name, linkname=None):
+    ...     m = tarfile.TarInfo(name)
+    ...     if linkname is not None:
+    ...         m.type, m.linkname = tarfile.SYMTYPE, linkname
+    ...     return m
+    >>> _unsafemember([member('a/model.config'), member('a/meshes'), member('a/link', 'meshes')]) is None
+    True
+    >>> d = member('./')
+    >>> d.type = tarfile.DIRTYPE
+    >>> _unsafemember([d, member('./a/model.config')]) is None
+    True
+    >>> [_unsafemember(ms).name for ms in [[member('../a')], [member('/a')], [member('a/link', '/tmp')],
+    ...                                    [member('a/link', '../..')], [member('a/link', '.'), member('a/link/b')]]]
+    ['../a', '/a', 'a/link', 'a/link', 'a/link/b']
+    '''
+    links = set([_resolve(m.name, ()) for m in members if m.issym() or m.islnk()])
+    for m in members:
+        if os.path.isabs(m.name) or not (m.isfile() or m.isdir() or m.issym() or m.islnk()):
+            return m
+        name = _resolve(m.name, links - set([_resolve(m.name, ())]))
+        if name is None or (name == '' and not m.isdir()):
+            return m
+        if m.issym() or m.islnk():
+            if os.path.isabs(m.linkname):
+                return m
+            # targets of symbolic links are relative to the link
+            target = os.path.join(os.path.dirname(name), m.linkname) if m.issym() else m.linkname
+            if _resolve(target, links) is None:
+                return m
+    return None
+
+
+def _islocal(uri):
+    return uri.startswith('file://') or '://' not in uri
+
+
+class Fetcher(object):
+    '''
+    Fetcher of the models from the model database
+
+    :param uri: URI of the model database (http://, file:// or local directory)
+    :param dest: directory to unpack the models (~/.gazebo/models by default)
+    :param mirror: directory to keep the downloaded archives in the layout of the database (optional)
+    :param jobs: number of the models fetched at the same time
+    :param force: fetch the models even if they are up to date
+    :param timeout: timeout of the HTTP requests in seconds
+    '''
+    def __init__(self, uri=None, dest=None, mirror=None, jobs=4, force=False, timeout=60):
+        self.uri = (uri or databaseuri()).rstrip('/')
+        self.dest = dest or os.path.expanduser('~/.gazebo/models')
+        self.mirror = mirror
+        self.jobs = jobs
+        self.force = force
+        self.timeout = timeout
+        self._lock = threading.Lock()
+
+    def archiveuri(self, name):
+        return '%s/%s/model.tar.gz' % (self.uri, name)
+
+    def state(self, name):
+        '''
+        Get the record of the archive from which the model is unpacked
+        '''
+        fname = os.path.join(self.dest, name, STATEFILE)
+        if not os.path.exists(fname):
+            return {}
+        with open(fname) as f:
+            return json.load(f)
+
+    def workfile(self, name):
+        '''
+        Get path to download the archive of the model
+        '''
+        if self.mirror:
+            return os.path.join(self.mirror, name, 'model.tar.gz')
+        return os.path.join(self.dest, '.download', name + '.tar.gz')
+
+    def fetch(self, name):
+        '''
+        Fetch the model unless it is up to date, returning the result
+        (name, status, time, bytes downloaded and the message)
+        '''
+        start = time.time()
+        result = {'name': name, 'status': 'fetched', 'bytes': 0, 'message': ''}
+        try:
+            if _islocal(self.uri):
+                archive, state = self._local(name, result)
+            else:
+                archive, state = self._download(name, result)
+            if archive is not None:
+                self.unpack(name, archive, state)
+                if not self.mirror and not _islocal(self.uri):
+                    os.unlink(archive)
+        except Exception, e:
+            result['status'] = 'error'
+            result['message'] = str(e)
+        result['time'] = time.time() - start
+        return result
+
+    def _local(self, name, result):
+        dirname = self.uri[len('file://'):] if self.uri.startswith('file://') else self.uri
+        archive = os.path.join(dirname, name, 'model.tar.gz')
+        if not os.path.exists(archive):
+            raise Exception('model is not found in the database: %s' % archive)
+        md5 = md5sum(archive)
+        if not self.force and self.state(name).get('md5') == md5:
+            result['status'] = 'uptodate'
+            return None, None
+        return archive, {'uri': archive, 'md5': md5}
+
+    def _download(self, name, result):
+        uri = self.archiveuri(name)
+        state = self.state(name)
+        work = self.workfile(name)
+        part = work + '.part'
+        if not os.path.exists(os.path.dirname(work)):
+            try:
+                os.makedirs(os.path.dirname(work))
+            except OSError:
+                # created by another thread
+                pass
+        request = urllib2.Request(uri)
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        if offset > 0:
+            request.add_header('Range', 'bytes=%i-' % offset)
+        elif not self.force and state.get('etag') and os.path.isdir(os.path.join(self.dest, name)):
+            request.add_header('If-None-Match', state['etag'])
+        try:
+            response = urllib2.urlopen(request, timeout=self.timeout)
+        except urllib2.HTTPError, e:
+            if e.code == 304:
+                result['status'] = 'uptodate'
+                return None, None
+            if e.code == 416 and offset > 0:
+                # the partial download is no longer valid
+                os.unlink(part)
+                return self._download(name, result)
+            raise Exception('unable to download %s: %s' % (uri, e))
+        headers = response.info()
+        mode = 'wb'
+        if offset > 0:
+            contentrange = headers.get('Content-Range', '')
+            if response.getcode() == 206 and contentrange.startswith('bytes %i-' % offset):
+                mode = 'ab'
+                result['status'] = 'resumed'
+        with open(part, mode) as f:
+            while True:
+                b = response.read(CHUNKSIZE)
+                if not b:
+                    break
+                f.write(b)
+                result['bytes'] = result['bytes'] + len(b)
+        response.close()
+        length = headers.get('Content-Length')
+        if length is not None and result['bytes'] != int(length):
+            # keep the partial file to resume the download next time
+            raise Exception('download of %s is interrupted (%i of %s bytes)' % (uri, result['bytes'], length))
+        md5 = md5sum(part)
+        expected = _checksum(headers)
+        if expected is not None and expected != md5:
+            os.unlink(part)
+            raise Exception('checksum of %s does not match (%s expected but %s)' % (uri, expected, md5))
+        os.rename(part, work)
+        return work, {'uri': uri, 'md5': md5, 'etag': headers.get('ETag')}
+
+    def unpack(self, name, archive, state):
+        '''
+        Unpack the archive of the model and record where it is from
+        '''
+        target = os.path.join(self.dest, name)
+        tmp = os.path.join(self.dest, '.%s.tmp' % name)
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+        with tarfile.open(archive) as t:
+            members = t.getmembers()
+            unsafe = _unsafemember(members)
+            if unsafe is not None:
+                raise Exception('unsafe path in the archive %s: %s' % (archive, unsafe.name))
+            t.extractall(tmp, members)
+        # archives of the database contain the directory of the model
+        entries = os.listdir(tmp)
+        root = tmp
+        if len(entries) == 1 and os.path.isdir(os.path.join(tmp, entries[0])):
+            root = os.path.join(tmp, entries[0])
+        with open(os.path.join(root, STATEFILE), 'w') as f:
+            json.dump(state, f, indent=2, sort_keys=True)
+        with self._lock:
+            if os.path.exists(target):
+                shutil.rmtree(target)
+            os.rename(root, target)
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+
+    def fetchall(self, names, callback=None):
+        '''
+        Fetch the models and the models they depend on in parallel,
+        returning the list of the results
+
+        :param names: names of the models
+        :param callback: function called with each result (optional)
+        '''
+        if not os.path.exists(self.dest):
+            os.makedirs(self.dest)
+        results = []
+        done = set()
+        pool = ThreadPool(max(self.jobs, 1))
+        try:
+            while len(names) > 0:
+                names = [n for n in sorted(set(names)) if n not in done]
+                done.update(names)
+                following = []
+                for r in pool.imap_unordered(self.fetch, names):
+                    results.append(r)
+                    if callback is not None:
+                        callback(r)
+                    if r['status'] != 'error':
+                        following.extend(dependencies(os.path.join(self.dest, r['name'])))
+                names = following
+        finally:
+            pool.close()
+            pool.join()
+        return results
 
 
 def main():
-    usage = '''Usage: %prog [options] model://name
+    usage = '''Usage: %prog [options] model://name ... (or world file)
 Utility command to fetch simulation model from gazebo's model database.'''
     parser = OptionParser(usage=usage)
     parser.add_option('-f', '--fromfile', dest='fromfile', metavar='FILE', help='read list from FILE (optional)')
+    parser.add_option('-u', '--uri', dest='uri', metavar='URI', help='URI of the model database or local mirror directory (default: $GAZEBO_MODEL_DATABASE_URI or %s)' % DATABASE)
+    parser.add_option('-d', '--dest', dest='dest', metavar='DIR', help='directory to unpack the models (default: ~/.gazebo/models)')
+    parser.add_option('-m', '--mirror', dest='mirror', metavar='DIR', help='keep the downloaded archives in DIR (can be used as the database by --uri)')
+    parser.add_option('-j', '--jobs', dest='jobs', metavar='N', type='int', default=4, help='number of models fetched at the same time (default: 4)')
+    parser.add_option('--force', action='store_true', dest='force', default=False, help='fetch even if the model is up to date')
     parser.add_option('-v', '--verbose', action='store_true', dest='verbose', default=False, help='verbose output')
     try:
         options, args = parser.parse_args()
@@ -46,27 +499,27 @@ Utility command to fetch simulation model from gazebo's model database.'''
         print >> sys.stderr, parser.print_help()
         return 1
 
-    # prepare world file which contains required model information
-    worldfile = None
-    needcleanup = False
     if options.fromfile:
-        models = [f.rstrip() for f in open(options.fromfile).readlines()]
-        worldfile = renderworld(models)
-        needcleanup = True
+        models = [modeluri(f.strip()) for f in open(options.fromfile).readlines() if f.strip()]
     elif args[0].count('.world'):
-        worldfile = args[0]
+        models = worldmodels(args[0])
     else:
-        worldfile = renderworld(args)
-        needcleanup = True
+        models = [modeluri(a) for a in args]
 
-    # now fetch the simulation model (run gzserver for only one iteration)
-    print "running gzserver to fetch the models ... (this will take a while)"
-    subprocess.check_output(['gzserver', '--iters', '1', worldfile])
-    print "done!"
-
-    if needcleanup:
-        os.unlink(worldfile)
+    def report(r):
+        print '[%s] %.2fs %s (%i bytes)' % (r['status'], r['time'], r['name'], r['bytes'])
+        if options.verbose or r['status'] == 'error':
+            if r['message']:
+                print '    ' + r['message']
+        sys.stdout.flush()
 
+    fetcher = Fetcher(options.uri, options.dest, options.mirror, options.jobs, options.force)
+    results = fetcher.fetchall(models, report)
+    failed = len([r for r in results if r['status'] == 'error'])
+    if failed > 0:
+        print "%i of %i models failed" % (failed, len(results))
+        return 1
+    print "done!"
     return 0
 
 if __name__ == '__main__':
@@ -0,0 +1,357 @@
+# -*- coding:utf-8 -*-
+
+"""Inspection of the models without conversion
+
+``simtrans info`` reads the model by the existing readers keeping the
+loaders of the meshes (see :func:`simtrans.memory.deferred`) instead of
+loading them, and estimates the cost of the conversion from the headers
+of the asset files: triangle counts of binary STL files, ``count``
+attributes of COLLADA files and image sizes of PNG, JPEG, GIF and BMP
+files.
+
+:Organization:
+ AIST
+
+Examples
+--------
+
+Triangle count of binary STL file is read from the header
+
+>>> import tempfile, struct
+>>> fd, fname = tempfile.mkstemp(suffix='.stl')
+>>> os.write(fd, ' ' * 80 + struct.pack('<I', 2) + '\\0' * 100)
+184
+>>> os.close(fd)
+>>> meshinfo(fname)['triangles']
+2
+>>> os.unlink(fname)
+
+Image size is read from the header
+
+>>> fd, fname = tempfile.mkstemp(suffix='.png')
+>>> os.write(fd, '\\x89PNG\\r\\n\\x1a\\n' + struct.pack('>I', 13) + 'IHDR' + struct.pack('>II', 640, 480))
+24
+>>> os.close(fd)
+>>> imagesize(fname)
+(640, 480)
+>>> os.unlink(fname)
+
+Inspect the model
+
+>>> from . import model
+>>> bm = model.BodyModel()
+>>> bm.links = [model.LinkModel(), model.LinkModel()]
+>>> bm.links[0].name, bm.links[1].name = 'base', 'arm'
+>>> j = model.JointModel()
+>>> j.parent, j.child = 'base', 'arm'
+>>> bm.joints = [j]
+>>> r = summarize(bm)
+>>> r['links'], r['joints'], r['depth']
+(2, 1, 2)
+
+Shapes are listed by their names in each link
+
+>>> s = model.ShapeModel()
+>>> s.name = 'visual0'
+>>> bm.links[1].visuals = [s]
+>>> summarize(bm)['shapesperlink']['arm']
+['visual0']
+"""
+
+import os
+import sys
+import json
+import struct
+from argparse import ArgumentParser
+import lxml.etree
+from . import memory
+from . import registry
+
+parser = ArgumentParser(prog='simtrans info', description='Show size of robot simulation model without converting it.')
+parser.add_argument('fromfile', metavar='FILE', help='model file')
+parser.add_argument('-f', '--from', dest='fromformat', metavar='FORMAT', help='format of the model (optional)')
+parser.add_argument('--top', dest='top', metavar='N', type=int, default=10, help='number of the largest assets and links shown (default: 10)')
+parser.add_argument('--json', dest='json', action='store_true', help='output in JSON format')
+parser.add_argument('-o', '--output', dest='output', metavar='FILE', help='file to write the output to (default: stdout)')
+
+
+def imagesize(fname):
+    '''
+    Read width and height of the image from the file header (None if the
+    format is not supported)
+    '''
+    with open(fname, 'rb') as f:
+        head = f.read(26)
+        if head[0:8] == '\x89PNG\r\n\x1a\n' and head[12:16] == 'IHDR':
+            return struct.unpack('>II', head[16:24])
+        if head[0:4] in ('GIF8',):
+            return struct.unpack('<HH', head[6:10])
+        if head[0:2] == 'BM':
+            w, h = struct.unpack('<ii', head[18:26])
+            return (w, abs(h))
+        if head[0:2] == '\xff\xd8':
+            f.seek(2)
+            while True:
+                marker = f.read(2)
+                if len(marker) < 2 or marker[0] != '\xff':
+                    return None
+                code = ord(marker[1])
+                if code in (0xd8, 0x01) or 0xd0 <= code <= 0xd7:
+                    continue
+                length = struct.unpack('>H', f.read(2))[0]
+                if 0xc0 <= code <= 0xcf and code not in (0xc4, 0xc8, 0xcc):
+                    h, w = struct.unpack('>xHH', f.read(5))
+                    return (w, h)
+                f.seek(length - 2, 1)
+    return None
+
+
+def _stlinfo(fname):
+    size = os.path.getsize(fname)
+    with open(fname, 'rb') as f:
+        head = f.read(84)
+        if len(head) == 84:
+            n = struct.unpack('<I', head[80:84])[0]
+            if size == 84 + 50 * n:
+                return {'triangles': n, 'vertices': 3 * n}
+        if not head.lstrip().startswith('solid'):
+            return {}
+        # ascii stl: count the facets
+        f.seek(0)
+        n = 0
+        for line in f:
+            if line.lstrip().startswith('facet'):
+                n = n + 1
+        return {'triangles': n, 'vertices': 3 * n}
+
+
+def _localname(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _colladainfo(fname):
+    accessors = {}
+    positions = []
+    triangles = 0
+    images = []
+    for event, e in lxml.etree.iterparse(fname, events=('end',)):
+        if not isinstance(e.tag, basestring):
+            continue
+        tag = _localname(e.tag)
+        if tag == 'accessor':
+            source = e.getparent().getparent()
+            if source is not None and source.get('id'):
+                accessors[source.get('id')] = int(e.get('count', 0))
+        elif tag == 'input' and e.get('semantic') == 'POSITION':
+            if _localname(e.getparent().tag) == 'vertices':
+                positions.append(e.get('source', '').lstrip('#'))
+        elif tag == 'triangles':
+            triangles = triangles + int(e.get('count', 0))
+        elif tag in ('polylist', 'polygons'):
+            vcount = [c for c in e if _localname(c.tag) == 'vcount']
+            if len(vcount) > 0 and vcount[0].text:
+                triangles = triangles + sum([max(int(v) - 2, 0) for v in vcount[0].text.split()])
+            else:
+                triangles = triangles + int(e.get('count', 0))
+        elif tag == 'init_from' and _localname(e.getparent().tag) == 'image':
+            images.append(e.text.strip())
+        elif tag in ('float_array', 'p'):
+            # only the counts are needed
+            e.clear()
+    dirname = os.path.dirname(fname)
+    textures = []
+    for i in images:
+        if i.startswith('file://'):
+            i = i[7:]
+        textures.append(os.path.join(dirname, i))
+    return {'vertices': sum([accessors.get(p, 0) for p in positions]),
+            'triangles': triangles,
+            'textures': textures}
+
+
+def meshinfo(fname):
+    '''
+    Read size, vertex and triangle counts and textures of the mesh file
+    from its header (counts are missing for unsupported formats)
+    '''
+    info = {'path': fname, 'bytes': os.path.getsize(fname)}
+    ext = os.path.splitext(fname)[1].lower()
+    if ext == '.stl':
+        info.update(_stlinfo(fname))
+    elif ext == '.dae':
+        info.update(_colladainfo(fname))
+    return info
+
+
+def _meshcount(data, seen):
+    if id(data) in seen:
+        return 0, 0, []
+    seen.add(id(data))
+    if hasattr(data, 'children'):
+        vertices, triangles, textures = 0, 0, []
+        for c in data.children:
+            v, t, tx = _meshcount(c, seen)
+            vertices, triangles, textures = vertices + v, triangles + t, textures + tx
+        return vertices, triangles, textures
+    textures = []
+    if getattr(data, 'material', None) is not None and data.material.texture:
+        textures.append(data.material.texture)
+    if hasattr(data, 'vertex_index'):
+        return len(data.vertex), len(data.vertex_index), textures
+    return 0, 0, textures
+
+
+def _depth(bm):
+    children = {}
+    childnames = set()
+    for j in bm.joints:
+        children.setdefault(j.parent, []).append(j.child)
+        childnames.add(j.child)
+    depth = 0
+    current = [l.name for l in bm.links if l.name not in childnames]
+    seen = set()
+    while len(current) > 0:
+        depth = depth + 1
+        seen.update(current)
+        current = [c for n in current for c in children.get(n, []) if c not in seen]
+    return depth
+
+
+def summarize(bm):
+    '''
+    Summarize the body model read with deferred meshes
+    '''
+    result = {
+        'links': len(bm.links),
+        'joints': len(bm.joints),
+        'sensors': len(bm.sensors),
+        'shapes': 0,
+        'depth': _depth(bm),
+        'vertices': 0,
+        'triangles': 0,
+        'meshesperlink': {},
+        'shapesperlink': {},
+        'assets': [],
+        'textures': []
+    }
+    meshes = {}
+    textures = set()
+    seen = set()
+    for l in bm.links:
+        shapes = l.visuals + [c for c in l.collisions if c not in l.visuals]
+        result['shapes'] = result['shapes'] + len(shapes)
+        result['meshesperlink'][l.name] = 0
+        # names accepted by --shape-budget of the conversion
+        result['shapesperlink'][l.name] = [s.name for s in shapes]
+        for s in shapes:
+            if s.data is not None:
+                v, t, tx = _meshcount(s.data, seen)
+                if t > 0:
+                    result['meshesperlink'][l.name] += 1
+            elif s.meshfile is not None:
+                result['meshesperlink'][l.name] += 1
+                if s.meshfile in meshes:
+                    # mesh files are read once and shared by the shapes
+                    continue
+                try:
+                    m = meshinfo(s.meshfile)
+                except (IOError, OSError):
+                    m = {'path': s.meshfile, 'bytes': 0, 'missing': True}
+                meshes[s.meshfile] = m
+                v, t, tx = m.get('vertices', 0), m.get('triangles', 0), m.get('textures', [])
+            else:
+                continue
+            result['vertices'] = result['vertices'] + v
+            result['triangles'] = result['triangles'] + t
+            textures.update(tx)
+    for t in sorted(textures):
+        info = {'path': t, 'bytes': 0}
+        try:
+            info['bytes'] = os.path.getsize(t)
+            size = imagesize(t)
+            if size is not None:
+                info['width'], info['height'] = size
+        except (IOError, OSError):
+            info['missing'] = True
+        result['textures'].append(info)
+    assets = meshes.values() + result['textures']
+    result['assets'] = sorted(assets, key=lambda a: a['bytes'], reverse=True)
+    return result
+
+
+def inspect(fname, fmt=None):
+    '''
+    Read the model without loading the meshes and summarize it
+    '''
+    name = registry.readerformat(fname, fmt)
+    if name is None:
+        raise Exception('unable to detect input format (may be not supported?): %s' % fname)
+    reader = registry.createreader(name)
+    with memory.deferred():
+        bm = reader.read(fname)
+    result = summarize(bm)
+    result['input'] = fname
+    result['format'] = name
+    result['bytes'] = os.path.getsize(fname) if os.path.exists(fname) else 0
+    return result
+
+
+def _size(n):
+    return memory.formatsize(n)
+
+
+def report(result, top=10):
+    '''
+    Format the summary as table
+    '''
+    lines = ['%-24s %s (%s)' % ('model', result['input'], result['format'])]
+    for k in ['links', 'joints', 'sensors', 'shapes', 'depth', 'vertices', 'triangles']:
+        lines.append('%-24s %10i' % (k, result[k]))
+    texturebytes = sum([t['bytes'] for t in result['textures']])
+    lines.append('%-24s %10i %9s' % ('textures', len(result['textures']), _size(texturebytes)))
+    assetbytes = sum([a['bytes'] for a in result['assets']])
+    lines.append('%-24s %10i %9s' % ('assets', len(result['assets']), _size(assetbytes)))
+
+    counts = result['meshesperlink']
+    if len(counts) > 0:
+        lines.append('')
+        lines.append('%-48s %8s' % ('link', 'meshes'))
+        for name in sorted(counts.keys(), key=lambda k: counts[k], reverse=True)[0:top]:
+            lines.append('%-48s %8i' % (name, counts[name]))
+    if len(result['assets']) > 0:
+        lines.append('')
+        lines.append('%-48s %9s %10s %11s' % ('asset', 'size', 'triangles', 'image'))
+        for a in result['assets'][0:top]:
+            label = a['path']
+            if len(label) > 48:
+                label = '...' + label[-45:]
+            triangles = '%i' % a['triangles'] if 'triangles' in a else '-'
+            image = '%ix%i' % (a['width'], a['height']) if 'width' in a else '-'
+            if a.get('missing'):
+                image = 'missing'
+            lines.append('%-48s %9s %10s %11s' % (label, _size(a['bytes']), triangles, image))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    options = parser.parse_args(argv)
+    try:
+        result = inspect(options.fromfile, options.fromformat)
+    except Exception, e:
+        print >> sys.stderr, 'unable to read model: %s' % e
+        return 1
+    if options.json:
+        output = json.dumps(result, indent=2, sort_keys=True)
+    else:
+        output = report(result, options.top)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print output
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,204 @@
+# -*- coding:utf-8 -*-
+
+"""Manifest to support incremental conversion
+
+The manifest is stored next to the output file and records digests of
+the input files, the conversion options and digests of the produced
+files. It is used to skip conversions (or single mesh files) whose
+inputs have not changed since the last run.
+
+:Organization:
+ AIST
+
+Examples
+--------
+
+Record a conversion and check whether it is up to date
+
+>>> import tempfile, shutil
+>>> d = tempfile.mkdtemp()
+>>> src = os.path.join(d, 'input.urdf')
+>>> dst = os.path.join(d, 'output.sdf')
+>>> open(src, 'w').write('<robot/>')
+>>> open(dst, 'w').write('<sdf/>')
+>>> m = Manifest(manifestpath(dst))
+>>> m.options = {'to': 'sdf'}
+>>> m.isuptodate()
+False
+>>> m.addinput(src)
+>>> m.addoutput(dst)
+>>> m.save()
+
+>>> m = Manifest(manifestpath(dst))
+>>> m.options = {'to': 'sdf'}
+>>> m.isuptodate()
+True
+>>> open(src, 'w').write('<robot name="changed"/>')
+>>> m.isuptodate()
+False
+>>> shutil.rmtree(d)
+"""
+
+from __future__ import absolute_import
+import os
+import json
+import hashlib
+import numpy
+from . import model
+from . import utils
+from . import profiling
+from . import memory
+from . import sink
+
+
+def manifestpath(fname):
+    '''
+    Get path of the manifest file for the output file
+
+    >>> manifestpath('/tmp/pr2.sdf')
+    '/tmp/pr2.sdf.manifest.json'
+    '''
+    return fname + '.manifest.json'
+
+
+def shapedigest(shape):
+    '''
+    Calculate digest of the shape contents (used to decide whether mesh
+    file generated from the shape needs update)
+
+    >>> s = model.ShapeModel()
+    >>> s.shapeType = model.ShapeModel.SP_MESH
+    >>> s.data = model.MeshData()
+    >>> s.data.vertex = numpy.array([[0, 0, 0], [1, 0, 0], [0, 1, 0]])
+    >>> s.data.vertex_index = numpy.array([[0, 1, 2]])
+    >>> d1 = shapedigest(s)
+    >>> s.data.vertex_index = numpy.array([[0, 2, 1]])
+    >>> d1 == shapedigest(s)
+    False
+    '''
+    h = hashlib.sha1()
+    h.update(str(shape.shapeType))
+    _digestdata(h, shape.data)
+    return h.hexdigest()
+
+
+def _digestdata(h, d):
+    if type(d) == model.MeshTransformData:
+        if d.matrix is not None:
+            h.update(numpy.ascontiguousarray(d.matrix, dtype=float).tostring())
+        for c in d.children:
+            _digestdata(h, c)
+    elif type(d) == model.MeshData:
+        for a in [d.vertex, d.vertex_index, d.normal, d.normal_index, d.uvmap, d.uvmap_index]:
+            if a is not None:
+                h.update(numpy.ascontiguousarray(a).tostring())
+        if d.material is not None:
+            h.update(repr([d.material.diffuse, d.material.specular, d.material.transparency, d.material.texture]))
+
+
+class Manifest(object):
+    '''
+    Conversion manifest class
+    '''
+    def __init__(self, fname):
+        self.fname = fname
+        self.options = {}   #: Options used for the conversion
+        self.inputs = {}    #: Digests of input files (path: digest)
+        self.outputs = {}   #: Digests of output files (path: {'digest': digest, 'source': source digest})
+        self._previous = {}
+        self.load()
+
+    def load(self):
+        '''
+        Load previous manifest (if exists)
+        '''
+        try:
+            with open(self.fname) as f:
+                self._previous = json.load(f)
+        except (IOError, ValueError):
+            self._previous = {}
+
+    def save(self):
+        '''
+        Save the manifest
+        '''
+        with open(self.fname, 'w') as f:
+            json.dump({
+                'options': self.options,
+                'inputs': self.inputs,
+                'outputs': self.outputs
+            }, f, indent=2, sort_keys=True)
+
+    def addinput(self, fname):
+        '''
+        Record digest of the input file
+        '''
+        fname = os.path.abspath(fname)
+        self.inputs[fname] = utils.filedigest(fname)
+
+    def addoutput(self, fname, source=None):
+        '''
+        Record digest of the output file and the digest of the data it
+        was generated from
+        '''
+        self.outputs[os.path.abspath(fname)] = {'digest': sink.digest(fname), 'source': source}
+
+    def isuptodate(self):
+        '''
+        Check whether all the inputs, options and outputs are the same as
+        recorded in the previous manifest
+        '''
+        if len(self._previous.get('inputs', {})) == 0:
+            return False
+        if self._previous.get('options') != self.options:
+            return False
+        for fname, digest in self._previous['inputs'].items():
+            if not self._matches(fname, digest):
+                return False
+        for fname, o in self._previous.get('outputs', {}).items():
+            if not self._matches(fname, o['digest']):
+                return False
+        return True
+
+    def needsupdate(self, fname, source):
+        '''
+        Check whether the output file has to be regenerated from the data
+        whose digest is source
+        '''
+        try:
+            o = self._previous['outputs'][os.path.abspath(fname)]
+        except KeyError:
+            return True
+        if source is None or o['source'] != source or not sink.current().local:
+            # outputs kept in memory are always regenerated
+            return True
+        return not self._matches(fname, o['digest'])
+
+    def _matches(self, fname, digest):
+        try:
+            return utils.filedigest(fname) == digest
+        except IOError:
+            return False
+
+
+def writeshape(writer, shape, fname, manifest=None):
+    '''
+    Write the shape using the writer unless the manifest says the file
+    is already up to date
+
+    :returns: True if the file was (re)generated
+    '''
+    with memory.loaded(shape):
+        if manifest is None:
+            with profiling.stage('write mesh', fname):
+                writer.write(shape, fname)
+            return True
+        source = shapedigest(shape)
+        updated = manifest.needsupdate(fname, source)
+        if updated:
+            with profiling.stage('write mesh', fname):
+                writer.write(shape, fname)
+        else:
+            profiling.count('meshes up to date')
+    manifest.addoutput(fname, source)
+    return updated
@@ -0,0 +1,292 @@
+# -*- coding:utf-8 -*-
+
+"""Memory accounting and memory capped conversion
+
+While a memory limit is active in the thread, readers do not load the
+mesh data of the shapes but keep loaders of them, and writers load the
+data of each shape just before writing it and release it afterwards, so
+that only one mesh is held in memory at a time. Resident set size of the
+process is checked against the cap before and after loading each mesh,
+and :class:`MemoryCapExceeded` is raised with a report as soon as the cap
+cannot be met.
+
+:Organization:
+ AIST
+
+Examples
+--------
+
+Parse and format sizes
+
+>>> parsesize('512M') == 512 * 1024 * 1024
+True
+>>> parsesize('1.5G') == 1.5 * 1024 ** 3
+True
+>>> formatsize(3 * 1024 * 1024)
+'3.0M'
+
+Mesh data is loaded immediately without limit
+
+>>> from . import model
+>>> s = model.ShapeModel()
+>>> s.data = lazy(s, lambda: model.MeshData())
+>>> s.data is None
+False
+
+and only while written with limit
+
+>>> s = model.ShapeModel()
+>>> with Limit(parsesize('100T')).activate():
+...     s.data = lazy(s, lambda: model.MeshData())
+...     print s.data is None
+...     with loaded(s):
+...         print s.data is None
+...     print s.data is None
+True
+False
+True
+
+Conversion fails as soon as the cap cannot be met
+
+>>> try:
+...     with Limit(1024).activate():
+...         check('read')
+... except MemoryCapExceeded, e:
+...     print str(e).splitlines()[0]
+memory cap 1.0K exceeded while read
+"""
+
+import os
+import re
+import threading
+from . import archive
+try:
+    import resource
+except ImportError:
+    resource = None
+
+_local = threading.local()
+
+_units = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parsesize(s):
+    '''
+    Parse size with optional unit (K, M, G or T) to bytes
+    '''
+    m = re.match(r'^\s*([0-9.]+)\s*([KMGT]?)i?B?\s*$', str(s), re.IGNORECASE)
+    if m is None:
+        raise ValueError('invalid size: %s' % s)
+    return int(float(m.group(1)) * _units[m.group(2).upper()])
+
+
+def formatsize(n):
+    '''
+    Format bytes in human readable form
+    '''
+    for unit in ['', 'K', 'M', 'G']:
+        if abs(n) < 1024:
+            return '%.1f%s' % (n, unit)
+        n = n / 1024.0
+    return '%.1fT' % n
+
+
+def peak():
+    '''
+    Get peak resident set size of the process in bytes (0 if unknown)
+    '''
+    if resource is None:
+        return 0
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if os.uname()[0] == 'Darwin':
+        return maxrss
+    return maxrss * 1024
+
+
+def rss():
+    '''
+    Get current resident set size of the process in bytes (peak size if
+    the current size is unknown)
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        return peak()
+
+
+def meshsize(data):
+    '''
+    Get total bytes of the arrays in the mesh data
+    '''
+    if hasattr(data, 'children'):
+        return sum([meshsize(c) for c in data.children])
+    total = 0
+    for k in ['vertex', 'vertex_index', 'normal', 'normal_index', 'uvmap', 'uvmap_index']:
+        total = total + getattr(getattr(data, k, None), 'nbytes', 0)
+    return total
+
+
+class MemoryCapExceeded(Exception):
+    '''
+    Raised when the conversion cannot be done within the memory cap
+    '''
+    def __init__(self, cap, usage, what, meshes=[], estimate=0):
+        self.cap = cap
+        self.usage = usage
+        self.what = what
+        self.meshes = meshes
+        lines = ['memory cap %s exceeded while %s' % (formatsize(cap), what),
+                 '  resident memory: %s (peak %s)' % (formatsize(usage), formatsize(peak()))]
+        if estimate > 0:
+            lines.append('  estimated size of the data to be loaded: %s' % formatsize(estimate))
+        if len(meshes) > 0:
+            lines.append('  largest meshes loaded so far:')
+            for name, size in meshes:
+                lines.append('    %-40s %10s' % (name, formatsize(size)))
+        Exception.__init__(self, '\n'.join(lines))
+
+
+class Limit(object):
+    '''
+    Memory limit of the conversion
+    '''
+    def __init__(self, cap):
+        self.cap = cap      #: Maximum resident set size in bytes
+        self.meshes = {}    #: Size of the loaded meshes ({shape name: bytes})
+
+    def activate(self):
+        '''
+        Context manager to activate the limit in the current thread
+        '''
+        limit = self
+
+        class _Activation(object):
+            def __enter__(self):
+                self._previous = getattr(_local, 'limit', None)
+                _local.limit = limit
+                return limit
+
+            def __exit__(self, *args):
+                _local.limit = self._previous
+                return False
+        return _Activation()
+
+    def check(self, what, estimate=0):
+        '''
+        Raise MemoryCapExceeded if the memory usage (plus the estimated
+        size of the data to be loaded) exceeds the cap
+        '''
+        usage = rss()
+        if usage + estimate > self.cap:
+            largest = sorted(self.meshes.items(), key=lambda i: i[1], reverse=True)[0:5]
+            raise MemoryCapExceeded(self.cap, usage, what, largest, estimate)
+
+
+def current():
+    '''
+    Get the memory limit active in the current thread (None if unlimited)
+    '''
+    return getattr(_local, 'limit', None)
+
+
+def streaming():
+    '''
+    Whether the meshes are loaded on demand (memory limit is active)
+    '''
+    return getattr(_local, 'limit', None) is not None
+
+
+def check(what, estimate=0):
+    '''
+    Check memory usage against the active limit (if any)
+    '''
+    l = getattr(_local, 'limit', None)
+    if l is not None:
+        l.check(what, estimate)
+
+
+class _Deferred(object):
+    def __enter__(self):
+        _local.deferred = getattr(_local, 'deferred', 0) + 1
+        return self
+
+    def __exit__(self, *args):
+        _local.deferred = _local.deferred - 1
+        return False
+
+
+def deferred():
+    '''
+    Context manager to keep the loaders in the shapes even without memory
+    limit (used to load the meshes later in other threads)
+    '''
+    return _Deferred()
+
+
+def lazy(shape, load, fname=None):
+    '''
+    Load mesh data of the shape (returns None and keeps the loader in the
+    shape to load the data later when the memory limit is active or the
+    loading is deferred)
+
+    :param shape: shape model
+    :param load: function to load the mesh data
+    :param fname: mesh file (its size is used to check the cap before loading)
+    '''
+    if getattr(_local, 'limit', None) is None and getattr(_local, 'deferred', 0) == 0:
+        return load()
+    shape.loader = load
+    shape.meshfile = fname
+    return None
+
+
+class _Loaded(object):
+    def __init__(self, limit, shape):
+        self._limit = limit
+        self._shape = shape
+
+    def __enter__(self):
+        s = self._shape
+        estimate = 0
+        if s.meshfile is not None:
+            try:
+                estimate = archive.stat(s.meshfile).st_size
+            except OSError:
+                pass
+        self._limit.check('loading %s' % (s.meshfile or s.name), estimate)
+        s.data = s.loader()
+        self._limit.meshes[s.name] = meshsize(s.data)
+        self._limit.check('loading %s' % (s.meshfile or s.name))
+        return s
+
+    def __exit__(self, *args):
+        self._shape.data = None
+        return False
+
+
+class _NullLoaded(object):
+    def __init__(self, shape):
+        self._shape = shape
+
+    def __enter__(self):
+        return self._shape
+
+    def __exit__(self, *args):
+        return False
+
+
+def loaded(shape):
+    '''
+    Context manager to load the mesh data of the shape on demand and
+    release it at the end (does nothing if the data is already loaded)
+    '''
+    l = getattr(_local, 'limit', None)
+    if shape.loader is None or shape.data is not None:
+        return _NullLoaded(shape)
+    if l is None:
+        # loading was deferred without limit: keep the data
+        shape.data = shape.loader()
+        shape.loader = None
+        return _NullLoaded(shape)
+    return _Loaded(l, shape)
@@ -12,6 +12,9 @@ with warnings.catch_warnings():
     warnings.simplefilter('ignore')
     from .thirdparty import transformations as tf
 from .thirdparty import hrputil as hrputil
+from . import profiling
+
+decomposeMatrix = profiling.profiled('decompose transform')(hrputil.decomposeMatrix)
 
 
 class ProjectModel(object):
@@ -19,10 +22,12 @@ class ProjectModel(object):
     Project model
     """
     name = None        #: Name of the simulation
-    bodies = []        #: List of body models
+    bodies = []        #: List of body models (each model is listed once even if placed many times)
+    instances = []     #: List of instances of the bodies placed in the world
 
     def __init__(self):
         self.bodies = []
+        self.instances = []
 
 
 class TransformationModel(object):
@@ -54,21 +59,21 @@ class TransformationModel(object):
 
     def gettranslation(self):
         if self.matrix is not None:
-            translation, scale, axis = hrputil.decomposeMatrix(self.matrix)
+            translation, scale, axis = decomposeMatrix(self.matrix)
             return translation
         else:
             return self.trans
 
     def getscale(self):
         if self.matrix is not None:
-            transform, scale, axis = hrputil.decomposeMatrix(self.matrix)
+            transform, scale, axis = decomposeMatrix(self.matrix)
             return scale
         else:
             return self.scale
 
     def getrotation(self):
         if self.matrix is not None:
-            transform, scale, axis = hrputil.decomposeMatrix(self.matrix)
+            transform, scale, axis = decomposeMatrix(self.matrix)
             m = tf.quaternion_matrix(tf.quaternion_about_axis(axis[1], axis[0]))
             return tf.quaternion_from_matrix(m)
         else:
@@ -76,7 +81,7 @@ class TransformationModel(object):
 
     def getrpy(self):
         if self.matrix is not None:
-            transform, scale, axis = hrputil.decomposeMatrix(self.matrix)
+            transform, scale, axis = decomposeMatrix(self.matrix)
             m = tf.quaternion_matrix(tf.quaternion_about_axis(axis[1], axis[0]))
             return tf.euler_from_matrix(m)
         else:
@@ -84,11 +89,11 @@ class TransformationModel(object):
 
     def getangle(self):
         if self.matrix is not None:
-            transform, scale, axis = hrputil.decomposeMatrix(self.matrix)
+            transform, scale, axis = decomposeMatrix(self.matrix)
             return axis
         else:
             m = tf.quaternion_matrix(self.rot)
-            transform, scale, axis = hrputil.decomposeMatrix(m)
+            transform, scale, axis = decomposeMatrix(m)
             return axis
 
     def getmatrix(self):
@@ -122,6 +127,8 @@ class BodyModel(TransformationModel):
     joints = []        #: List of joints
     sensors = []       #: List of sensors
     materials = []     #: List of materials
+    sources = []       #: List of files the model was read from (documents and meshes)
+    url = None         #: Location of the body in the world (e.g. "world.sdf#name" for the model defined in the world file)
 
     def __init__(self):
         TransformationModel.__init__(self)
@@ -129,6 +136,15 @@ class BodyModel(TransformationModel):
         self.joints = []
         self.sensors = []
         self.materials = []
+        self.sources = []
+
+
+class InstanceModel(TransformationModel):
+    """
+    Instance of the body placed in the world
+    """
+    name = None        #: Name of the instance
+    body = None        #: Body model of the instance
 
 
 class LinkModel(TransformationModel):
@@ -146,6 +162,8 @@ class LinkModel(TransformationModel):
         TransformationModel.__init__(self)
         self.centerofmass = [0, 0, 0]
         self.inertia = numpy.identity(3)
+        self.visuals = []
+        self.collisions = []
 
 
 class JointModel(TransformationModel):
@@ -183,12 +201,19 @@ class ShapeModel(TransformationModel):
     SP_SPHERE = 'sphere'     #: Sphere shape
 
     name = None              #: Shape name
+    meshname = None          #: Base name of the mesh files of the shape (unique in the body, name is used if not given)
     shapeType = None         #: Shape type
     data = None              #: Store properties for each specific type of shape
+    loader = None            #: Function to load mesh data on demand (see simtrans.memory)
+    meshfile = None          #: Mesh file loaded by the loader
+    submesh = None           #: Submesh of the mesh file loaded by the loader (name and whether it is centered)
 
     def __init__(self):
         TransformationModel.__init__(self)
 
+    def getmeshname(self):
+        return self.meshname or self.name
+
 
 class MeshTransformData(TransformationModel):
     """
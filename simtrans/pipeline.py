@@ -0,0 +1,373 @@
+# -*- coding:utf-8 -*-
+
+"""Pipelined conversion overlapping mesh reads, writes and external tools
+
+Without a pipeline the conversion runs in phases on a single thread and
+waits for each mesh file and each external tool (``rospack``, ``convert``)
+in turn. While a pipeline is active:
+
+* the reader parses the model in its own thread and passes the events
+  (see :mod:`simtrans.stream`) through a bounded queue,
+* mesh files of the shapes are loaded by the worker threads ahead of the
+  writer (each link is passed to the writer when its meshes are loaded),
+* mesh files of each link and texture conversions are written by the
+  worker threads while the reader goes on,
+* external tools are launched under a limit of concurrent processes.
+
+Queues between the stages are bounded, so a slow writer stops the reader
+instead of piling up meshes in memory. Profiler, memory limit, tracer and
+output sink of the thread activating the pipeline are also active in its
+threads.
+
+:Organization:
+ AIST
+
+Examples
+--------
+
+Run functions in the worker threads and wait for the results
+
+>>> with Pipeline(workers=2).activate() as p:
+...     tasks = [submit(pow, 2, i) for i in range(4)]
+...     print [t.wait() for t in tasks]
+[1, 2, 4, 8]
+
+Functions are called immediately without pipeline
+
+>>> submit(pow, 2, 10).wait()
+1024
+
+Errors of the workers are raised when joining the pipeline
+
+>>> try:
+...     with Pipeline(workers=2).activate() as p:
+...         t = submit(int, 'x')
+...         p.join()
+... except ValueError, e:
+...     print 'failed'
+failed
+
+Events of the reader are passed in order
+
+>>> from . import model, stream
+>>> bm = model.BodyModel()
+>>> bm.links = [model.LinkModel(), model.LinkModel()]
+>>> with Pipeline(workers=2).activate() as p:
+...     print [k for k, o in p.prefetch(stream.iterevents(bm))]
+['body', 'link', 'link', 'end']
+"""
+
+import sys
+import Queue
+import threading
+import subprocess
+from . import profiling
+from . import memory
+from . import sink
+from . import stream
+
+_local = threading.local()
+
+_timeout = 0.1
+_stop = object()
+
+
+class Task(object):
+    '''
+    Function submitted to the pipeline
+    '''
+    def __init__(self, func, args, kwargs):
+        self._func = func
+        self._args = args
+        self._kwargs = kwargs
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def run(self):
+        try:
+            self._result = self._func(*self._args, **self._kwargs)
+        except:
+            self._error = sys.exc_info()
+        self._done.set()
+
+    def done(self):
+        '''
+        Whether the function has finished
+        '''
+        return self._done.is_set()
+
+    def wait(self):
+        '''
+        Wait for the function to finish and return the result (or raise
+        the exception of the function)
+        '''
+        # wait with timeout so that the wait can be interrupted
+        while not self._done.wait(_timeout):
+            pass
+        if self._error is not None:
+            raise self._error[0], self._error[1], self._error[2]
+        return self._result
+
+
+class _Context(object):
+    '''
+    Profiler, memory limit, output sink and pipeline to be activated in
+    the threads
+    (pipeline is not active in the worker threads so that the tasks do
+    not wait for the queue they are taken from)
+    '''
+    def __init__(self, pipeline, active):
+        self._pipeline = pipeline
+        self._active = active
+        self._activations = [a for a in [profiling.active(), memory.current(), sink.active()] if a is not None]
+
+    def run(self, func, *args):
+        previous = getattr(_local, 'pipeline', None), getattr(_local, 'tools', None)
+        _local.pipeline = self._pipeline if self._active else None
+        _local.tools = self._pipeline._tools
+        try:
+            return self._runin(self._activations, func, args)
+        finally:
+            _local.pipeline, _local.tools = previous
+
+    def _runin(self, activations, func, args):
+        if len(activations) == 0:
+            return func(*args)
+        with activations[0].activate():
+            return self._runin(activations[1:], func, args)
+
+
+class Pipeline(object):
+    '''
+    Worker threads and bounded queues of the conversion
+    '''
+    def __init__(self, workers=4, tools=2, depth=16):
+        '''
+        :param workers: number of worker threads reading and writing mesh files
+        :param tools: maximum number of external tools run at the same time
+        :param depth: maximum number of tasks and events waiting in the queues
+        '''
+        self.workers = workers
+        self.depth = depth
+        self._tools = threading.BoundedSemaphore(tools)
+        self._tasks = Queue.Queue(depth)
+        self._threads = []
+        self._pending = []
+        self._closed = threading.Event()
+        self._lock = threading.Lock()
+
+    def activate(self):
+        '''
+        Context manager to start the worker threads and activate the
+        pipeline in the current thread (waits for the submitted tasks and
+        stops the threads at the end)
+        '''
+        pipeline = self
+
+        class _Activation(object):
+            def __enter__(self):
+                self._previous = getattr(_local, 'pipeline', None), getattr(_local, 'tools', None)
+                pipeline._start()
+                _local.pipeline = pipeline
+                _local.tools = pipeline._tools
+                return pipeline
+
+            def __exit__(self, exc_type, *args):
+                _local.pipeline, _local.tools = self._previous
+                if exc_type is None:
+                    pipeline._stop()
+                else:
+                    # do not hide the original exception
+                    try:
+                        pipeline._stop()
+                    except Exception:
+                        pass
+                return False
+        return _Activation()
+
+    def _start(self):
+        self._closed.clear()
+        context = _Context(self, False)
+        for i in range(self.workers):
+            t = threading.Thread(target=context.run, args=(self._work,), name='simtrans-worker-%i' % i)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def _stop(self):
+        try:
+            self.join()
+        finally:
+            self._closed.set()
+            for t in self._threads:
+                self._tasks.put(_stop)
+            for t in self._threads:
+                t.join()
+            self._threads = []
+
+    def _work(self):
+        while True:
+            task = self._tasks.get()
+            if task is _stop:
+                return
+            if not self._closed.is_set():
+                task.run()
+            else:
+                task._done.set()
+
+    def _put(self, queue, item, closed):
+        # put with timeout to give up when the consumer is gone
+        while True:
+            try:
+                queue.put(item, True, _timeout)
+                return True
+            except Queue.Full:
+                if closed.is_set():
+                    return False
+
+    def submit(self, func, *args, **kwargs):
+        '''
+        Run the function in a worker thread (waits while the queue is full)
+
+        :returns: task to wait for the result
+        '''
+        task = Task(func, args, kwargs)
+        with self._lock:
+            self._pending.append(task)
+        if not self._put(self._tasks, task, self._closed):
+            raise Exception('pipeline is closed')
+        return task
+
+    def join(self):
+        '''
+        Wait for all the submitted tasks and raise the first error
+        '''
+        while True:
+            with self._lock:
+                pending = self._pending
+                self._pending = []
+            if len(pending) == 0:
+                return
+            for t in pending:
+                t.wait()
+
+    def prefetch(self, events):
+        '''
+        Generate the events in a reader thread and load the meshes of the
+        shapes in the worker threads (links are generated when their
+        meshes are loaded)
+
+        :param events: events of the reader (see simtrans.stream)
+        '''
+        queue = Queue.Queue(self.depth)
+        stopped = threading.Event()
+        context = _Context(self, True)
+        t = threading.Thread(target=context.run, args=(self._read, events, queue, stopped), name='simtrans-reader')
+        t.daemon = True
+        t.start()
+        loads = []
+        try:
+            while True:
+                try:
+                    kind, obj = queue.get(True, _timeout)
+                except Queue.Empty:
+                    continue
+                if kind is None:
+                    raise obj[0], obj[1], obj[2]
+                if kind == stream.SHAPE:
+                    loads.append(obj)
+                    continue
+                if kind == stream.LINK:
+                    for task in loads:
+                        task.wait()
+                    loads = []
+                    for s in stream.linkevents(obj):
+                        yield s
+                    continue
+                yield (kind, obj)
+                if kind == stream.END:
+                    break
+        finally:
+            stopped.set()
+            t.join()
+
+    def _read(self, events, queue, stopped):
+        try:
+            with memory.deferred():
+                for kind, obj in events:
+                    if kind == stream.SHAPE:
+                        obj = self.submit(load, obj)
+                    if not self._put(queue, (kind, obj), stopped):
+                        return
+        except:
+            self._put(queue, (None, sys.exc_info()), stopped)
+
+
+def current():
+    '''
+    Get the pipeline active in the current thread (None if not pipelined)
+    '''
+    return getattr(_local, 'pipeline', None)
+
+
+def submit(func, *args, **kwargs):
+    '''
+    Run the function in a worker thread of the active pipeline (or
+    immediately if no pipeline is active, raising its exception)
+
+    :returns: task to wait for the result
+    '''
+    p = getattr(_local, 'pipeline', None)
+    if p is not None:
+        return p.submit(func, *args, **kwargs)
+    task = Task(func, args, kwargs)
+    task.run()
+    task.wait()
+    return task
+
+
+def load(shape):
+    '''
+    Load the mesh data of the shape kept by the reader (unless the memory
+    limit is active, in which case the data is loaded by the writer)
+    '''
+    if shape.loader is not None and shape.data is None and not memory.streaming():
+        shape.data = shape.loader()
+        shape.loader = None
+    return shape
+
+
+class _NullSlot(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_nullslot = _NullSlot()
+
+
+def toolslot():
+    '''
+    Context manager to wait for a slot to run an external tool
+    '''
+    return getattr(_local, 'tools', None) or _nullslot
+
+
+def checkcall(args, **kwargs):
+    '''
+    Run the external tool (see subprocess.check_call) within the limit of
+    the active pipeline
+    '''
+    with toolslot():
+        return subprocess.check_call(args, **kwargs)
+
+
+def checkoutput(args, **kwargs):
+    '''
+    Run the external tool and return its output (see
+    subprocess.check_output) within the limit of the active pipeline
+    '''
+    with toolslot():
+        return subprocess.check_output(args, **kwargs)
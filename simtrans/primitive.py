@@ -0,0 +1,221 @@
+# -*- coding:utf-8 -*-
+
+"""Fit primitive shapes (box, cylinder and sphere) to collision meshes
+
+:Organization:
+ AIST
+
+Requirements
+------------
+* numpy
+
+Examples
+--------
+
+Box mesh is replaced with box shape
+
+>>> s = model.ShapeModel()
+>>> s.shapeType = model.ShapeModel.SP_MESH
+>>> s.data = convex.box([-1, -2, -3], [1, 2, 3])
+>>> s.trans = numpy.array([0, 0, 1])
+>>> p = fit(s)
+>>> p.shapeType
+'box'
+>>> sorted([round(p.data.x, 6), round(p.data.y, 6), round(p.data.z, 6)])
+[2.0, 4.0, 6.0]
+>>> numpy.allclose(p.trans, [0, 0, 1])
+True
+
+Cylinder mesh is replaced with cylinder shape
+
+>>> t = numpy.linspace(0, 2 * numpy.pi, 64, endpoint=False)
+>>> s.data = model.MeshData()
+>>> s.data.vertex = numpy.vstack([numpy.column_stack([numpy.cos(t), numpy.sin(t), numpy.zeros(64) + z]) for z in [0, 3]])
+>>> s.data.vertex_index = numpy.array([[i, (i + 1) % 64, 64 + i] for i in range(64)])
+>>> p = fit(s)
+>>> p.shapeType
+'cylinder'
+>>> round(p.data.radius, 2), round(p.data.height, 2)
+(1.0, 3.0)
+>>> numpy.allclose(p.trans, [0, 0, 2.5])
+True
+
+Concave mesh is kept as it is
+
+>>> s.data = model.MeshTransformData()
+>>> s.data.children = [convex.box([0, 0, 0], [2, 1, 1]), convex.box([0, 1, 0], [1, 2, 1])]
+>>> fit(s) is None
+True
+"""
+
+from __future__ import absolute_import
+from . import model
+from . import convex
+import numpy
+import warnings
+with warnings.catch_warnings():
+    warnings.simplefilter('ignore')
+    from .thirdparty import transformations as tf
+
+ITERATIONS = 1000  #: Number of iterations to calculate minimal enclosing circles and spheres
+
+
+def _enclosing(points):
+    '''
+    Calculate approximate minimal enclosing ball of the points (Badoiu-Clarkson)
+
+    :returns: center and radius
+    '''
+    center = points[0]
+    for i in range(1, ITERATIONS):
+        far = points[((points - center) ** 2).sum(axis=1).argmax()]
+        center = center + (far - center) / (i + 1.0)
+    return center, numpy.sqrt(((points - center) ** 2).sum(axis=1).max())
+
+
+def _rotation(axes):
+    # rotation matrix (4x4) whose columns are the axes (right handed)
+    R = numpy.identity(4)
+    R[0:3, 0:3] = numpy.asarray(axes).T
+    if numpy.linalg.det(R[0:3, 0:3]) < 0:
+        R[0:3, 2] = -R[0:3, 2]
+    return R
+
+
+def fitbox(points, axes=None):
+    '''
+    Calculate oriented bounding box of the points
+
+    :param points: [x,y,z] * N array
+    :param axes: candidate axes (3x3 arrays of row vectors), principal axes are used if not given
+    :returns: volume, size, center and rotation (4x4 matrix)
+    '''
+    if axes is None:
+        axes = [numpy.linalg.svd(points - points.mean(axis=0), full_matrices=False)[2]]
+    best = None
+    for a in axes:
+        R = _rotation(a)
+        local = numpy.dot(points, R[0:3, 0:3])
+        lower = local.min(axis=0)
+        upper = local.max(axis=0)
+        size = upper - lower
+        vol = size.prod()
+        if best is None or vol < best[0]:
+            best = (vol, size, numpy.dot(R[0:3, 0:3], (lower + upper) / 2.0), R)
+    return best
+
+
+def fitcylinder(points, axes):
+    '''
+    Calculate minimal cylinder which encloses the points along one of the axes
+
+    :param points: [x,y,z] * N array
+    :param axes: candidate axes (list of 3-dim vectors)
+    :returns: volume, radius, height, center and rotation (4x4 matrix)
+    '''
+    best = None
+    for axis in axes:
+        axis = axis / numpy.linalg.norm(axis)
+        u = numpy.cross(axis, numpy.identity(3)[numpy.abs(axis).argmin()])
+        u = u / numpy.linalg.norm(u)
+        R = _rotation([u, numpy.cross(axis, u), axis])
+        local = numpy.dot(points, R[0:3, 0:3])
+        c, radius = _enclosing(local[:, 0:2])
+        lower = local[:, 2].min()
+        upper = local[:, 2].max()
+        vol = numpy.pi * radius * radius * (upper - lower)
+        if best is None or vol < best[0]:
+            center = numpy.dot(R[0:3, 0:3], [c[0], c[1], (lower + upper) / 2.0])
+            best = (vol, radius, upper - lower, center, R)
+    return best
+
+
+def fitsphere(points):
+    '''
+    Calculate minimal sphere which encloses the points
+
+    :param points: [x,y,z] * N array
+    :returns: volume, radius and center
+    '''
+    center, radius = _enclosing(points)
+    return 4.0 / 3.0 * numpy.pi * radius ** 3, radius, center
+
+
+def fit(shape, tolerance=0.1):
+    '''
+    Fit primitive shapes to the mesh shape and return the one with the
+    smallest volume if its volume error against the convex hull of the
+    mesh is within the tolerance
+
+    :param shape: ShapeModel (mesh)
+    :param tolerance: allowed volume error (ratio to the volume of the convex hull)
+    :returns: ShapeModel of the primitive (None if no primitive fits)
+    '''
+    vertex, faces = convex.flatten(shape.data)
+    if len(faces) == 0:
+        return None
+    vertex = vertex[numpy.unique(faces)]
+    m = numpy.asarray(shape.getmatrix(), dtype=float)
+    h = convex.convexhull(numpy.dot(vertex, m[0:3, 0:3].T) + m[0:3, 3])
+    if h is None:
+        return None
+    points = h.vertex
+    hullvolume = convex.volume(h.vertex, h.vertex_index)
+    if hullvolume <= 0:
+        return None
+
+    # principal axes and the axes of the shape are tried for the box
+    rotation = m[0:3, 0:3] / numpy.sqrt((m[0:3, 0:3] ** 2).sum(axis=0))
+    principal = numpy.linalg.svd(points - points.mean(axis=0), full_matrices=False)[2]
+    box = fitbox(points, [principal, rotation.T])
+    cylinder = fitcylinder(points, list(principal) + list(rotation.T))
+    sphere = fitsphere(points)
+
+    p = model.ShapeModel()
+    p.name = shape.name
+    if box[0] <= cylinder[0] and box[0] <= sphere[0]:
+        vol = box[0]
+        p.shapeType = model.ShapeModel.SP_BOX
+        p.data = model.BoxData()
+        p.data.x, p.data.y, p.data.z = [float(v) for v in box[1]]
+        p.trans = box[2]
+        p.rot = tf.quaternion_from_matrix(box[3])
+    elif cylinder[0] <= sphere[0]:
+        vol = cylinder[0]
+        p.shapeType = model.ShapeModel.SP_CYLINDER
+        p.data = model.CylinderData()
+        p.data.radius = float(cylinder[1])
+        p.data.height = float(cylinder[2])
+        p.trans = cylinder[3]
+        p.rot = tf.quaternion_from_matrix(cylinder[4])
+    else:
+        vol = sphere[0]
+        p.shapeType = model.ShapeModel.SP_SPHERE
+        p.data = model.SphereData()
+        p.data.radius = float(sphere[1])
+        p.trans = sphere[2]
+    if (vol - hullvolume) / hullvolume > tolerance:
+        return None
+    return p
+
+
+def fitprimitives(bm, tolerance=0.1):
+    '''
+    Replace collision meshes of the body with primitive shapes where they
+    fit. Visual shapes are used for the links without collision shapes.
+
+    :param bm: BodyModel
+    :param tolerance: allowed volume error (ratio to the volume of the convex hull)
+    '''
+    for l in bm.links:
+        shapes = l.collisions
+        if len(shapes) == 0:
+            shapes = l.visuals
+        collisions = []
+        for s in shapes:
+            if s.shapeType == model.ShapeModel.SP_MESH and s.data is not None:
+                p = fit(s, tolerance)
+                if p is not None:
+                    s = p
+            collisions.append(s)
+        l.collisions = collisions
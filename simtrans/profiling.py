@@ -0,0 +1,280 @@
+# -*- coding:utf-8 -*-
+
+"""Measure wall and cpu time and resident memory of each conversion stage
+
+Stages and counters are recorded only while a profiler is active in
+the thread, otherwise they cost a function call. Stages are also
+recorded as spans while a :mod:`simtrans.tracing` tracer is active.
+
+:Organization:
+ AIST
+
+Examples
+--------
+
+Record stages and counters
+
+>>> p = Profiler()
+>>> with p.activate():
+...     with stage('read'):
+...         with stage('read mesh', 'a.dae'):
+...             count('triangles', 10)
+...         with stage('read mesh', 'b.dae'):
+...             count('triangles', 5)
+>>> p.stages['read']['count'], p.stages['read mesh']['count']
+(1, 2)
+>>> sorted(p.details['read mesh'].keys())
+['a.dae', 'b.dae']
+>>> p.counters['triangles']
+15
+
+Nothing is recorded without active profiler
+
+>>> with stage('read'):
+...     count('triangles', 10)
+>>> p.counters['triangles']
+15
+
+Results of other processes can be merged
+
+>>> q = Profiler()
+>>> q.merge(p.todict())
+>>> q.merge(p.todict())
+>>> q.stages['read mesh']['count'], q.counters['triangles']
+(4, 30)
+"""
+
+import os
+import time
+import threading
+import functools
+from . import tracing
+from . import memory
+
+_local = threading.local()
+
+
+def _cputime():
+    t = os.times()
+    return t[0] + t[1]
+
+
+class _NullStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_nullstage = _NullStage()
+
+
+class _Stage(object):
+    def __init__(self, profiler, tracer, name, detail):
+        self._profiler = profiler
+        self._name = name
+        self._detail = detail
+        self._span = None
+        if tracer is not None:
+            self._span = tracing.span(name) if detail is None else tracing.span(name, path=detail)
+
+    def __enter__(self):
+        if self._span is not None:
+            self._span.__enter__()
+        if self._profiler is not None:
+            self._profiler.register(self._name)
+            self._rss = memory.rss()
+            self._wall = time.time()
+            self._cpu = _cputime()
+        return self
+
+    def __exit__(self, *args):
+        if self._profiler is not None:
+            wall = time.time() - self._wall
+            cpu = _cputime() - self._cpu
+            rss = memory.rss()
+            self._profiler.add(self._name, self._detail, wall, cpu, rss=rss, growth=max(0, rss - self._rss))
+        if self._span is not None:
+            self._span.__exit__(*args)
+        return False
+
+
+def active():
+    '''
+    Get the profiler active in the current thread (None if not profiling)
+    '''
+    return getattr(_local, 'profiler', None)
+
+
+def stage(name, detail=None):
+    '''
+    Context manager to measure the stage
+
+    :param name: name of the stage
+    :param detail: file name or other detail to be measured separately (optional)
+    '''
+    p = getattr(_local, 'profiler', None)
+    t = tracing.current()
+    if p is None and t is None:
+        return _nullstage
+    return _Stage(p, t, name, detail)
+
+
+def profiled(name):
+    '''
+    Decorator to measure each call of the function as the stage
+    '''
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            p = getattr(_local, 'profiler', None)
+            t = tracing.current()
+            if p is None and t is None:
+                return f(*args, **kwargs)
+            with _Stage(p, t, name, None):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, n=1):
+    '''
+    Increment the counter
+    '''
+    p = getattr(_local, 'profiler', None)
+    if p is not None:
+        with p._lock:
+            p.counters[name] = p.counters.get(name, 0) + n
+
+
+def _countmesh(data, seen):
+    if id(data) in seen:
+        return
+    seen.add(id(data))
+    if hasattr(data, 'children'):
+        for c in data.children:
+            _countmesh(c, seen)
+    elif hasattr(data, 'vertex_index'):
+        count('vertices', len(data.vertex))
+        count('triangles', len(data.vertex_index))
+
+
+def countmodel(m):
+    '''
+    Count links, joints, shapes, vertices and triangles of the body model
+    '''
+    if getattr(_local, 'profiler', None) is None:
+        return
+    count('links', len(m.links))
+    count('joints', len(m.joints))
+    seen = set()
+    for l in m.links:
+        for s in l.visuals + [c for c in l.collisions if c not in l.visuals]:
+            count('shapes')
+            if s.data is not None:
+                _countmesh(s.data, seen)
+
+
+class Profiler(object):
+    '''
+    Profiler to record wall and cpu time and memory of the stages and counters
+    '''
+    def __init__(self):
+        self.stages = {}     #: Total time of each stage ({name: {count, wall, cpu, rss, growth}})
+        self.details = {}    #: Total time of each detail of the stage ({name: {detail: {count, wall, cpu, rss, growth}}})
+        self.counters = {}   #: Counters ({name: value})
+        self._order = []
+        self._lock = threading.RLock()
+
+    def activate(self):
+        '''
+        Context manager to activate the profiler in the current thread
+        '''
+        profiler = self
+
+        class _Activation(object):
+            def __enter__(self):
+                self._previous = getattr(_local, 'profiler', None)
+                _local.profiler = profiler
+                return profiler
+
+            def __exit__(self, *args):
+                _local.profiler = self._previous
+                return False
+        return _Activation()
+
+    def _add(self, d, key, c, wall, cpu, rss=0, growth=0):
+        try:
+            e = d[key]
+        except KeyError:
+            e = d[key] = {'count': 0, 'wall': 0.0, 'cpu': 0.0, 'rss': 0, 'growth': 0}
+        e['count'] += c
+        e['wall'] += wall
+        e['cpu'] += cpu
+        e['rss'] = max(e['rss'], rss)
+        e['growth'] += growth
+
+    def register(self, name):
+        '''
+        Register the stage to show in the report (in order of registration)
+        '''
+        with self._lock:
+            if name not in self._order:
+                self._order.append(name)
+
+    def add(self, name, detail, wall, cpu, c=1, rss=0, growth=0):
+        '''
+        Add measured time and memory of the stage (resident memory at the
+        end of the stage and its growth during the stage)
+        '''
+        with self._lock:
+            self.register(name)
+            self._add(self.stages, name, c, wall, cpu, rss, growth)
+            if detail is not None:
+                self._add(self.details.setdefault(name, {}), detail, c, wall, cpu, rss, growth)
+
+    def todict(self):
+        '''
+        Get the results as dict (to be saved in JSON format)
+        '''
+        return {'stages': self.stages, 'details': self.details, 'counters': self.counters}
+
+    def merge(self, d):
+        '''
+        Merge the results returned by todict()
+        '''
+        for name, e in d['stages'].items():
+            self.add(name, None, e['wall'], e['cpu'], e['count'], e.get('rss', 0), e.get('growth', 0))
+        for name, details in d['details'].items():
+            for detail, e in details.items():
+                self._add(self.details.setdefault(name, {}), detail, e['count'], e['wall'], e['cpu'],
+                          e.get('rss', 0), e.get('growth', 0))
+        for name, v in d['counters'].items():
+            self.counters[name] = self.counters.get(name, 0) + v
+
+    def report(self):
+        '''
+        Format the results as table (time of the stages are inclusive of
+        the nested stages, rss is the maximum resident memory at the end of
+        the stage and +rss is the total growth during the stage)
+        '''
+        mb = 1024.0 * 1024.0
+        lines = ['%-48s %8s %10s %10s %9s %9s' % ('stage', 'count', 'wall[s]', 'cpu[s]', 'rss[MB]', '+rss[MB]')]
+        for name in self._order:
+            e = self.stages[name]
+            lines.append('%-48s %8i %10.3f %10.3f %9.1f %9.1f' % (name, e['count'], e['wall'], e['cpu'],
+                                                                  e['rss'] / mb, e['growth'] / mb))
+            details = self.details.get(name, {})
+            for detail in sorted(details.keys(), key=lambda k: details[k]['wall'], reverse=True):
+                e = details[detail]
+                label = detail
+                if len(label) > 44:
+                    label = '...' + label[-41:]
+                lines.append('  %-46s %8i %10.3f %10.3f %9.1f %9.1f' % (label, e['count'], e['wall'], e['cpu'],
+                                                                        e['rss'] / mb, e['growth'] / mb))
+        if len(self.counters) > 0:
+            lines.append('')
+            lines.append('%-48s %8s' % ('counter', 'value'))
+            for name in sorted(self.counters.keys()):
+                lines.append('%-48s %8i' % (name, self.counters[name]))
+        return '\n'.join(lines)
@@ -0,0 +1,240 @@
+# -*- coding:utf-8 -*-
+
+"""Conversion of the worlds consisting of many bodies
+
+World files (e.g. SDF ``<world>`` with ``<model>`` and ``<include>``
+elements) are read into :class:`simtrans.model.ProjectModel` by the
+readers which have ``readproject(fname)``. Each model is listed once in
+the bodies of the project however many times it is placed, and the
+placements are kept in the instances. The bodies are converted in a pool
+of worker processes (each body is converted as usual, with its own
+manifest so that unchanged bodies are skipped), then the world file is
+written by ``writeproject(project, fname)`` of the writer referring to
+the files of the bodies given by ``bodyfile(fname, body)``. Meshes loaded
+from the same mesh file (by its digest) by many bodies are written once
+by the first body and referred to by the others.
+
+:Organization:
+ AIST
+
+Examples
+--------
+
+Read the world defining two models
+
+>>> import tempfile
+>>> from . import sdf
+>>> d = tempfile.mkdtemp()
+>>> with open(os.path.join(d, 'test.world'), 'w') as f:
+...     f.write('''<sdf version="1.5"><world name="test">
+...   <model name="box1"><link name="base"><visual name="v"><geometry><box><size>1 1 1</size></box></geometry></visual></link></model>
+...   <model name="box2"><pose>1 0 0 0 0 0</pose><link name="base"/></model>
+... </world></sdf>''')
+>>> p = sdf.SDFReader().readproject(os.path.join(d, 'test.world'))
+>>> [b.name for b in p.bodies], [(i.name, i.body.name, i.gettranslation()[0]) for i in p.instances]
+(['box1', 'box2'], [('box1', 'box1', 0), ('box2', 'box2', 1.0)])
+>>> p.bodies[0].url.endswith('test.world#box1')
+True
+
+Write the world referring to the bodies
+
+>>> w = sdf.SDFWriter()
+>>> for b in p.bodies:
+...     os.mkdir(os.path.dirname(w.bodyfile(os.path.join(d, 'out.world'), b)))
+>>> w.writeproject(p, os.path.join(d, 'out.world'))
+>>> print open(os.path.join(d, 'out.world')).read().count('<include>')
+3
+
+Meshes loaded from the same mesh file (by digest) are written once and
+shared by the bodies
+
+>>> import numpy
+>>> from . import model, collada
+>>> s = model.ShapeModel()
+>>> s.shapeType = model.ShapeModel.SP_MESH
+>>> s.data = model.MeshData()
+>>> s.data.vertex = numpy.array([[0, 0, 0], [1, 0, 0], [0, 1, 0]], dtype=float)
+>>> s.data.vertex_index = numpy.array([[0, 1, 2]])
+>>> s.data.material = model.MaterialModel()
+>>> collada.ColladaWriter().write(s, os.path.join(d, 'mesh0-0.dae'))
+>>> mesh = '<model name="%s"><link name="base"><visual name="v"><geometry><mesh><uri>%s</uri></mesh></geometry></visual></link></model>'
+>>> with open(os.path.join(d, 'shared.world'), 'w') as f:
+...     f.write('<sdf version="1.5"><world name="shared">%s%s</world></sdf>' % (
+...         mesh % ('box1', os.path.join(d, 'mesh0-0.dae')), mesh % ('box2', os.path.join(d, 'mesh0-0.dae'))))
+>>> with memory.deferred():
+...     p = sdf.SDFReader().readproject(os.path.join(d, 'shared.world'))
+>>> shared = sharedmeshes(w, os.path.join(d, 'out.world'), p.bodies)
+>>> files = lambda b: sorted([(os.path.relpath(os.path.dirname(f['path']), d), os.path.splitext(f['path'])[1], f['write']) for f in shared[b].values()])
+>>> files('box1')
+[('box1', '.dae', True), ('box1', '.stl', True)]
+>>> files('box2')
+[('box1', '.dae', False), ('box1', '.stl', False)]
+>>> w.sharedmeshes = shared['box2']
+>>> w.write(p.bodies[1], w.bodyfile(os.path.join(d, 'out.world'), p.bodies[1]))
+>>> sorted(os.listdir(os.path.join(d, 'box2')))
+['model.config', 'model.sdf']
+>>> '<uri>model://box1/shape-' in open(os.path.join(d, 'box2', 'model.sdf')).read()
+True
+>>> import shutil
+>>> shutil.rmtree(d)
+"""
+
+import os
+import sys
+import copy
+import multiprocessing
+from . import registry
+from . import manifest
+from . import profiling
+from . import tracing
+from . import memory
+from . import batch
+from . import utils
+
+
+def isproject(reader, fname):
+    '''
+    Check whether the file is read as the project by the reader
+    '''
+    return hasattr(reader, 'isproject') and reader.isproject(fname)
+
+
+def bodyoptions(options, body, fromformat, toformat, writer):
+    '''
+    Get the options to convert the body of the project
+    '''
+    o = copy.copy(options)
+    o.fromfile = body.url
+    o.fromformat = fromformat
+    o.tofile = writer.bodyfile(options.tofile, body)
+    o.toformat = toformat
+    o.jobs = 1
+    return o
+
+
+def sharedmeshes(writer, tofile, bodies):
+    '''
+    Find the mesh files of the bodies converted from the same mesh (by
+    digest of the source mesh file), so that each of them is written by
+    one of the bodies and referred to by the others
+
+    :returns: shared mesh files of each body (by the shape name and the extension: path of the file and whether the body writes it)
+    '''
+    digests = {}
+    users = {}
+    for b in bodies:
+        for s, fname in writer.meshfiles(writer.bodyfile(tofile, b), b):
+            if s.meshfile is None:
+                continue
+            if s.meshfile not in digests:
+                try:
+                    digests[s.meshfile] = utils.filedigest(s.meshfile)
+                except IOError:
+                    # reported by the conversion of the body
+                    digests[s.meshfile] = None
+            if digests[s.meshfile] is None:
+                continue
+            ext = os.path.splitext(fname)[1]
+            key = (digests[s.meshfile], repr(s.submesh), ext)
+            users.setdefault(key, []).append((b.name, s.getmeshname() + ext, fname))
+    shared = dict([(b.name, {}) for b in bodies])
+    for u in users.values():
+        if len(u) > 1:
+            for k, (body, name, fname) in enumerate(u):
+                shared[body][name] = {'path': u[0][2], 'write': k == 0}
+    return shared
+
+
+def sharedfile(shared, shape, fname):
+    '''
+    Get the file to write the mesh of the shape to (None if it is written
+    by another body) and the file to refer to
+
+    :param shared: shared mesh files of the body (see sharedmeshes)
+    :param fname: mesh file of the shape written by the body itself
+    '''
+    s = (shared or {}).get(shape.getmeshname() + os.path.splitext(fname)[1])
+    if s is None:
+        return fname, fname
+    return (s['path'] if s['write'] else None), s['path']
+
+
+def _convertbody(params):
+    options, profile, trace = params
+    return batch.runconvert(lambda: options, options.fromfile, options.tofile, profile, trace)
+
+
+def convert(options, reader, writer, checkpoint):
+    '''
+    Convert the bodies of the project in the worker processes and write
+    the project, returning the exit status
+    '''
+    if not hasattr(writer, 'writeproject'):
+        print >> sys.stderr, 'unable to write the world with many bodies in this format (%s)' % writer.__class__.__name__
+        return 1
+    with profiling.stage('read project'):
+        tracing.annotate(path=options.fromfile)
+        with memory.deferred():
+            p = reader.readproject(options.fromfile)
+    if len(p.bodies) == 0:
+        print "cannot read bodies at all (no model found in the world)"
+        return 1
+
+    print "converting world: %s (%i instances of %i bodies)" % (options.fromfile, len(p.instances), len(p.bodies))
+    print "              to: %s" % options.tofile
+    checkpoint()
+
+    fromformat = registry.readerformat(options.fromfile, options.fromformat)
+    toformat = registry.writerformat(options.tofile, options.toformat)
+    profile = profiling.active() is not None
+    trace = tracing.current() is not None
+    # meshes processed for each body (e.g. by the triangle budget) are not shared
+    shared = {}
+    if not (options.fitprimitives or options.convexhull or options.convexpieces or
+            options.visualbudget or options.collisionbudget or options.shapebudgets):
+        with profiling.stage('find shared meshes'):
+            shared = sharedmeshes(writer, options.tofile, p.bodies)
+        count = sum([len([s for s in m.values() if s['write']]) for m in shared.values()])
+        if count > 0:
+            print "%i mesh files are shared by the bodies" % count
+    params = []
+    for b in p.bodies:
+        o = bodyoptions(options, b, fromformat, toformat, writer)
+        o.sharedmeshes = shared.get(b.name) or None
+        dirname = os.path.dirname(o.tofile)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        params.append((o, profile, trace))
+
+    processes = options.jobs or multiprocessing.cpu_count()
+    if multiprocessing.current_process().daemon:
+        # worker processes (e.g. of batch conversion) cannot have children
+        processes = 1
+    failed = 0
+    with profiling.stage('convert bodies'):
+        for r in batch.runpool(_convertbody, params, processes):
+            if 'profile' in r:
+                profiling.active().merge(r['profile'])
+            if 'trace' in r and tracing.current() is not None:
+                tracing.current().merge(r['trace'])
+            if r['status'] != 'ok':
+                failed = failed + 1
+            print '[%s] %.2fs %s -> %s' % (r['status'], r['time'], r['input'], r['output'])
+            if options.verbose or r['status'] != 'ok':
+                for l in r['message'].splitlines():
+                    print '    ' + l
+            sys.stdout.flush()
+            checkpoint()
+    if failed > 0:
+        print "%i of %i bodies failed" % (failed, len(p.bodies))
+        return 1
+
+    mf = manifest.Manifest(manifest.manifestpath(options.tofile))
+    with profiling.stage('write project'):
+        tracing.annotate(path=options.tofile, writer=writer.__class__.__name__)
+        writer.writeproject(p, options.tofile, manifest=mf)
+    for b in p.bodies:
+        mf.addinput(b.sources[0])
+    with profiling.stage('save manifest'):
+        mf.save()
+    return 0
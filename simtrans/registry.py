@@ -0,0 +1,151 @@
+# -*- coding:utf-8 -*-
+
+"""Registry of readers and writers for each format
+
+Modules of readers and writers are imported only when the format is
+selected, so that the converter starts fast and works without the
+dependencies of unused formats (e.g. omniORB for VRML).
+
+:Organization:
+ AIST
+
+Examples
+--------
+
+Detect format from file extension
+
+>>> readerformat('/tmp/pr2.urdf')
+'urdf'
+>>> writerformat('/tmp/pr2.world')
+'sdf'
+>>> writerformat('/tmp/pr2.dot', 'urdf')
+'urdf'
+>>> readerformat('/tmp/pr2.txt') is None
+True
+
+Register new writer (options not accepted by the writer are ignored)
+
+>>> registerwriter('text', 'StringIO:StringIO', ['.txt'])
+>>> w = createwriter(writerformat('/tmp/pr2.txt'), meshformat='dae')
+>>> w.__class__.__name__
+'StringIO'
+>>> unregisterwriter('text')
+>>> writerformat('/tmp/pr2.txt') is None
+True
+"""
+
+import os
+import inspect
+import importlib
+
+_readers = {
+    'vrml': 'simtrans.vrml:VRMLReader',
+    'urdf': 'simtrans.urdf:URDFReader',
+    'sdf': 'simtrans.sdf:SDFReader'
+}
+_writers = {
+    'vrml': 'simtrans.vrml:VRMLWriter',
+    'urdf': 'simtrans.urdf:URDFWriter',
+    'sdf': 'simtrans.sdf:SDFWriter',
+    'dot': 'simtrans.graphviz:GraphvizWriter'
+}
+_readerexts = {'.wrl': 'vrml', '.urdf': 'urdf', '.sdf': 'sdf', '.world': 'sdf', '.xacro': 'urdf'}
+_writerexts = {'.wrl': 'vrml', '.urdf': 'urdf', '.sdf': 'sdf', '.world': 'sdf', '.dot': 'dot'}
+
+
+def load(spec):
+    '''
+    Import the class specified in "module:class" form
+    '''
+    modname, clsname = spec.split(':')
+    return getattr(importlib.import_module(modname), clsname)
+
+
+def registerreader(name, spec, extensions=[]):
+    '''
+    Register reader class for the format
+
+    :param name: name of the format
+    :param spec: reader class in "module:class" form
+    :param extensions: file extensions of the format
+    '''
+    _readers[name] = spec
+    for e in extensions:
+        _readerexts[e] = name
+
+
+def registerwriter(name, spec, extensions=[]):
+    '''
+    Register writer class for the format
+
+    :param name: name of the format
+    :param spec: writer class in "module:class" form
+    :param extensions: file extensions of the format
+    '''
+    _writers[name] = spec
+    for e in extensions:
+        _writerexts[e] = name
+
+
+def unregisterreader(name):
+    '''
+    Remove the reader of the format and its file extensions
+    '''
+    _readers.pop(name, None)
+    for e in [e for e, n in _readerexts.items() if n == name]:
+        del _readerexts[e]
+
+
+def unregisterwriter(name):
+    '''
+    Remove the writer of the format and its file extensions
+    '''
+    _writers.pop(name, None)
+    for e in [e for e, n in _writerexts.items() if n == name]:
+        del _writerexts[e]
+
+
+def readerformat(fname, fmt=None):
+    '''
+    Get name of the input format (detected from the file extension if
+    the format is not specified or unknown)
+    '''
+    if fmt in _readers:
+        return fmt
+    # strip the name of the model in the world file (e.g. world.sdf#robot)
+    return _readerexts.get(os.path.splitext(fname.split('#', 1)[0])[1])
+
+
+def writerformat(fname, fmt=None):
+    '''
+    Get name of the output format (detected from the file extension if
+    the format is not specified or unknown)
+    '''
+    if fmt in _writers:
+        return fmt
+    return _writerexts.get(os.path.splitext(fname)[1])
+
+
+def _create(spec, kwargs):
+    cls = load(spec)
+    try:
+        args = inspect.getargspec(cls.__init__).args
+    except TypeError:
+        args = []
+    return cls(**dict([(k, v) for k, v in kwargs.items() if k in args]))
+
+
+def createreader(name, **kwargs):
+    '''
+    Create reader of the format (keyword arguments accepted by the reader
+    are passed to the constructor)
+    '''
+    return _create(_readers[name], kwargs)
+
+
+def createwriter(name, **kwargs):
+    '''
+    Create writer of the format (keyword arguments accepted by the writer
+    are passed to the constructor)
+    '''
+    return _create(_writers[name], kwargs)
@@ -29,6 +29,90 @@ Write simulation model in SDF format
 >>> import subprocess
 >>> subprocess.check_call('gz sdf -k /tmp/hrp4c.sdf'.split(' '))
 0
+
+One reader and writer can be used by many threads at the same time (the
+state of each call is kept in its own context)
+
+>>> import tempfile, shutil
+>>> from multiprocessing.pool import ThreadPool
+>>> d = tempfile.mkdtemp()
+>>> box = '<link name="l%i"><visual name="v"><geometry><box><size>%i 1 1</size></box></geometry></visual></link>'
+>>> joint = '<joint name="j%i" type="revolute"><parent>l%i</parent><child>l%i</child><axis><xyz>0 0 1</xyz></axis></joint>'
+>>> for n in range(1, 9):
+...     with open(os.path.join(d, 'm%i.sdf' % n), 'w') as f:
+...         f.write('<sdf version="1.5"><model name="m%i">%s%s</model></sdf>' % (n,
+...             ''.join([box % (i, i + 1) for i in range(n)]), ''.join([joint % (i, i - 1, i) for i in range(1, n)])))
+>>> reader, writer = SDFReader(), SDFWriter()
+>>> def convert(params):
+...     n, k = params
+...     m = reader.read(os.path.join(d, 'm%i.sdf' % n))
+...     os.mkdir(os.path.join(d, 'out%i-%i' % (n, k)))
+...     writer.write(m, os.path.join(d, 'out%i-%i' % (n, k), 'm.sdf'))
+...     return open(os.path.join(d, 'out%i-%i' % (n, k), 'm.sdf')).read()
+>>> expected = dict([(n, convert((n, 0))) for n in range(1, 9)])
+>>> pool = ThreadPool(8)
+>>> results = pool.map(convert, [(n, k) for k in range(1, 9) for n in range(1, 9)])
+>>> pool.close()
+>>> all([r == expected[n] for r, n in zip(results, [n for k in range(1, 9) for n in range(1, 9)])])
+True
+
+So can the readers of the models with meshes (URDF models with COLLADA
+visual and STL collision meshes, VRML models with mesh shapes) and the
+writers writing the meshes in COLLADA, glTF and STL formats
+
+>>> import re
+>>> from . import model, collada, stl, urdf, vrml
+>>> s = model.ShapeModel()
+>>> s.shapeType = model.ShapeModel.SP_MESH
+>>> s.data = model.MeshData()
+>>> s.data.vertex = numpy.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1]], dtype=float)
+>>> s.data.vertex_index = numpy.array([[0, 2, 1], [0, 1, 3], [0, 3, 2], [1, 2, 3]])
+>>> s.data.material = model.MaterialModel()
+>>> collada.ColladaWriter().write(s, os.path.join(d, 'tetra.dae'))
+>>> stl.STLWriter().write(s, os.path.join(d, 'tetra.stl'))
+>>> mesh = '<link name="l%i"><visual><geometry><mesh filename="%s" scale="%i 1 1"/></geometry></visual><collision><geometry><mesh filename="%s"/></geometry></collision></link>'
+>>> joint = '<joint name="j%i" type="revolute"><parent link="l%i"/><child link="l%i"/><axis xyz="0 0 1"/><limit lower="-1" upper="1" effort="1" velocity="1"/></joint>'
+>>> segment = 'DEF J%i Joint { jointType "rotate" jointAxis "Z" translation 1 0 0 children [ DEF S%i Segment { children [ Shape { geometry IndexedFaceSet { coord Coordinate { point [ 0 0 0, 1 0 0, 0 %i 0, 0 0 1 ] } coordIndex [ 0 2 1 -1 0 1 3 -1 0 3 2 -1 1 2 3 -1 ] } } ] } %s ] }'
+>>> for n in range(1, 5):
+...     with open(os.path.join(d, 'u%i.urdf' % n), 'w') as f:
+...         f.write('<robot name="u%i">%s%s</robot>' % (n,
+...             ''.join([mesh % (i, os.path.join(d, 'tetra.dae'), i + 1, os.path.join(d, 'tetra.stl')) for i in range(n)]),
+...             ''.join([joint % (i, i - 1, i) for i in range(1, n)])))
+...     body = ''
+...     for i in reversed(range(1, n + 1)):
+...         body = segment % (i, i, i + 1, body)
+...     with open(os.path.join(d, 'v%i.wrl' % n), 'w') as f:
+...         f.write('DEF BODY Joint { jointType "free" children [ DEF S0 Segment { } %s ] }' % body)
+>>> readers = {'.urdf': urdf.URDFReader(), '.wrl': vrml.VRMLReader()}
+>>> writers = {'.sdf': SDFWriter(meshformat='glb'), '.urdf': urdf.URDFWriter()}
+>>> def convertmeshes(params):
+...     fname, ext, k = params
+...     m = readers[os.path.splitext(fname)[1]].read(os.path.join(d, fname))
+...     out = os.path.join(d, 'out-%s%s-%i' % (fname, ext, k))
+...     os.mkdir(out)
+...     writers[ext].write(m, os.path.join(out, 'm' + ext))
+...     # COLLADA files record the time they are written
+...     return dict([(f, re.sub('<(created|modified)>.*<', '<', open(os.path.join(out, f), 'rb').read())) for f in os.listdir(out)])
+>>> jobs = [(f % n, ext) for f in ['u%i.urdf', 'v%i.wrl'] for n in range(1, 5) for ext in ['.sdf', '.urdf']]
+>>> expected = dict([(j, convertmeshes(j + (0,))) for j in jobs])
+>>> sorted(set([os.path.splitext(f)[1] for r in expected.values() for f in r]))
+['.dae', '.glb', '.sdf', '.stl', '.urdf']
+>>> pool = ThreadPool(8)
+>>> results = pool.map(convertmeshes, [j + (k,) for k in range(1, 5) for j in jobs])
+>>> pool.close()
+>>> all([r == expected[j] for r, j in zip(results, [j for k in range(1, 5) for j in jobs])])
+True
+
+Events of the reader can be interleaved
+
+>>> iterators = [reader.iterread(os.path.join(d, 'm2.sdf')), reader.iterread(os.path.join(d, 'm3.sdf'))]
+>>> events = [[], []]
+>>> while len([e for e in events if e[-1:] != [None]]) > 0:
+...     for i in range(2):
+...         events[i].append(next(iterators[i], None))
+>>> [len(stream.collect(e[:e.index(None)]).links) for e in events]
+[2, 3]
+>>> shutil.rmtree(d)
 """
 
 from logging import getLogger
@@ -39,40 +123,70 @@ import subprocess
 import lxml.etree
 import numpy
 import warnings
+import functools
 with warnings.catch_warnings():
     warnings.simplefilter('ignore')
     from .thirdparty import transformations as tf
-import jinja2
 from . import model
 from . import urdf
 from . import collada
 from . import stl
 from . import utils
+from . import cache
+from . import profiling
+from . import memory
+from . import stream
+from . import pipeline
+from . import sink
+from . import archive
+from . import project
 
 
-class SDFReader(object):
+class SDFReader(utils.Reentrant):
     '''
     SDF reader class
     '''
     def __init__(self):
+        self._reset()
+
+    def _reset(self):
         self._assethandler = None
         self._linkmap = {}
         self._relpositionmap = {}
         self._rootname = None
+        self._sources = []
 
     def read(self, fname, assethandler=None):
         '''
         Read SDF model data given the model file
         '''
+        return stream.collect(self.iterread(fname, assethandler))
+
+    def iterread(self, fname, assethandler=None):
+        '''
+        Read SDF model data given the model file (or "world.sdf#name" to
+        read the model defined in the world) and generate the events (see
+        simtrans.stream) while parsing
+        '''
+        return self._context()._iterread(fname, assethandler)
+
+    def _iterread(self, fname, assethandler):
         self._assethandler = assethandler
         bm = model.BodyModel()
-        d = lxml.etree.parse(open(utils.resolveFile(fname)))
-        dm = d.find('model')
+        fname, name = splitfragment(fname)
+        fname = utils.resolveFile(fname)
+        self._sources = [fname]
+        bm.sources = self._sources
+        d = lxml.etree.parse(archive.open(fname))
+        dm = findmodel(d, name)
+        if dm is None:
+            raise Exception('no model found in %s (world files are read by readproject)' % fname)
         bm.name = self._rootname = dm.attrib['name']
+        yield (stream.BODY, bm)
 
         for i in dm.findall('include'):
-            r = SDFReader()
-            m = r.read(utils.resolveFile(i.find('uri').text) + '/model.sdf')
+            m = self.read(utils.resolveFile(i.find('uri').text) + '/model.sdf')
+            self._sources.extend(m.sources)
             name = i.find('name').text
             pose = i.find('pose')
             p = model.TransformationModel()
@@ -84,6 +198,8 @@ class SDFReader(object):
                     l.trans = p.gettranslation()
                     l.rot = p.getrotation()
                 bm.links.append(l)
+                for e in stream.linkevents(l):
+                    yield e
             for j in m.joints:
                 j.name = name + '::' + j.name
                 if j.parent != 'world':
@@ -91,6 +207,7 @@ class SDFReader(object):
                 if j.child != 'world':
                     j.child = name + '::' + j.child
                 bm.joints.append(j)
+                yield (stream.JOINT, j)
 
         for l in dm.findall('link'):
             # general information
@@ -109,13 +226,16 @@ class SDFReader(object):
                 lm.inertia = self.readInertia(inertial.find('inertia'))
             # visual property
             lm.visuals = []
-            for v in l.findall('visual'):
-                lm.visuals.append(self.readShape(v))
+            for i, v in enumerate(l.findall('visual')):
+                lm.visuals.append(self.readShape(v, lm.name, i))
+                yield (stream.SHAPE, lm.visuals[-1])
             # contact property
-            #collision = l.find('collision')
-            #if collision is not None:
-            #    lm.collision = self.readShape(collision)
+            lm.collisions = []
+            for i, c in enumerate(l.findall('collision')):
+                lm.collisions.append(self.readShape(c, lm.name, i))
+                yield (stream.SHAPE, lm.collisions[-1])
             bm.links.append(lm)
+            yield (stream.LINK, lm)
 
         for lm in bm.links:
             self._linkmap[lm.name] = lm
@@ -165,6 +285,7 @@ class SDFReader(object):
                 print "warning: link %s referenced by joint %s does not exist (ignoring)" % (jm.child, jm.name)
             else:
                 bm.joints.append(jm)
+                yield (stream.JOINT, jm)
 
         roots = utils.findroot(bm)
         if len(roots) > 0:
@@ -184,7 +305,72 @@ class SDFReader(object):
             except KeyError:
                 pass
 
-        return bm
+        yield (stream.END, bm)
+
+    def isproject(self, fname):
+        '''
+        Check whether the file is a world file
+        '''
+        fname, name = splitfragment(fname)
+        if name is not None:
+            return False
+        try:
+            d = lxml.etree.parse(archive.open(utils.resolveFile(fname)))
+        except (IOError, lxml.etree.XMLSyntaxError):
+            return False
+        return d.find('model') is None and d.find('world') is not None
+
+    def readproject(self, fname, assethandler=None):
+        '''
+        Read the models included or defined in the world file (each model
+        is read once even if it is placed many times)
+        '''
+        p = model.ProjectModel()
+        fname = utils.resolveFile(fname)
+        d = lxml.etree.parse(archive.open(fname))
+        w = d.find('world')
+        p.name = w.attrib.get('name', os.path.splitext(os.path.basename(fname))[0])
+        bodies = {}
+        names = set()
+        for e in w:
+            if e.tag == 'include':
+                uri = e.find('uri').text.strip()
+                source = utils.resolveFile(uri) + '/model.sdf'
+                if not archive.exists(source):
+                    print "warning: model %s included in %s is not found (ignoring)" % (uri, fname)
+                    continue
+                if lxml.etree.parse(archive.open(source)).find('model') is None:
+                    # e.g. light source
+                    print "warning: %s does not define a model (ignoring)" % uri
+                    continue
+                name = uri.rstrip('/').split('/')[-1]
+            elif e.tag == 'model':
+                name = e.attrib['name']
+                source = fname + '#' + name
+            else:
+                continue
+            i = model.InstanceModel()
+            n = e.find('name')
+            i.name = n.text.strip() if n is not None else name
+            pose = e.find('pose')
+            if pose is not None:
+                self.readPose(i, pose)
+            if source not in bodies:
+                with profiling.stage('read body', source):
+                    bm = self.read(source, assethandler)
+                bm.url = source
+                # name the body uniquely since the files of the bodies are written by their names
+                bm.name = name
+                count = 1
+                while bm.name in names:
+                    count = count + 1
+                    bm.name = '%s-%i' % (name, count)
+                names.add(bm.name)
+                bodies[source] = bm
+                p.bodies.append(bm)
+            i.body = bodies[source]
+            p.instances.append(i)
+        return p
 
     def convertchildren(self, mdata, joint):
         absparent = self._linkmap[joint.parent]
@@ -224,6 +410,21 @@ class SDFReader(object):
             return model.JointModel.J_CONTINUOUS
         raise Exception('unsupported joint type: %s' % d)
 
+    def readMesh(self, reader, filename, submesh=None, center=False):
+        if submesh is None:
+            return cache.readmesh(reader, filename, assethandler=self._assethandler)
+        data = cache.readmesh(reader, filename, submesh=submesh, assethandler=self._assethandler)
+        if center is True:
+            tm = model.MeshTransformData()
+            tm.children = [data]
+            c = data.getcenter()
+            tm.matrix = numpy.identity(4)
+            tm.matrix[0, 3] = -c[0]
+            tm.matrix[1, 3] = -c[1]
+            tm.matrix[2, 3] = -c[2]
+            data = tm
+        return data
+
     def readInertia(self, d):
         inertia = numpy.zeros((3, 3))
         inertia[0, 0] = float(d.find('ixx').text)
@@ -234,9 +435,11 @@ class SDFReader(object):
         inertia[2, 2] = float(d.find('izz').text)
         return inertia
 
-    def readShape(self, d):
+    @profiling.profiled('read shape')
+    def readShape(self, d, linkname='', index=0):
         m = model.ShapeModel()
         m.name = self._rootname + '-' + d.attrib['name']
+        m.meshname = utils.shapename(d, linkname, index)
         pose = d.find('pose')
         if pose is not None:
             self.readPose(m, pose)
@@ -245,6 +448,7 @@ class SDFReader(object):
                 m.shapeType = model.ShapeModel.SP_MESH
                 # print "reading mesh " + mesh.attrib['filename']
                 filename = utils.resolveFile(g.find('uri').text)
+                self._sources.append(filename)
                 fileext = os.path.splitext(filename)[1].lower()
                 if fileext == '.dae':
                     reader = collada.ColladaReader()
@@ -263,19 +467,12 @@ class SDFReader(object):
                         submeshcenter = (submesh.find('center').text.lower().count('true') > 0)
                     except KeyError:
                         pass
-                    m.data = reader.read(filename, submesh=submeshname, assethandler=self._assethandler)
-                    if submeshcenter is True:
-                        tm = model.MeshTransformData()
-                        tm.children = [m.data]
-                        center = m.data.getcenter()
-                        tm.matrix = numpy.identity(4)
-                        tm.matrix[0, 3] = -center[0]
-                        tm.matrix[1, 3] = -center[1]
-                        tm.matrix[2, 3] = -center[2]
-                        m.data = tm
+                    m.data = memory.lazy(m, functools.partial(self.readMesh, reader, filename, submeshname, submeshcenter), filename)
                     m.name = m.name + '-' + submeshname
+                    m.meshname = m.meshname + '-' + submeshname
+                    m.submesh = (submeshname, submeshcenter)
                 else:
-                    m.data = reader.read(filename, assethandler=self._assethandler)
+                    m.data = memory.lazy(m, functools.partial(self.readMesh, reader, filename), filename)
             elif g.tag == 'box':
                 m.shapeType = model.ShapeModel.SP_BOX
                 boxsize = [float(v) for v in g.find('size').text.split(' ')]
@@ -297,47 +494,94 @@ class SDFReader(object):
         return m
 
 
-class SDFWriter(object):
+def splitfragment(fname):
+    '''
+    Split "world.sdf#name" into the file name and the model name (None if
+    not specified)
+    '''
+    if '#' in fname:
+        fname, name = fname.rsplit('#', 1)
+        return fname, name
+    return fname, None
+
+
+def findmodel(d, name=None):
+    '''
+    Find the model in SDF document (the first model or the model of the
+    name defined in the document or its world)
+    '''
+    if name is None:
+        return d.find('model')
+    for m in d.findall('model') + d.findall('world/model'):
+        if m.attrib.get('name') == name:
+            return m
+    return None
+
+
+class SDFWriter(utils.Reentrant):
     '''
     SDF writer class
     '''
-    def __init__(self):
+    def __init__(self, meshformat='dae', quantize=False):
+        self.meshformat = meshformat  #: Format of visual mesh files ('dae' or 'glb')
+        self.quantize = quantize      #: Quantize vertex attributes (only for 'glb')
+        self.sharedmeshes = {}        #: Mesh files shared with the other bodies of the world (see simtrans.project.sharedmeshes)
+        self._reset()
+
+    def _reset(self):
         self._jointparentmap = {}
         self._linkmap = {}
         self._sensorparentmap = {}
         self._absolutepositionmap = {}
         self._root = None
 
-    def write(self, m, f):
+    def write(self, m, f, manifest=None):
         '''
         Write simulation model in SDF format
         '''
+        self.writestream(stream.iterevents(m), f, manifest)
+
+    def writestream(self, events, f, manifest=None):
+        '''
+        Write simulation model in SDF format given the events (mesh files
+        of each link are written as soon as the link is read)
+        '''
+        self._context()._writestream(events, f, manifest)
+
+    def _writestream(self, events, f, manifest):
         # render the data structure using template
-        loader = jinja2.PackageLoader(self.__module__, 'template')
-        env = jinja2.Environment(loader=loader)
+        env = cache.environment()
 
-        # render mesh data to each separate collada file
-        cwriter = collada.ColladaWriter()
-        swriter = stl.STLWriter()
+        # render mesh data to each separate collada (or glb) file
         dirname = os.path.dirname(f)
         fpath, ext = os.path.splitext(f)
         if ext == '.world':
-            m.name = os.path.basename(fpath)
             dirname = fpath
-            try:
-                os.mkdir(fpath)
-            except OSError:
-                pass
+            sink.makedirs(fpath)
+        m = None
+        for kind, obj in events:
+            if kind == stream.LINK:
+                pipeline.submit(urdf.writelinkmeshes, obj, dirname, self.meshformat, self.quantize, manifest, self.sharedmeshes)
+            elif kind == stream.END:
+                m = obj
+
+        if ext == '.world':
+            m.name = os.path.basename(fpath)
             template = env.get_template('sdf-model-config.xml')
-            with open(os.path.join(dirname, 'model.config'), 'w') as ofile:
-                ofile.write(template.render({
+            with sink.open(os.path.join(dirname, 'model.config'), 'w') as ofile:
+                template.stream({
                     'model': m
-                }))
+                }).dump(ofile)
             template = env.get_template('sdf-world.xml')
-            with open(f, 'w') as ofile:
-                ofile.write(template.render({
-                    'model': m
-                }))
+            with sink.open(f, 'w') as ofile:
+                template.stream({
+                    'world': m.name + '_test',
+                    'ground': True,
+                    'instances': [{'uri': m.name, 'comment': 'robot'}]
+                }).dump(ofile)
+            if manifest is not None:
+                manifest.addoutput(os.path.join(dirname, 'model.config'))
+                manifest.addoutput(f)
             f = os.path.join(dirname, 'model.sdf')
 
         # render mesh collada file for each links
@@ -356,7 +600,7 @@ class SDFWriter(object):
         except IndexError:
             if len(m.joints) == 0:
                 self._root = m.links[0].name
-        if m.joints[0].jointType == model.JointModel.J_FIXED:
+        if len(m.joints) > 0 and m.joints[0].jointType == model.JointModel.J_FIXED:
             m.joints[0].jointType = model.JointModel.J_REVOLUTE
             m.joints[0].limits = [0, 0]
 
@@ -370,21 +614,85 @@ class SDFWriter(object):
         self._absolutepositionmap[self._root] = rootposition
         for cjoint in utils.findchildren(m, self._root):
             self.convertchildren(m, cjoint)
+        def meshuri(s, ext):
+            path = project.sharedfile(self.sharedmeshes, s, os.path.join(dirname, s.getmeshname() + ext))[1]
+            if path != os.path.join(dirname, s.getmeshname() + ext):
+                # written in the directory of another body
+                return 'model://%s/%s' % (os.path.basename(os.path.dirname(path)), os.path.basename(path))
+            return 'model://%s/%s%s' % (m.name, s.getmeshname(), ext)
+
         template = env.get_template('sdf.xml')
-        with open(f, 'w') as ofile:
-            ofile.write(template.render({
+        with sink.open(f, 'w') as ofile:
+            template.stream({
                 'model': m,
+                'meshuri': meshuri,
                 'jointparentmap': self._jointparentmap,
                 'sensorparentmap': self._sensorparentmap,
                 'absolutepositionmap': self._absolutepositionmap,
+                'meshformat': self.meshformat,
                 'ShapeModel': model.ShapeModel
-            }))
+            }).dump(ofile)
+        if manifest is not None:
+            manifest.addoutput(f)
+        if ext != '.world' and os.path.basename(f) == 'model.sdf':
+            # complete the model directory of gazebo (named after the directory)
+            config = os.path.join(os.path.dirname(f), 'model.config')
+            template = env.get_template('sdf-model-config.xml')
+            with sink.open(config, 'w') as ofile:
+                template.stream({
+                    'model': {'name': os.path.basename(os.path.dirname(f)) or m.name}
+                }).dump(ofile)
+            if manifest is not None:
+                manifest.addoutput(config)
+
+    def bodyfile(self, f, body):
+        '''
+        Get the file to write the body of the world (the model directory
+        is placed next to the world file)
+        '''
+        return os.path.join(os.path.dirname(f), body.name, 'model.sdf')
 
-        for l in m.links:
-            for v in l.visuals:
-                if v.shapeType == model.ShapeModel.SP_MESH:
-                    cwriter.write(v, os.path.join(dirname, v.name + ".dae"))
-                    swriter.write(v, os.path.join(dirname, v.name + ".stl"))
+    def meshfiles(self, f, body):
+        '''
+        List the mesh files written for the body (shape and path of each
+        file)
+        '''
+        dirname = os.path.dirname(f)
+        fpath, ext = os.path.splitext(f)
+        if ext == '.world':
+            dirname = fpath
+        return [(s, fname) for l in body.links for s, fmt, fname in urdf.linkmeshfiles(l, dirname, self.meshformat)]
+
+    def writeproject(self, p, f, manifest=None):
+        '''
+        Write the world file including the bodies (and model.config of
+        each body) in SDF format (bodies are written by write() to the
+        files given by bodyfile())
+        '''
+        env = cache.environment()
+        template = env.get_template('sdf-model-config.xml')
+        for b in p.bodies:
+            config = os.path.join(os.path.dirname(self.bodyfile(f, b)), 'model.config')
+            with sink.open(config, 'w') as ofile:
+                template.stream({
+                    'model': b
+                }).dump(ofile)
+            if manifest is not None:
+                manifest.addoutput(config)
+        instances = []
+        for i in p.instances:
+            pose = list(i.gettranslation()) + list(i.getrpy())
+            instances.append({'uri': i.body.name, 'name': i.name, 'comment': i.name,
+                              'pose': ['%g' % v for v in pose]})
+        template = env.get_template('sdf-world.xml')
+        with sink.open(f, 'w') as ofile:
+            template.stream({
+                'world': p.name,
+                'ground': False,
+                'instances': instances
+            }).dump(ofile)
+        if manifest is not None:
+            manifest.addoutput(f)
 
     def convertchildren(self, mdata, joint):
         absparent = self._absolutepositionmap[joint.parent]
@@ -403,8 +711,7 @@ class SDFWriter(object):
         (internally use urdf and convert to sdf using gz sdf utility)
         '''
         # render the data structure using template
-        loader = jinja2.PackageLoader(self.__module__, 'template')
-        env = jinja2.Environment(loader=loader)
+        env = cache.environment()
 
         # render mesh data to each separate collada file
         dirname = os.path.dirname(f)
@@ -418,20 +725,23 @@ class SDFWriter(object):
                 pass
             template = env.get_template('sdf-model-config.xml')
             with open(os.path.join(dirname, 'model.config'), 'w') as ofile:
-                ofile.write(template.render({
+                template.stream({
                     'model': m
-                }))
+                }).dump(ofile)
             template = env.get_template('sdf-world.xml')
             with open(f, 'w') as ofile:
-                ofile.write(template.render({
-                    'model': m
-                }))
+                template.stream({
+                    'world': m.name + '_test',
+                    'ground': True,
+                    'instances': [{'uri': m.name, 'comment': 'robot'}]
+                }).dump(ofile)
             f = os.path.join(dirname, 'model.sdf')
 
         uwriter = urdf.URDFWriter()
         urdffile = f.replace('.sdf', '.urdf')
         uwriter.write(m, urdffile)
-        d = subprocess.check_output(['gz', 'sdf', '-p', urdffile])
+        with profiling.stage('gz sdf', urdffile):
+            d = subprocess.check_output(['gz', 'sdf', '-p', urdffile])
         with open(f, 'w') as of:
             of.write(d)
 
@@ -0,0 +1,317 @@
+# -*- coding:utf-8 -*-
+
+"""Output sinks collecting the files written by the writers
+
+Writers open their outputs (the main document and the side files such as
+mesh files, ``model.config`` and converted textures) by :func:`open` of
+this module, which writes to the files unless another sink is active in
+the thread. While a :class:`MemorySink` is active, the outputs are kept as
+named in-memory buffers and no file (nor directory) is created. Binary
+data passed as ``memoryview`` (e.g. vertex arrays of glb and stl meshes)
+is kept as it is without being copied, so the buffers must not be
+modified after they are written. The sink active in the thread is also
+active in the worker threads of the pipeline.
+
+Writers of a single document (mesh writers, URDF and Graphviz) also accept
+a file-like object in place of the path (binary meshes are written as
+buffers, e.g. to ``io.BytesIO``). Side files are then named relative to
+the name of the file object (or to the current directory if it has no
+name). Conversions writing a world with many bodies run in worker
+processes and need the files.
+
+:Organization:
+ AIST
+
+Examples
+--------
+
+Write the model to URDF collecting the mesh files in memory
+
+>>> from . import model, urdf
+>>> bm = model.BodyModel()
+>>> bm.name = 'box'
+>>> l = model.LinkModel()
+>>> l.name = 'base'
+>>> s = model.ShapeModel()
+>>> s.name = 'mesh0'
+>>> s.shapeType = model.ShapeModel.SP_MESH
+>>> s.data = model.MeshData()
+>>> s.data.vertex = numpy.array([[0, 0, 0], [1, 0, 0], [0, 1, 0]], dtype=float)
+>>> s.data.vertex_index = numpy.array([[0, 1, 2]])
+>>> s.data.material = model.MaterialModel()
+>>> l.visuals.append(s)
+>>> bm.links.append(l)
+>>> output = MemorySink()
+>>> with output.activate():
+...     urdf.URDFWriter(meshformat='glb').write(bm, 'out/box.urdf')
+>>> output.names()
+['out/mesh0.glb', 'out/mesh0.stl', 'out/box.urdf']
+>>> os.path.exists('out')
+False
+>>> '<robot name="box"' in output.getvalue('out/box.urdf')
+True
+>>> output.size('out/mesh0.stl')
+134
+
+Vertex arrays of the meshes are passed without copies
+
+>>> [type(c).__name__ for c in output.chunks('out/mesh0.stl')]
+['str', 'memoryview']
+
+Write the main document to a file object
+
+>>> from StringIO import StringIO
+>>> out = StringIO()
+>>> output = MemorySink()
+>>> with output.activate():
+...     urdf.URDFWriter().write(bm, out)
+>>> output.names()
+['mesh0.dae', 'mesh0.stl']
+>>> '<robot name="box"' in out.getvalue()
+True
+"""
+
+import os
+import sys
+import hashlib
+import threading
+import collections
+import __builtin__
+import numpy
+
+_local = threading.local()
+
+
+class DirectorySink(object):
+    '''
+    Sink writing the outputs to the files (default, other sinks override
+    the methods to write elsewhere)
+    '''
+    local = True  #: Outputs are files (external tools can write them)
+
+    def activate(self):
+        '''
+        Context manager to write the outputs of the writers to the sink in
+        the current thread
+        '''
+        sink = self
+
+        class _Activation(object):
+            def __enter__(self):
+                self._previous = getattr(_local, 'sink', None)
+                _local.sink = sink
+                return sink
+
+            def __exit__(self, *args):
+                _local.sink = self._previous
+                return False
+        return _Activation()
+
+    def open(self, fname, mode='w'):
+        '''
+        Open the output to write
+        '''
+        return __builtin__.open(fname, mode)
+
+    def makedirs(self, dirname):
+        '''
+        Create the directory of the outputs (if not exists)
+        '''
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            if not os.path.isdir(dirname):
+                raise
+
+    def digest(self, fname):
+        '''
+        Calculate sha1 digest of the output
+        '''
+        # utils imports the pipeline which imports this module
+        from . import utils
+        return utils.filedigest(fname)
+
+
+class MemorySink(DirectorySink):
+    '''
+    Sink keeping the outputs as named in-memory buffers (in the order
+    they are opened)
+    '''
+    local = False
+
+    def __init__(self):
+        self._outputs = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def open(self, fname, mode='w'):
+        if mode not in ['w', 'wb']:
+            raise Exception('unsupported mode: %s' % mode)
+        f = Buffer(os.path.normpath(fname))
+        with self._lock:
+            self._outputs.pop(f.name, None)
+            self._outputs[f.name] = f
+        return f
+
+    def makedirs(self, dirname):
+        pass
+
+    def digest(self, fname):
+        h = hashlib.sha1()
+        for c in self.chunks(fname):
+            h.update(c)
+        return h.hexdigest()
+
+    def _buffer(self, fname):
+        try:
+            return self._outputs[os.path.normpath(fname)]
+        except KeyError:
+            raise Exception('no such output: %s' % fname)
+
+    def names(self):
+        '''
+        Get the names of the outputs
+        '''
+        with self._lock:
+            return self._outputs.keys()
+
+    def chunks(self, fname):
+        '''
+        Get the data of the output as it was written (``str`` or
+        ``memoryview`` of the buffers passed to the writer)
+        '''
+        return list(self._buffer(fname).chunks)
+
+    def size(self, fname):
+        '''
+        Get the size of the output in bytes
+        '''
+        return self._buffer(fname).size
+
+    def getvalue(self, fname):
+        '''
+        Get the data of the output joined in a string (copies the buffers)
+        '''
+        return ''.join([c if isinstance(c, str) else c.tobytes() for c in self.chunks(fname)])
+
+
+class Buffer(object):
+    '''
+    Write-only file object keeping the data in memory (chunks are ``str``
+    or ``memoryview`` of the buffers written)
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.chunks = []
+        self.size = 0
+        self.closed = False
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+        if isinstance(data, unicode):
+            data = data.encode(sys.getdefaultencoding())
+        elif not isinstance(data, str):
+            # keep the buffer without copying it
+            data = memoryview(data)
+            self.size = self.size + int(data.itemsize * numpy.prod(data.shape))
+            self.chunks.append(data)
+            return
+        self.size = self.size + len(data)
+        self.chunks.append(data)
+
+    def writelines(self, lines):
+        for l in lines:
+            self.write(l)
+
+    def tell(self):
+        return self.size
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+
+class _Unclosed(object):
+    '''
+    File object given by the caller (left open at the end of the with
+    statement)
+    '''
+    def __init__(self, f):
+        self._f = f
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+    def __enter__(self):
+        return self._f
+
+    def __exit__(self, *args):
+        return False
+
+_default = DirectorySink()
+
+
+def current():
+    '''
+    Get the sink active in the current thread (files if not activated)
+    '''
+    return getattr(_local, 'sink', None) or _default
+
+
+def active():
+    '''
+    Get the sink activated in the current thread (None if not activated)
+    '''
+    return getattr(_local, 'sink', None)
+
+
+def isfile(f):
+    '''
+    Check whether the output is given as a file-like object
+    '''
+    return hasattr(f, 'write')
+
+
+def filename(f):
+    '''
+    Get the path of the output given as the path or the file-like object
+    (side files are named relative to it)
+    '''
+    if isfile(f):
+        name = getattr(f, 'name', '')
+        return name if isinstance(name, basestring) and not name.startswith('<') else ''
+    return f
+
+
+def open(f, mode='w'):
+    '''
+    Open the output in the active sink (file-like objects are returned as
+    they are and left open by the with statement)
+    '''
+    if isfile(f):
+        return _Unclosed(f)
+    return current().open(f, mode)
+
+
+def makedirs(dirname):
+    '''
+    Create the directory of the outputs in the active sink
+    '''
+    if dirname:
+        current().makedirs(dirname)
+
+
+def digest(fname):
+    '''
+    Calculate sha1 digest of the output in the active sink
+    '''
+    return current().digest(fname)
@@ -2,6 +2,10 @@
 
 """Reader and writer for stl format
 
+Meshes are written in binary STL format. The triangles are packed in a
+numpy record array which is passed to the file (or to the output sink,
+see :mod:`simtrans.sink`) as it is.
+
 :Organization:
  AIST
 
@@ -9,18 +13,39 @@ Requirements
 ------------
 * numpy
 * numpy-stl
-* meshlab
+
+Examples
+--------
+
+Write mesh shape in STL format
+
+>>> import io
+>>> s = model.ShapeModel()
+>>> s.shapeType = model.ShapeModel.SP_MESH
+>>> s.data = model.MeshData()
+>>> s.data.vertex = numpy.array([[0, 0, 0], [1, 0, 0], [0, 1, 0]], dtype=float)
+>>> s.data.vertex_index = numpy.array([[0, 1, 2]])
+>>> out = io.BytesIO()
+>>> STLWriter().write(s, out)
+>>> b = out.getvalue()
+>>> len(b), struct.unpack('<I', b[80:84])[0]
+(134, 1)
+>>> struct.unpack('<3f', b[84:96])
+(0.0, 0.0, 1.0)
 """
 
 from __future__ import absolute_import
 from . import model
-from . import collada
+from . import convex
+from . import sink
+from . import archive
 import numpy
-import os
-import subprocess
-import tempfile
+import struct
 from stl import stl
 
+#: Record of a triangle in binary STL format
+TRIANGLE = numpy.dtype([('normal', '<f4', (3,)), ('vertex', '<f4', (3, 3)), ('attribute', '<u2')])
+
 
 class STLReader(object):
     '''
@@ -32,7 +57,8 @@ class STLReader(object):
         '''
         data = model.MeshData()
         #stl.MAX_COUNT = 1e10
-        p = stl.StlMesh(f)
+        with archive.open(f, 'rb') as fh:
+            p = stl.StlMesh(f, fh=fh)
         npoints = p.v0.shape[0]
         idx = numpy.array(range(0, npoints))
         data.vertex = numpy.concatenate([p.v0, p.v1, p.v2])
@@ -46,12 +72,20 @@ class STLWriter(object):
     '''
     def write(self, m, f):
         '''
-        Write mesh model in STL format
-        This method first generates collada and use meshlab to output stl
+        Write mesh model in binary STL format (transforms of the mesh tree
+        are applied to the vertices)
+
+        :param m: shape model
+        :param f: path (or file object) of the file to save
         '''
-        fd, daefile = tempfile.mkstemp(suffix='.dae')
-        os.close(fd)
-        cwriter = collada.ColladaWriter()
-        cwriter.write(m, daefile)
-        subprocess.check_call(['meshlabserver', '-i', daefile, '-o', f], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        os.unlink(daefile)
+        vertex, vertex_index = convex.flatten(m.data)
+        triangles = numpy.zeros(len(vertex_index), dtype=TRIANGLE)
+        tri = vertex[vertex_index]
+        triangles['vertex'] = tri
+        n = numpy.cross(tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0])
+        norm = numpy.sqrt((n ** 2).sum(axis=1))
+        norm[norm == 0] = 1
+        triangles['normal'] = n / norm[:, numpy.newaxis]
+        with sink.open(f, 'wb') as ofile:
+            ofile.write(struct.pack('<80sI', 'simtrans', len(triangles)))
+            ofile.write(memoryview(triangles.view(numpy.uint8)))
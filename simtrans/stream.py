@@ -0,0 +1,107 @@
+# -*- coding:utf-8 -*-
+
+"""Stream of the model events from readers to writers
+
+Readers which support streaming have ``iterread(fname, assethandler=None)``
+generating events while parsing, and writers which support streaming have
+``writestream(events, fname, manifest=None)`` writing mesh files of each
+link as soon as the link is read. Each event is a tuple ``(kind, obj)``:
+
+* ``(BODY, body)`` -- first event with the body model being built
+* ``(SHAPE, shape)`` -- visual or collision shape (before the link it belongs to)
+* ``(LINK, link)`` -- link with its shapes
+* ``(JOINT, joint)`` -- joint
+* ``(SENSOR, sensor)`` -- sensor
+* ``(END, body)`` -- last event with the complete body model
+
+Links and joints are appended to the body when they are generated, but
+their poses may be updated until the end event (e.g. SDF reader converts
+absolute poses to relative ones after reading all the joints), so only
+the shapes are safe to write before the end event.
+
+:Organization:
+ AIST
+
+Examples
+--------
+
+Convert built model to events and back
+
+>>> from . import model
+>>> bm = model.BodyModel()
+>>> l = model.LinkModel()
+>>> l.name = 'base'
+>>> l.visuals = [model.ShapeModel()]
+>>> bm.links = [l]
+>>> [k for k, o in iterevents(bm)]
+['body', 'shape', 'link', 'end']
+>>> collect(iterevents(bm)) is bm
+True
+"""
+
+BODY = 'body'      #: Start of the body
+SHAPE = 'shape'    #: Shape of the link
+LINK = 'link'      #: Link
+JOINT = 'joint'    #: Joint
+SENSOR = 'sensor'  #: Sensor
+END = 'end'        #: End of the body
+
+
+def linkevents(l):
+    '''
+    Generate events of the shapes of the link and the link
+    '''
+    for s in l.visuals:
+        yield (SHAPE, s)
+    for s in l.collisions:
+        if s not in l.visuals:
+            yield (SHAPE, s)
+    yield (LINK, l)
+
+
+def iterevents(bm):
+    '''
+    Generate events of the model already built
+    '''
+    yield (BODY, bm)
+    for l in bm.links:
+        for e in linkevents(l):
+            yield e
+    for j in bm.joints:
+        yield (JOINT, j)
+    for s in bm.sensors:
+        yield (SENSOR, s)
+    yield (END, bm)
+
+
+def collect(events):
+    '''
+    Consume the events and return the complete body model
+    '''
+    bm = None
+    for kind, obj in events:
+        if kind == END:
+            bm = obj
+    if bm is None:
+        raise Exception('model stream ended without end event')
+    return bm
+
+
+def iterread(reader, fname, assethandler=None):
+    '''
+    Generate events of the model read by the reader (readers without
+    streaming support read the whole model first)
+    '''
+    if hasattr(reader, 'iterread'):
+        return reader.iterread(fname, assethandler=assethandler)
+    return iterevents(reader.read(fname, assethandler=assethandler))
+
+
+def writestream(writer, events, fname, manifest=None):
+    '''
+    Write the model given by the events (writers without streaming
+    support write after collecting the whole model)
+    '''
+    if hasattr(writer, 'writestream'):
+        return writer.writestream(events, fname, manifest=manifest)
+    return writer.write(collect(events), fname, manifest=manifest)
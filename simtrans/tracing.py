@@ -0,0 +1,198 @@
+# -*- coding:utf-8 -*-
+
+"""Record spans of the conversion and export them in Chrome trace format
+
+Spans show when each stage ran in each thread and process, so that the
+overlap of mesh loading and writing of parallel conversions can be seen
+in chrome://tracing or Perfetto. The stages measured by
+:mod:`simtrans.profiling` are recorded as spans while a tracer is
+active, otherwise tracing costs a global variable lookup.
+
+:Organization:
+ AIST
+
+Examples
+--------
+
+Record spans with attributes
+
+>>> t = Tracer()
+>>> with t.activate():
+...     with span('read', path='/tmp/a.urdf'):
+...         with span('read mesh', path='/tmp/a.dae'):
+...             annotate(triangles=12)
+>>> [e['name'] for e in t.events]
+['read mesh', 'read']
+>>> t.events[0]['args']
+{'path': '/tmp/a.dae', 'triangles': 12}
+>>> t.events[1]['ts'] <= t.events[0]['ts']
+True
+
+Nothing is recorded without active tracer
+
+>>> with span('read'):
+...     annotate(triangles=1)
+>>> len(t.events)
+2
+
+Export in Chrome trace event format
+
+>>> d = t.tochrome()
+>>> sorted(set([e['ph'] for e in d['traceEvents']]))
+['M', 'X']
+"""
+
+import os
+import json
+import time
+import thread
+import threading
+
+_tracer = None
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_nullspan = _NullSpan()
+
+
+class _Span(object):
+    def __init__(self, tracer, name, args):
+        self._tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self._tracer._push(self)
+        self._start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self._tracer._pop(self, self._start, time.time())
+        return False
+
+
+def current():
+    '''
+    Get the active tracer (None if not tracing)
+    '''
+    return _tracer
+
+
+def span(name, **attrs):
+    '''
+    Context manager to record the span
+
+    :param name: name of the span
+    :param attrs: attributes of the span (e.g. path)
+    '''
+    t = _tracer
+    if t is None:
+        return _nullspan
+    return _Span(t, name, attrs)
+
+
+def annotate(**attrs):
+    '''
+    Add attributes to the innermost span of the current thread
+    '''
+    t = _tracer
+    if t is not None:
+        s = t._current()
+        if s is not None:
+            s.args.update(attrs)
+
+
+class Tracer(object):
+    '''
+    Tracer to record spans of all the threads in the process
+    '''
+    def __init__(self):
+        self.events = []     #: Finished spans as Chrome trace complete events
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._threads = {}
+
+    def activate(self):
+        '''
+        Context manager to activate the tracer in the process
+        '''
+        tracer = self
+
+        class _Activation(object):
+            def __enter__(self):
+                global _tracer
+                self._previous = _tracer
+                _tracer = tracer
+                return tracer
+
+            def __exit__(self, *args):
+                global _tracer
+                _tracer = self._previous
+                return False
+        return _Activation()
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def _current(self):
+        stack = self._stack()
+        if len(stack) == 0:
+            return None
+        return stack[-1]
+
+    def _push(self, s):
+        self._stack().append(s)
+
+    def _pop(self, s, start, end):
+        self._stack().pop()
+        tid = thread.get_ident()
+        e = {'name': s.name, 'cat': 'simtrans', 'ph': 'X', 'pid': os.getpid(), 'tid': tid,
+             'ts': int(start * 1e6), 'dur': int((end - start) * 1e6), 'args': s.args}
+        with self._lock:
+            self.events.append(e)
+            if tid not in self._threads:
+                self._threads[tid] = threading.current_thread().name
+
+    def merge(self, d):
+        '''
+        Merge the trace returned by tochrome() (e.g. of the worker process)
+        '''
+        with self._lock:
+            for e in d['traceEvents']:
+                if e['ph'] == 'X':
+                    self.events.append(e)
+                elif e['ph'] == 'M':
+                    self._threads[(e['pid'], e['tid'])] = e['args']['name']
+
+    def tochrome(self):
+        '''
+        Get the trace in Chrome trace event format
+        '''
+        with self._lock:
+            events = list(self.events)
+            threads = dict(self._threads)
+        meta = []
+        for key, name in threads.items():
+            if isinstance(key, tuple):
+                pid, tid = key
+            else:
+                pid, tid = os.getpid(), key
+            meta.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}})
+        return {'traceEvents': meta + events, 'displayTimeUnit': 'ms'}
+
+    def save(self, fname):
+        '''
+        Save the trace in Chrome trace event format (JSON)
+        '''
+        with open(fname, 'w') as f:
+            json.dump(self.tochrome(), f)
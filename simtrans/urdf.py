@@ -39,20 +39,35 @@ import warnings
 with warnings.catch_warnings():
     warnings.simplefilter('ignore')
     from .thirdparty import transformations as tf
-import jinja2
-import uuid
+import functools
+import itertools
 from . import model
 from . import collada
+from . import gltf
 from . import stl
 from . import utils
+from . import cache
+from . import profiling
+from . import memory
+from . import stream
+from . import pipeline
+from . import xacro
+from . import sink
+from . import archive
+from . import project
+from .manifest import writeshape
 
 
-class URDFReader(object):
+class URDFReader(utils.Reentrant):
     '''
     URDF reader class
     '''
     def __init__(self):
+        self._reset()
+
+    def _reset(self):
         self._assethandler = None
+        self._sources = []
 
     def read(self, fname, assethandler=None):
         """Read URDF model data given the model file
@@ -63,11 +78,33 @@ class URDFReader(object):
         :rtype: model.Model
 
         """
-        if assethandler is not None:
-            self._assethandler = assethandler
+        return stream.collect(self.iterread(fname, assethandler))
+
+    def iterread(self, fname, assethandler=None):
+        """Read URDF model data given the model file and generate the
+        events (see simtrans.stream) while parsing
+
+        :param fname: path of the file to read
+        :param assethandler: asset handler (optional)
+        :returns: generator of the events
+
+        """
+        return self._context()._iterread(fname, assethandler)
+
+    def _iterread(self, fname, assethandler):
+        self._assethandler = assethandler
 
         bm = model.BodyModel()
-        d = lxml.etree.parse(open(utils.resolveFile(fname)))
+        fname = utils.resolveFile(fname)
+        self._sources = [fname]
+        bm.sources = self._sources
+        if fname.endswith('.xacro'):
+            # included files are also the sources of the model
+            del self._sources[:]
+            d = xacro.expand(fname, files=self._sources)
+        else:
+            d = lxml.etree.parse(archive.open(fname))
+        yield (stream.BODY, bm)
 
         for l in d.findall('link'):
             # general information
@@ -81,13 +118,16 @@ class URDFReader(object):
                 lm.inertia = self.readInertia(inertial.find('inertia'))
             # visual property
             lm.visuals = []
-            for v in l.findall('visual'):
-                lm.visuals.append(self.readShape(v))
+            for i, v in enumerate(l.findall('visual')):
+                lm.visuals.append(self.readShape(v, lm.name, i))
+                yield (stream.SHAPE, lm.visuals[-1])
             # contact property
             lm.collisions = []
-            for c in l.findall('collision'):
-                lm.collisions.append(self.readShape(c))
+            for i, c in enumerate(l.findall('collision')):
+                lm.collisions.append(self.readShape(c, lm.name, i))
+                yield (stream.SHAPE, lm.collisions[-1])
             bm.links.append(lm)
+            yield (stream.LINK, lm)
 
         for j in d.findall('joint'):
             jm = model.JointModel()
@@ -119,8 +159,18 @@ class URDFReader(object):
                 except KeyError:
                     pass
             bm.joints.append(jm)
+            yield (stream.JOINT, jm)
+
+        yield (stream.END, bm)
 
-        return bm
+    def readMesh(self, reader, filename, scale=None):
+        data = cache.readmesh(reader, filename, assethandler=self._assethandler)
+        if scale is not None:
+            d = model.MeshTransformData()
+            d.matrix = tf.scale_matrix(scale)
+            d.children = [data]
+            data = d
+        return data
 
     def readOrigin(self, m, doc):
         try:
@@ -156,9 +206,30 @@ class URDFReader(object):
         inertia[2, 2] = float(d.attrib['izz'])
         return inertia
 
-    def readShape(self, d):
+    def shapeName(self, d, linkname, index):
+        """Generate stable name of the mesh files of the shape derived
+        from the shape definition
+
+        :param d: visual or collision element
+        :param linkname: name of the link the shape belongs to
+        :param index: index of the shape inside the link
+        :returns: base name of the mesh files
+
+        >>> d = lxml.etree.fromstring('<visual><geometry><box size="1 1 1"/></geometry></visual>')
+        >>> r = URDFReader()
+        >>> r.shapeName(d, 'base', 0) == r.shapeName(d, 'base', 0)
+        True
+        >>> r.shapeName(d, 'base', 0) == r.shapeName(d, 'base', 1)
+        False
+        """
+        return utils.shapename(d, linkname, index)
+
+    @profiling.profiled('read shape')
+    def readShape(self, d, linkname='', index=0):
         sm = model.ShapeModel()
-        sm.name = 'shape-' + str(uuid.uuid1()).replace('-', '')
+        # shapes are named by the name attribute (optional) or by the index
+        sm.name = d.attrib.get('name') or '%s%i' % (d.tag, index)
+        sm.meshname = self.shapeName(d, linkname, index)
         origin = d.find('origin')
         if origin is not None:
             self.readOrigin(sm, origin)
@@ -167,21 +238,20 @@ class URDFReader(object):
                 sm.shapeType = model.ShapeModel.SP_MESH
                 # print "reading mesh " + mesh.attrib['filename']
                 filename = utils.resolveFile(g.attrib['filename'])
+                self._sources.append(filename)
                 fileext = os.path.splitext(filename)[1].lower()
                 if fileext == '.dae':
                     reader = collada.ColladaReader()
                 else:
                     reader = stl.STLReader()
-                sm.data = reader.read(filename, assethandler=self._assethandler)
+                scale = None
                 try:
                     scales = [float(v) for v in g.attrib['scale'].split(' ')]
                     if scales[0] != 0.0:
-                        d = model.MeshTransformData()
-                        d.matrix = tf.scale_matrix(scales[0])
-                        d.children = [sm.data]
-                        sm.data = d
+                        scale = scales[0]
                 except KeyError:
                     pass
+                sm.data = memory.lazy(sm, functools.partial(self.readMesh, reader, filename, scale), filename)
             elif g.tag == 'box':
                 sm.shapeType = model.ShapeModel.SP_BOX
                 sm.data = model.BoxData()
@@ -203,39 +273,111 @@ class URDFReader(object):
         return sm
 
 
+def linkmeshfiles(l, dirname, meshformat):
+    '''
+    List the mesh files written for the link by writelinkmeshes
+
+    :returns: list of the shape, the format and the path of each file
+    '''
+    files = []
+    for v in l.visuals:
+        if v.shapeType == model.ShapeModel.SP_MESH:
+            files.append((v, meshformat, os.path.join(dirname, v.getmeshname() + "." + meshformat)))
+            if len(l.collisions) == 0:
+                files.append((v, 'stl', os.path.join(dirname, v.getmeshname() + ".stl")))
+    for c in l.collisions:
+        if c.shapeType == model.ShapeModel.SP_MESH:
+            files.append((c, 'stl', os.path.join(dirname, c.getmeshname() + ".stl")))
+    return files
+
+
+def writelinkmeshes(l, dirname, meshformat, quantize=False, manifest=None, shared=None):
+    '''
+    Write visual meshes of the link (also in STL format as collision meshes
+    if the link has no collision shapes) and collision meshes in STL format
+    (mesh writers are created for each call since they keep the state of
+    the file being written)
+
+    :param shared: mesh files shared with the other bodies of the world (see simtrans.project.sharedmeshes)
+    '''
+    writers = {meshformat: getmeshwriter(meshformat, quantize), 'stl': stl.STLWriter()}
+    for s, files in itertools.groupby(linkmeshfiles(l, dirname, meshformat), lambda f: f[0]):
+        files = [(fmt, project.sharedfile(shared, s, fname)[0]) for s, fmt, fname in files]
+        files = [(fmt, fname) for fmt, fname in files if fname is not None]
+        if len(files) == 0:
+            # written by another body
+            continue
+        with memory.loaded(s):
+            for fmt, fname in files:
+                writeshape(writers[fmt], s, fname, manifest)
+
+
+def getmeshwriter(meshformat, quantize=False):
+    '''
+    Get writer for visual mesh files
+
+    >>> getmeshwriter('glb').__class__.__name__
+    'GLTFWriter'
+    '''
+    if meshformat == 'dae':
+        return collada.ColladaWriter()
+    elif meshformat == 'glb':
+        return gltf.GLTFWriter(quantize=quantize)
+    raise Exception('unsupported mesh format: %s' % meshformat)
+
+
 class URDFWriter(object):
     '''
     URDF writer class
     '''
-    def write(self, m, f):
+    def __init__(self, meshformat='dae', quantize=False):
+        self.meshformat = meshformat  #: Format of visual mesh files ('dae' or 'glb')
+        self.quantize = quantize      #: Quantize vertex attributes (only for 'glb')
+
+    def write(self, m, f, manifest=None):
         """Write simulation model in URDF format
 
         :param m: model data
-        :param f: path of the file to save
+        :param f: path (or file object) of the file to save
+        :param manifest: manifest to skip regeneration of unchanged mesh files (optional)
+        :returns: None
+        :rtype: None
+
+        """
+        self.writestream(stream.iterevents(m), f, manifest)
+
+    def writestream(self, events, f, manifest=None):
+        """Write simulation model in URDF format given the events (mesh
+        files of each link are written as soon as the link is read)
+
+        :param events: events of the model (see simtrans.stream)
+        :param f: path (or file object) of the file to save
+        :param manifest: manifest to skip regeneration of unchanged mesh files (optional)
         :returns: None
         :rtype: None
 
         """
         # render the data structure using template
-        loader = jinja2.PackageLoader(self.__module__, 'template')
-        env = jinja2.Environment(loader=loader)
-
-        # render mesh data to each separate collada file
-        cwriter = collada.ColladaWriter()
-        swriter = stl.STLWriter()
-        dirname = os.path.dirname(f)
-        for l in m.links:
-            for v in l.visuals:
-                if v.shapeType == model.ShapeModel.SP_MESH:
-                    cwriter.write(v, os.path.join(dirname, v.name + ".dae"))
-                    swriter.write(v, os.path.join(dirname, v.name + ".stl"))
+        env = cache.environment()
+
+        # render mesh data to each separate collada (or glb) file
+        dirname = os.path.dirname(sink.filename(f))
+        m = None
+        for kind, obj in events:
+            if kind == stream.LINK:
+                pipeline.submit(writelinkmeshes, obj, dirname, self.meshformat, self.quantize, manifest)
+            elif kind == stream.END:
+                m = obj
 
         # render mesh collada file for each links
         template = env.get_template('urdf.xml')
-        with open(f, 'w') as ofile:
-            ofile.write(template.render({
+        with sink.open(f, 'w') as ofile:
+            template.stream({
                 'model': m,
                 'ShapeModel': model.ShapeModel,
                 'JointModel': model.JointModel,
+                'meshformat': self.meshformat,
                 'tf': tf
-            }))
+            }).dump(ofile)
+        if manifest is not None:
+            manifest.addoutput(f)
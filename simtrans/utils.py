@@ -5,11 +5,17 @@ Miscellaneous utility functions
 """
 
 import os
-import subprocess
+import copy
+import hashlib
+import lxml.etree
+from . import cache
+from . import profiling
+from . import archive
 from logging import getLogger
 logger = getLogger(__name__)
 
 
+@profiling.profiled('resolve file')
 def resolveFile(f):
     '''
     Resolve file by replacing file path heading "package://" or "model://"
@@ -34,12 +40,15 @@ def resolveFile(f):
                     pass
             for p in paths:
                 ff = os.path.expanduser(os.path.join(p, fn))
-                if os.path.exists(ff):
+                if archive.exists(ff):
                     return ff
         if f.count('package://') > 0:
             pkgname, pkgfile = f.replace('package://', '').split('/', 1)
-            ppath = subprocess.check_output(['rospack', 'find', pkgname]).rstrip()
-            return os.path.join(ppath, pkgfile)
+            # packages bundled in the archives are not found by rospack
+            for p in os.environ.get('ROS_PACKAGE_PATH', '').split(':'):
+                if archive.isarchive(p) and archive.exists(os.path.join(p, pkgname)):
+                    return os.path.join(p, pkgname, pkgfile)
+            return os.path.join(cache.packagepath(pkgname), pkgfile)
     except Exception, e:
         logger.warn(str(e))
     return f
@@ -99,3 +108,74 @@ def findchildren(mdata, linkname):
         if j.parent == linkname:
             children.append(j)
     return children
+
+
+def filedigest(fname, blocksize=65536):
+    '''
+    Calculate sha1 digest of the file contents
+
+    >>> import tempfile
+    >>> fd, fname = tempfile.mkstemp()
+    >>> os.write(fd, 'simtrans')
+    8
+    >>> os.close(fd)
+    >>> filedigest(fname)
+    '1e26160da8c9b4b58a6c34c9f9425651d7b232d4'
+    >>> os.unlink(fname)
+    '''
+    h = hashlib.sha1()
+    with archive.open(fname, 'rb') as f:
+        while True:
+            b = f.read(blocksize)
+            if not b:
+                break
+            h.update(b)
+    return h.hexdigest()
+
+
+def shapename(d, linkname, index):
+    '''
+    Generate stable name of the mesh files of the shape derived from the
+    shape definition (unique for each shape of each link, so that the mesh
+    files of the shapes named alike in different links are not overwritten)
+
+    :param d: visual or collision element
+    :param linkname: name of the link the shape belongs to
+    :param index: index of the shape inside the link
+    :returns: base name of the mesh files
+
+    >>> d = lxml.etree.fromstring('<collision name="collision"><geometry><box><size>1 1 1</size></box></geometry></collision>')
+    >>> shapename(d, 'base', 0) == shapename(d, 'arm', 0)
+    False
+    '''
+    h = hashlib.sha1()
+    h.update('%s/%s/%i/' % (linkname, d.tag, index))
+    h.update(lxml.etree.tostring(d))
+    return 'shape-' + h.hexdigest()[0:32]
+
+
+class Reentrant(object):
+    '''
+    Base class of the readers and writers keeping the state of each call
+    in a context (a copy of the instance sharing the configuration, with
+    the state initialized by _reset), so that one instance can be used by
+    many threads and by nested or interleaved calls at the same time
+
+    >>> class Counter(Reentrant):
+    ...     def _reset(self):
+    ...         self._items = []
+    ...     def count(self, items):
+    ...         c = self._context()
+    ...         c._items.extend(items)
+    ...         return len(c._items)
+    >>> counter = Counter()
+    >>> counter.count([1, 2]), counter.count([3])
+    (2, 1)
+    '''
+    def _reset(self):
+        pass
+
+    def _context(self):
+        c = copy.copy(self)
+        c._reset()
+        return c
@@ -8,8 +8,8 @@
 Requirements
 ------------
 * numpy
-* omniorb-python
 * jinja2 template engine
+* omniorb-python (optional, to read models by OpenHRP model loader)
 
 Examples
 --------
@@ -19,6 +19,50 @@ Read vrml model data given the file path
 >>> r = VRMLReader()
 >>> m = r.read('/usr/local/share/OpenHRP-3.1/sample/model/closed-link-sample.wrl')
 
+Read many models keeping the connection to the model loader (native
+loader stands in for the CORBA service here)
+
+>>> import tempfile
+>>> f = tempfile.NamedTemporaryFile(suffix='.wrl')
+>>> f.write('DEF BODY Joint { jointType "free" }')
+>>> f.flush()
+>>> pool = LoaderPool(resolve=vrmlparser.ModelLoader)
+>>> r = VRMLReader(pool=pool)
+>>> [len(m.links) for m in r.readmany([f.name, f.name])]
+[1, 1]
+>>> pool.resolved
+1
+
+Reconnect to the loader when the connection is lost and resolve the loader
+again when it fails the health check
+
+>>> class FlakyLoader(vrmlparser.ModelLoader):
+...     calls = 0
+...     dead = False
+...     def loadBodyInfo(self, url):
+...         FlakyLoader.calls += 1
+...         if FlakyLoader.calls == 1:
+...             raise IOError('connection lost')
+...         return vrmlparser.ModelLoader.loadBodyInfo(self, url)
+...     def _non_existent(self):
+...         return self.dead
+>>> pool = LoaderPool(resolve=FlakyLoader, interval=0, errors=(IOError,))
+>>> r = VRMLReader(pool=pool)
+>>> len(r.read(f.name).links)
+1
+>>> pool.resolved
+2
+>>> pool.get().dead = True
+>>> len(r.read(f.name).links)
+1
+>>> pool.resolved
+3
+
+Read vrml model data by OpenHRP model loader (CORBA service)
+
+>>> r = VRMLReader(corba=True)
+>>> m = r.read('/usr/local/share/OpenHRP-3.1/sample/model/closed-link-sample.wrl')
+
 Write simulation model in URDF format
 
 >>> from . import vrml
@@ -47,35 +91,198 @@ Write simulation model in VRML format
 
 from . import model
 from . import utils
+from . import cache
+from . import memory
+from . import stream
+from . import pipeline
+from . import sink
+from . import archive
+from . import project
+from .manifest import shapedigest
 import os
 import sys
+import copy
 import warnings
 with warnings.catch_warnings():
     warnings.simplefilter('ignore')
     from .thirdparty import transformations as tf
 import math
+import time
+import threading
 import numpy
-import jinja2
-import CORBA
-import CosNaming
-import OpenHRP
+from . import vrmlparser
+from . import profiling
+try:
+    import CORBA
+    import CosNaming
+    import OpenHRP
+except ImportError:
+    CORBA = CosNaming = OpenHRP = None
+
+
+class LoaderPool(object):
+    '''
+    Connection to the model loader shared by the readers (the ORB is
+    initialized once and the loader is resolved again when the connection
+    is lost)
+    '''
+    def __init__(self, resolve=None, nameservice='corbaloc::localhost:2809/NameService', interval=10.0, errors=None):
+        '''
+        :param resolve: function returning the model loader (resolves OpenHRP model loader on CORBA name service by default)
+        :param nameservice: location of CORBA name service
+        :param interval: seconds between the health checks of the loader
+        :param errors: exceptions raised when the connection is lost (CORBA TRANSIENT, COMM_FAILURE and OBJECT_NOT_EXIST by default)
+        '''
+        self._resolve = resolve or self.resolvecorba
+        self._errors = errors
+        self._nameservice = nameservice
+        self._interval = interval
+        self._orb = None
+        self._loader = None
+        self._checked = 0
+        self._lock = threading.RLock()
+        self.resolved = 0    #: Number of times the loader was resolved
+
+    def orb(self):
+        '''
+        Get the ORB (initialized at the first call)
+        '''
+        with self._lock:
+            if self._orb is None:
+                if CORBA is None:
+                    raise Exception('omniorb-python is required to read models by OpenHRP model loader')
+                self._orb = CORBA.ORB_init([sys.argv[0],
+                                            "-ORBInitRef",
+                                            "NameService=%s" % self._nameservice],
+                                           CORBA.ORB_ID)
+            return self._orb
+
+    def resolvecorba(self):
+        '''
+        Resolve OpenHRP model loader on CORBA name service
+        '''
+        nsobj = self.orb().resolve_initial_references("NameService")
+        ns = nsobj._narrow(CosNaming.NamingContext)
+        try:
+            obj = ns.resolve([CosNaming.NameComponent("ModelLoader", "")])
+            return obj._narrow(OpenHRP.ModelLoader)
+        except CosNaming.NamingContext.NotFound:
+            print "unable to resolve OpenHRP model loader on CORBA name service"
+            raise
+
+    def isalive(self, loader):
+        '''
+        Check whether the loader is reachable
+        '''
+        try:
+            return not loader._non_existent()
+        except AttributeError:
+            return True
+        except Exception:
+            return False
+
+    def get(self):
+        '''
+        Get the loader (resolved again if the health check fails)
+        '''
+        with self._lock:
+            now = time.time()
+            if self._loader is not None and now - self._checked >= self._interval:
+                if not self.isalive(self._loader):
+                    self._loader = None
+                self._checked = now
+            if self._loader is None:
+                with profiling.stage('resolve model loader'):
+                    self._loader = self._resolve()
+                self._checked = now
+                self.resolved = self.resolved + 1
+            return self._loader
+
+    def invalidate(self, loader=None):
+        '''
+        Forget the loader to resolve it again at the next call
+        '''
+        with self._lock:
+            if loader is None or self._loader is loader:
+                self._loader = None
+
+    def load(self, url):
+        '''
+        Load the body info by the loader (reconnecting once when the
+        connection is lost)
+        '''
+        errors = self._errors if self._errors is not None else _connectionerrors()
+        loader = self.get()
+        try:
+            return loader.loadBodyInfo(url)
+        except errors:
+            self.invalidate(loader)
+        try:
+            return self.get().loadBodyInfo(url)
+        except errors:
+            print 'unable to connect to model loader corba service (is "openhrp-model-loader" running?)'
+            raise
+
+
+def _array(seq, dtype, n):
+    '''
+    Convert the sequence (list of CORBA sequence or numpy array of native
+    loader) to n columns array in bulk
+    '''
+    if isinstance(seq, numpy.ndarray):
+        a = numpy.asarray(seq, dtype=dtype)
+    else:
+        a = numpy.fromiter(seq, dtype=dtype, count=len(seq))
+    return a.reshape(-1, n)
+
+
+def _connectionerrors():
+    if CORBA is None:
+        return ()
+    return (CORBA.TRANSIENT, CORBA.COMM_FAILURE, CORBA.OBJECT_NOT_EXIST)
+
+
+_pool = None
+_poollock = threading.Lock()
+
+
+def loaderpool():
+    '''
+    Get the loader pool shared in the process
+    '''
+    global _pool
+    with _poollock:
+        if _pool is None:
+            _pool = LoaderPool()
+        return _pool
 
 
-class VRMLReader(object):
+class VRMLReader(utils.Reentrant):
     '''
     VRML reader class
     '''
-    def __init__(self):
-        self._orb = CORBA.ORB_init([sys.argv[0],
-                                    "-ORBInitRef",
-                                    "NameService=corbaloc::localhost:2809/NameService"],
-                                   CORBA.ORB_ID)
+    def __init__(self, corba=False, pool=None):
+        '''
+        :param corba: read the models by OpenHRP model loader (CORBA service) instead of the native parser
+        :param pool: loader pool to read the models (the pool shared in the process is used by default with corba=True)
+        '''
+        if corba:
+            if CORBA is None:
+                raise Exception('omniorb-python is required to read models by OpenHRP model loader')
+            self._pool = pool or loaderpool()
+            self._types = OpenHRP
+        else:
+            self._pool = pool
+            self._types = vrmlparser
+        self._reset()
+
+    def _reset(self):
         self._loader = None
-        self._ns = None
         self._model = None
         self._joints = []
         self._links = []
         self._materials = []
+        self._texturedmaterials = {}
         self._sensors = []
         self._assethandler = None
 
@@ -83,24 +290,42 @@ class VRMLReader(object):
         '''
         Read vrml model data given the file path
         '''
+        return stream.collect(self.iterread(f, assethandler))
+
+    def readmany(self, files, assethandler=None):
+        '''
+        Read vrml model data of the files one after another (the loader
+        of the pool is shared by the reads)
+        '''
+        return [self.read(f, assethandler) for f in files]
+
+    def iterread(self, f, assethandler=None):
+        '''
+        Read vrml model data given the file path and generate the events
+        (see simtrans.stream) while converting the links
+        '''
+        return self._context()._iterread(f, assethandler)
+
+    def _iterread(self, f, assethandler):
         self._assethandler = assethandler
-        self.resolveModelLoader()
-        try:
+        if self._pool is None:
+            self.resolveModelLoader()
             self._model = self._loader.loadBodyInfo(f)
-        except CORBA.TRANSIENT:
-            print 'unable to connect to model loader corba service (is "openhrp-model-loader" running?)'
-            raise
+        else:
+            with profiling.stage('load body info', f):
+                self._model = self._pool.load(f)
         bm = model.BodyModel()
-        self._joints = []
-        self._links = []
-        self._materials = []
-        self._sensors = []
         self._hrplinks = self._model._get_links()
         self._hrpshapes = self._model._get_shapes()
         self._hrpapperances = self._model._get_appearances()
         self._hrpmaterials = self._model._get_materials()
         self._hrptextures = self._model._get_textures()
         self._hrpextrajoints = self._model._get_extraJoints()
+        bm.links = self._links
+        bm.joints = self._joints
+        bm.sensors = self._sensors
+        if archive.exists(f):
+            bm.sources = [f]
         mid = 0
         for a in self._hrpmaterials:
             m = model.MaterialModel()
@@ -115,15 +340,18 @@ class VRMLReader(object):
             self._materials.append(m)
         root = self._hrplinks[0]
         bm.trans = numpy.array(root.translation)
+        yield (stream.BODY, bm)
         if root.jointType == 'fixed':
             world = model.JointModel()
             world.name = 'world'
-            self.readChild(world, root)
+            for e in self.readChild(world, root):
+                yield e
         else:
-            lm = self.readLink(root)
-            self._links.append(lm)
+            for e in self.linkevents(root):
+                yield e
             for c in root.childIndices:
-                self.readChild(root, self._hrplinks[c])
+                for e in self.readChild(root, self._hrplinks[c]):
+                    yield e
         for j in self._hrpextrajoints:
             # extra joint for closed link models
             m = model.JointModel()
@@ -135,10 +363,21 @@ class VRMLReader(object):
             m.trans = numpy.array(j.point[1])
             m.offsetPosition = True
             self._joints.append(m)
-        bm.links = self._links
-        bm.joints = self._joints
-        bm.sensors = self._sensors
-        return bm
+            yield (stream.JOINT, m)
+        yield (stream.END, bm)
+
+    def linkevents(self, m):
+        '''
+        Convert the link and generate the events of its shapes, the link
+        and its sensors
+        '''
+        nsensors = len(self._sensors)
+        lm = self.readLink(m)
+        self._links.append(lm)
+        for e in stream.linkevents(lm):
+            yield e
+        for sm in self._sensors[nsensors:]:
+            yield (stream.SENSOR, sm)
 
     def readLink(self, m):
         lm = model.LinkModel()
@@ -189,27 +428,27 @@ class VRMLReader(object):
             sm.name = "shape-%i" % s.shapeIndex
             sm.matrix = numpy.matrix(s.transformMatrix+[0, 0, 0, 1]).reshape(4, 4)
             sdata = self._hrpshapes[s.shapeIndex]
-            if sdata.primitiveType == OpenHRP.SP_MESH:
+            if sdata.primitiveType == self._types.SP_MESH:
                 sm.shapeType = model.ShapeModel.SP_MESH
                 sm.data = self.readMesh(sdata)
-            elif sdata.primitiveType == OpenHRP.SP_SPHERE and numpy.allclose(sm.matrix, numpy.identity(4)):
+            elif sdata.primitiveType == self._types.SP_SPHERE and numpy.allclose(sm.matrix, numpy.identity(4)):
                 sm.shapeType = model.ShapeModel.SP_SPHERE
                 sm.data = model.SphereData()
                 sm.data.radius = sdata.primitiveParameters[0]
-                sm.data.material = self._materials[sdata.appearanceIndex]
-            elif sdata.primitiveType == OpenHRP.SP_CYLINDER and numpy.allclose(sm.matrix, numpy.identity(4)):
+                sm.data.material = self._materials[self._hrpapperances[sdata.appearanceIndex].materialIndex]
+            elif sdata.primitiveType == self._types.SP_CYLINDER and numpy.allclose(sm.matrix, numpy.identity(4)):
                 sm.shapeType = model.ShapeModel.SP_CYLINDER
                 sm.data = model.CylinderData()
                 sm.data.radius = sdata.primitiveParameters[0]
                 sm.data.height = sdata.primitiveParameters[1]
-                sm.data.material = self._materials[sdata.appearanceIndex]
-            elif sdata.primitiveType == OpenHRP.SP_BOX and numpy.allclose(sm.matrix, numpy.identity(4)):
+                sm.data.material = self._materials[self._hrpapperances[sdata.appearanceIndex].materialIndex]
+            elif sdata.primitiveType == self._types.SP_BOX and numpy.allclose(sm.matrix, numpy.identity(4)):
                 sm.shapeType = model.ShapeModel.SP_BOX
                 sm.data = model.BoxData()
                 sm.data.x = sdata.primitiveParameters[0]
                 sm.data.y = sdata.primitiveParameters[1]
                 sm.data.z = sdata.primitiveParameters[2]
-                sm.data.material = self._materials[sdata.appearanceIndex]
+                sm.data.material = self._materials[self._hrpapperances[sdata.appearanceIndex].materialIndex]
             else:
                 # raise Exception('unsupported shape primitive: %s' % sdata.primitiveType)
                 sm.shapeType = model.ShapeModel.SP_MESH
@@ -219,48 +458,57 @@ class VRMLReader(object):
 
     def readMesh(self, sdata):
         data = model.MeshData()
-        data.vertex = numpy.array(sdata.vertices).reshape(len(sdata.vertices)/3, 3)
-        data.vertex_index = numpy.array(sdata.triangles).reshape(len(sdata.triangles)/3, 3)
+        data.vertex = _array(sdata.vertices, float, 3)
+        data.vertex_index = _array(sdata.triangles, int, 3)
         adata = self._hrpapperances[sdata.appearanceIndex]
+        data.normal = _array(adata.normals, float, 3)
         if adata.normalPerVertex is True:
-            data.normal = numpy.array(adata.normals).reshape(len(adata.normals)/3, 3)
             if len(adata.normalIndices) > 0:
-                data.normal_index = numpy.array(adata.normalIndices).reshape(len(adata.normalIndices)/3, 3)
+                data.normal_index = _array(adata.normalIndices, int, 3)
             else:
                 data.normal_index = data.vertex_index
         else:
-            data.normal = numpy.array(adata.normals).reshape(len(adata.normals)/3, 3)
+            # normal of each face is shared by its three vertices
             if len(adata.normalIndices) > 0:
-                idx = []
-                for i in adata.normalIndices:
-                    idx.append(i)
-                    idx.append(i)
-                    idx.append(i)
-                data.normal_index = numpy.array(idx).reshape(len(idx)/3, 3)
+                idx = _array(adata.normalIndices, int, 1)
             else:
-                idx = []
-                for i in range(0, len(adata.normals)/3):
-                    idx.append(i)
-                    idx.append(i)
-                    idx.append(i)
-                data.normal_index = numpy.array(idx).reshape(len(idx)/3, 3)
+                idx = numpy.arange(len(data.normal))
+            data.normal_index = numpy.repeat(idx, 3).reshape(-1, 3)
         if len(data.vertex_index) != len(data.normal_index):
             raise Exception('vertex length and normal length not match')
-        data.material = self._materials[adata.materialIndex]
+        data.material = self.readMaterial(adata.materialIndex, adata.textureIndex)
         if adata.textureIndex >= 0:
-            fname = self._hrptextures[adata.textureIndex].url
-            if self._assethandler:
-                data.material.texture = self._assethandler(fname)
-            else:
-                data.material.texture = fname
-            data.uvmap = numpy.array(adata.textureCoordinate).reshape(len(adata.textureCoordinate)/2, 2)
-            data.uvmap_index = numpy.array(adata.textureCoordIndices).reshape(len(adata.textureCoordIndices)/3, 3)
+            data.uvmap = _array(adata.textureCoordinate, float, 2)
+            data.uvmap_index = _array(adata.textureCoordIndices, int, 3)
         return data
 
+    def readMaterial(self, materialIndex, textureIndex=-1):
+        '''
+        Get the material (textured materials are shared by the meshes
+        with the same material and texture)
+        '''
+        m = self._materials[materialIndex]
+        if textureIndex < 0:
+            return m
+        key = (materialIndex, textureIndex)
+        try:
+            return self._texturedmaterials[key]
+        except KeyError:
+            pass
+        fname = self._hrptextures[textureIndex].url
+        tm = copy.copy(m)
+        tm.name = "%s-texture-%i" % (m.name, textureIndex)
+        if self._assethandler:
+            tm.texture = self._assethandler(fname)
+        else:
+            tm.texture = fname
+        self._texturedmaterials[key] = tm
+        return tm
+
     def readChild(self, parent, child):
         # first convert link shape information
-        lm = self.readLink(child)
-        self._links.append(lm)
+        for e in self.linkevents(child):
+            yield e
         # then create joint pairs
         jm = model.JointModel()
         if parent.name != 'world':
@@ -289,38 +537,171 @@ class VRMLReader(object):
         jm.trans = numpy.array(child.translation)
         jm.rot = tf.quaternion_about_axis(child.rotation[3], child.rotation[0:3])
         self._joints.append(jm)
+        yield (stream.JOINT, jm)
         for c in child.childIndices:
-            self.readChild(child, self._hrplinks[c])
+            for e in self.readChild(child, self._hrplinks[c]):
+                yield e
 
     def resolveModelLoader(self):
-        nsobj = self._orb.resolve_initial_references("NameService")
-        self._ns = nsobj._narrow(CosNaming.NamingContext)
-        try:
-            obj = self._ns.resolve([CosNaming.NameComponent("ModelLoader", "")])
-            self._loader = obj._narrow(OpenHRP.ModelLoader)
-        except CosNaming.NamingContext.NotFound:
-            print "unable to resolve OpenHRP model loader on CORBA name service"
-            raise
+        if self._pool is None:
+            self._loader = vrmlparser.ModelLoader()
+        else:
+            self._loader = self._pool.get()
 
 
-class VRMLWriter(object):
+class VRMLWriter(utils.Reentrant):
     '''
     VRML writer class
     '''
     def __init__(self):
+        self.sharedmeshes = {}  #: Mesh files shared with the other bodies of the world (see simtrans.project.sharedmeshes)
+        self._reset()
+
+    def _reset(self):
         self._linkmap = {}
         self._roots = []
         self._ignore = []
 
-    def write(self, mdata, fname):
+    def write(self, mdata, fname, manifest=None):
         '''
         Write simulation model in VRML format
         '''
+        self.writestream(stream.iterevents(mdata), fname, manifest)
+
+    def writestream(self, events, fname, manifest=None):
+        '''
+        Write simulation model in VRML format given the events (mesh files
+        of each link are written as soon as the link is read)
+        '''
+        self._context()._writestream(events, fname, manifest)
+
+    def _writestream(self, events, fname, manifest):
         fpath, fext = os.path.splitext(fname)
         basename = os.path.basename(fpath)
-        if mdata.name is None or mdata.name == '':
-            mdata.name = basename
+        mdata = None
+        for kind, obj in events:
+            if kind == stream.BODY:
+                if obj.name is None or obj.name == '':
+                    obj.name = basename
+                name = obj.name
+            elif kind == stream.LINK:
+                pipeline.submit(self.writelinkmeshes, obj, fname, name, manifest)
+            elif kind == stream.END:
+                mdata = obj
+
+        root, rootlink, rootjoint, links, joints = self.findroot(mdata)
+
+        if len(joints) == 0:
+            joints = [root]
+
+        # first convert data structure (VRML uses tree structure)
+        nmodel = {}
+        nmodel['link'] = rootlink
+        nmodel['joint'] = rootjoint
+        nmodel['jointtype'] = rootjoint.jointType
+        nmodel['children'] = self.convertchildren(mdata, root)
+        rmodel = {}
+        rmodel['children'] = [nmodel]
+
+        # assign jointId
+        jointmap = {root: 0}
+        for j in mdata.joints:
+            jointmap[j.name] = 0
+        jointcount = 1
+        for j in mdata.joints:
+            jointmap[j.name] = jointcount
+            jointcount = jointcount + 1
+
+        # render the data structure using template
+        env = cache.environment()
+
+        def meshurl(v):
+            path = project.sharedfile(self.sharedmeshes, v, self.meshfile(fname, name, v))[1]
+            return os.path.relpath(path, os.path.dirname(fname) or os.curdir)
+
+        # render main vrml file
+        template = env.get_template('vrml.wrl')
+        with sink.open(fname, 'w') as ofile:
+            template.stream({
+                'model': rmodel,
+                'meshurl': meshurl,
+                'body': mdata,
+                'links': links,
+                'joints': joints,
+                'jointmap': jointmap,
+                'ShapeModel': model.ShapeModel
+            }).dump(ofile)
+        if manifest is not None:
+            manifest.addoutput(fname)
+
+        # render openhrp project
+        template = env.get_template('openhrp-project.xml')
+        with sink.open(fname.replace('.wrl', '-project.xml'), 'w') as ofile:
+            template.stream({
+                'items': [{'name': 'sample1', 'url': fname, 'joints': mdata.joints}]
+            }).dump(ofile)
+        if manifest is not None:
+            manifest.addoutput(fname.replace('.wrl', '-project.xml'))
+
+    def bodyfile(self, fname, body):
+        '''
+        Get the file to write the body of the project (placed next to the
+        project file)
+        '''
+        return os.path.join(os.path.dirname(fname), body.name + '.wrl')
+
+    def meshfile(self, fname, name, v):
+        '''
+        Get the file to write the mesh of the visual shape of the body
+        (named after the body next to the file of the body)
+        '''
+        return os.path.join(os.path.dirname(fname), name + "-" + v.getmeshname() + ".wrl")
+
+    def meshfiles(self, fname, body):
+        '''
+        List the mesh files written for the body (shape and path of each
+        file)
+        '''
+        return [(v, self.meshfile(fname, body.name, v)) for l in body.links for v in l.visuals
+                if v.shapeType == model.ShapeModel.SP_MESH]
+
+    def writeproject(self, p, fname, manifest=None):
+        '''
+        Write OpenHRP project placing the bodies (bodies are written by
+        write() to the files given by bodyfile())
+        '''
+        items = []
+        for i in p.instances:
+            root = self._context().findroot(i.body)[0]
+            # place the root of the body in the world
+            m = numpy.dot(i.getmatrix(), i.body.getmatrix())
+            q = tf.quaternion_from_matrix(m)
+            angle = 2 * math.acos(max(-1.0, min(1.0, q[0])))
+            axis = q[1:4] / math.sin(angle / 2) if angle > 1e-9 else [0, 0, 1]
+            items.append({
+                'name': i.name,
+                'url': self.bodyfile(fname, i.body),
+                'joints': i.body.joints,
+                'root': root,
+                'translation': ['%g' % v for v in m[0:3, 3]],
+                'rotation': ['%g' % v for v in list(axis) + [angle]]
+            })
+        template = cache.environment().get_template('openhrp-project.xml')
+        pfname = fname.replace('.wrl', '-project.xml')
+        with sink.open(pfname, 'w') as ofile:
+            template.stream({
+                'items': items
+            }).dump(ofile)
+        if manifest is not None:
+            manifest.addoutput(pfname)
+
+    def findroot(self, mdata):
+        '''
+        Find root joint of the body and list the links and the joints to
+        be written
 
+        :returns: name of the root joint, root link, root joint model, names of the links and names of the joints
+        '''
         # find root joint (including local peaks)
         self._roots = utils.findroot(mdata)
         self._ignore = self._roots[1:]
@@ -331,8 +712,6 @@ class VRMLWriter(object):
         # list joint with parent
         joints = [j.name for j in mdata.joints if j.child in links and j.parent not in self._ignore]
 
-        # first convert data structure (VRML uses tree structure)
-        nmodel = {}
         self._linkmap['world'] = model.LinkModel()
         for m in mdata.links:
             self._linkmap[m.name] = m
@@ -361,65 +740,36 @@ class VRMLWriter(object):
             rootjoint = model.JointModel()
             rootjoint.name = root
             rootjoint.jointType = "free"
+        return root, rootlink, rootjoint, links, joints
 
-        if len(joints) == 0:
-            joints = [root]
-
-        nmodel['link'] = rootlink
-        nmodel['joint'] = rootjoint
-        nmodel['jointtype'] = rootjoint.jointType
-        nmodel['children'] = self.convertchildren(mdata, root)
-        rmodel = {}
-        rmodel['children'] = [nmodel]
-
-        # assign jointId
-        jointmap = {root: 0}
-        for j in mdata.joints:
-            jointmap[j.name] = 0
-        jointcount = 1
-        for j in mdata.joints:
-            jointmap[j.name] = jointcount
-            jointcount = jointcount + 1
-
-        # render the data structure using template
-        loader = jinja2.PackageLoader(self.__module__, 'template')
-        env = jinja2.Environment(loader=loader)
-
-        # render main vrml file
-        template = env.get_template('vrml.wrl')
-        with open(fname, 'w') as ofile:
-            ofile.write(template.render({
-                'model': rmodel,
-                'body': mdata,
-                'links': links,
-                'joints': joints,
-                'jointmap': jointmap,
-                'ShapeModel': model.ShapeModel
-            }))
-
-        # render mesh vrml file for each links
-        template = env.get_template('vrml-mesh.wrl')
-        dirname = os.path.dirname(fname)
-        for l in mdata.links:
-            for v in l.visuals:
-                if v.shapeType == model.ShapeModel.SP_MESH:
+    def writelinkmeshes(self, l, fname, name, manifest=None):
+        '''
+        Render mesh vrml file for each visual mesh of the link
+        '''
+        template = cache.environment().get_template('vrml-mesh.wrl')
+        for v in l.visuals:
+            if v.shapeType == model.ShapeModel.SP_MESH:
+                meshfname = project.sharedfile(self.sharedmeshes, v, self.meshfile(fname, name, v))[0]
+                if meshfname is None:
+                    # written by another body
+                    continue
+                with memory.loaded(v):
+                    source = None
+                    if manifest is not None:
+                        source = shapedigest(v)
+                        if not manifest.needsupdate(meshfname, source):
+                            manifest.addoutput(meshfname, source)
+                            continue
                     m = {}
                     m['children'] = [v.data]
-                    with open(os.path.join(dirname, mdata.name + "-" + v.name + ".wrl"), 'w') as ofile:
-                        ofile.write(template.render({
+                    with sink.open(meshfname, 'w') as ofile:
+                        template.stream({
                             'name': v.name,
                             'ShapeModel': model.ShapeModel,
                             'mesh': m
-                        }))
-
-        # render openhrp project
-        template = env.get_template('openhrp-project.xml')
-        with open(fname.replace('.wrl', '-project.xml'), 'w') as ofile:
-            ofile.write(template.render({
-                'model': mdata,
-                'root': root,
-                'fname': fname
-            }))
+                        }).dump(ofile)
+                if manifest is not None:
+                    manifest.addoutput(meshfname, source)
 
     def convertchildren(self, mdata, linkname):
         children = []
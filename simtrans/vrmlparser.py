@@ -0,0 +1,984 @@
+# -*- coding:utf-8 -*-
+
+"""Native loader of VRML97 models in OpenHRP format
+
+Parses VRML97 files (including PROTO declarations, DEF/USE and Inline
+nodes) and builds the same structure as the BodyInfo returned by the
+OpenHRP ModelLoader CORBA service (links, shapes, appearances, materials,
+textures and extra joints), so that :class:`simtrans.vrml.VRMLReader` can
+read the models without omniORB and a running openhrp-model-loader.
+Number arrays (point, coordIndex, vector, ...) are parsed in bulk with
+numpy.
+
+:Organization:
+ AIST
+
+Examples
+--------
+
+Parse VRML nodes
+
+>>> nodes = parsestring('DEF B Transform { translation 1 2 3 children [ Shape { geometry Box { size 1 2 3 } } ] }')
+>>> nodes[0].type, nodes[0].name, nodes[0].get('translation')
+('Transform', 'B', [1.0, 2.0, 3.0])
+>>> nodes[0].get('children')[0].get('geometry').get('size')
+[1.0, 2.0, 3.0]
+
+Load the body of OpenHRP model
+
+>>> b = loadstring('''
+... PROTO Joint [ exposedField SFString jointType "" exposedField SFVec3f translation 0 0 0
+...               exposedField SFRotation rotation 0 0 1 0 exposedField SFVec3f jointAxis 0 0 1
+...               exposedField MFFloat ulimit [] exposedField MFNode children [] ] { }
+... PROTO Segment [ exposedField SFFloat mass 0 exposedField SFVec3f centerOfMass 0 0 0
+...                 exposedField MFFloat momentsOfInertia [ 0 0 0 0 0 0 0 0 0 ]
+...                 exposedField MFNode children [] ] { }
+... DEF WAIST Joint {
+...   jointType "free"
+...   children [
+...     Segment { mass 2.0 children [ Shape { geometry IndexedFaceSet {
+...       coord Coordinate { point [ 0 0 0, 1 0 0, 1 1 0, 0 1 0 ] }
+...       coordIndex [ 0 1 2 3 -1 ] } } ] }
+...     DEF ARM Joint { jointType "rotate" translation 0 0 1 ulimit [ 1.57 ] }
+...   ]
+... }
+... ''')
+>>> [(l.name, l.jointType, l.childIndices) for l in b._get_links()]
+[('WAIST', 'free', [1]), ('ARM', 'rotate', [])]
+>>> b._get_links()[0].mass, b._get_links()[1].ulimit
+(2.0, [1.57])
+>>> s = b._get_shapes()[0]
+>>> s.primitiveType == SP_MESH, list(s.triangles)
+(True, [0, 1, 2, 0, 2, 3])
+"""
+
+import os
+import re
+import math
+import numpy
+import warnings
+from logging import getLogger
+with warnings.catch_warnings():
+    warnings.simplefilter('ignore')
+    from .thirdparty import transformations as tf
+from . import profiling
+from . import archive
+
+logger = getLogger(__name__)
+
+# shape primitive types (same names as OpenHRP.ShapePrimitiveType)
+SP_MESH = 'SP_MESH'
+SP_BOX = 'SP_BOX'
+SP_CYLINDER = 'SP_CYLINDER'
+SP_CONE = 'SP_CONE'
+SP_SPHERE = 'SP_SPHERE'
+SP_PLANE = 'SP_PLANE'
+
+_comment = re.compile(r'("(?:[^"\\]|\\.)*")|#[^\n\r]*')
+_token = re.compile(r'[\s,]*([\[\]{}]|"(?:[^"\\]|\\.)*"|[^\s,\[\]{}"]+)')
+_number = re.compile(r'^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$|^0[xX][0-9a-fA-F]+$')
+_unescape = re.compile(r'\\(.)')
+
+_DIVISION = 20     #: Number of divisions of the meshes of sphere, cylinder and cone
+
+_sensortypes = {
+    'VisionSensor': 'Vision',
+    'RangeSensor': 'Range',
+    'ForceSensor': 'Force',
+    'Gyro': 'RateGyro',
+    'AccelerationSensor': 'Acceleration'
+}
+
+_cameratypes = {'NONE': 0, 'COLOR': 1, 'MONO': 2, 'DEPTH': 3, 'COLOR_DEPTH': 4, 'MONO_DEPTH': 5}
+
+_groups = ['Group', 'Anchor', 'Billboard', 'Collision', 'Humanoid']
+
+
+class Node(object):
+    '''
+    VRML node
+    '''
+    def __init__(self, nodetype, fields, basedir):
+        self.type = nodetype        #: Type of the node (e.g. Transform)
+        self.name = None            #: Name given by DEF
+        self.fields = fields        #: Values of the fields ({name: value})
+        self.basedir = basedir      #: Directory of the file (to resolve urls)
+
+    def get(self, name, default=None):
+        '''
+        Get value of the field (or default value of the PROTO)
+        '''
+        return self.fields.get(name, default)
+
+    def __repr__(self):
+        return '<Node %s %s>' % (self.type, self.name)
+
+
+class _Parser(object):
+    def __init__(self, text, basedir):
+        self._text = _comment.sub(lambda m: m.group(1) or '', text)
+        self._pos = 0
+        self._basedir = basedir
+        self.defs = {}
+        self.protos = {}
+
+    def peek(self):
+        m = _token.match(self._text, self._pos)
+        if m is None:
+            return None
+        return m.group(1)
+
+    def next(self):
+        m = _token.match(self._text, self._pos)
+        if m is None:
+            raise Exception('unexpected end of file')
+        self._pos = m.end()
+        return m.group(1)
+
+    def expect(self, t):
+        n = self.next()
+        if n != t:
+            raise Exception('expected %s but got %s' % (t, n))
+
+    def parse(self):
+        nodes = []
+        while True:
+            t = self.peek()
+            if t is None:
+                return nodes
+            n = self.statement()
+            if n is not None:
+                nodes.append(n)
+
+    def statement(self):
+        t = self.peek()
+        if t == 'PROTO':
+            self.proto()
+        elif t == 'EXTERNPROTO':
+            self.externproto()
+        elif t == 'ROUTE':
+            for i in range(4):
+                self.next()
+        else:
+            return self.node()
+        return None
+
+    def node(self):
+        t = self.next()
+        if t == 'NULL':
+            return None
+        if t == 'USE':
+            name = self.next()
+            try:
+                return self.defs[name]
+            except KeyError:
+                raise Exception('undefined node: %s' % name)
+        name = None
+        if t == 'DEF':
+            name = self.next()
+            t = self.next()
+        fields = dict(self.protos.get(t, {}))
+        n = Node(t, fields, self._basedir)
+        n.name = name
+        if name is not None:
+            self.defs[name] = n
+        self.expect('{')
+        while True:
+            f = self.next()
+            if f == '}':
+                break
+            if f == 'ROUTE':
+                for i in range(3):
+                    self.next()
+            elif f in ('PROTO', 'EXTERNPROTO'):
+                self._pos = self._pos - len(f)
+                self.statement()
+            elif f in ('eventIn', 'eventOut'):
+                self.next()
+                self.next()
+            elif f in ('field', 'exposedField'):
+                self.next()
+                f = self.next()
+                fields[f] = self.value()
+            elif self.peek() == 'IS':
+                self.next()
+                self.next()
+            else:
+                fields[f] = self.value()
+        return n
+
+    def value(self):
+        t = self.peek()
+        if t == '[':
+            return self.array()
+        if t[0] == '"':
+            return self.string()
+        if _number.match(t):
+            values = []
+            while t is not None and _number.match(t):
+                values.append(self.number())
+                t = self.peek()
+            return values
+        if t == 'TRUE' or t == 'FALSE':
+            self.next()
+            return t == 'TRUE'
+        return self.node()
+
+    def number(self):
+        t = self.next()
+        if t[0:2] in ('0x', '0X'):
+            return float(int(t, 16))
+        return float(t)
+
+    def string(self):
+        return _unescape.sub(r'\1', self.next()[1:-1])
+
+    def array(self):
+        self.expect('[')
+        t = self.peek()
+        if t == ']':
+            self.next()
+            return []
+        if _number.match(t):
+            # parse numbers in bulk
+            end = self._text.index(']', self._pos)
+            values = numpy.fromstring(self._text[self._pos:end].replace(',', ' '), sep=' ')
+            self._pos = end + 1
+            return values
+        values = []
+        while True:
+            t = self.peek()
+            if t == ']':
+                self.next()
+                return values
+            if t[0] == '"':
+                values.append(self.string())
+            elif t == 'TRUE' or t == 'FALSE':
+                self.next()
+                values.append(t == 'TRUE')
+            elif t == 'ROUTE':
+                self.statement()
+            else:
+                n = self.node()
+                if n is not None:
+                    values.append(n)
+
+    def interface(self, defaults):
+        fields = {}
+        self.expect('[')
+        while True:
+            t = self.next()
+            if t == ']':
+                return fields
+            self.next()
+            name = self.next()
+            if defaults and t in ('field', 'exposedField'):
+                fields[name] = self.value()
+
+    def skip(self):
+        self.expect('{')
+        depth = 1
+        while depth > 0:
+            t = self.next()
+            if t == '{':
+                depth = depth + 1
+            elif t == '}':
+                depth = depth - 1
+
+    def proto(self):
+        self.expect('PROTO')
+        name = self.next()
+        # nodes defined in the interface and the body are local to the PROTO
+        defs = self.defs
+        self.defs = {}
+        self.protos[name] = self.interface(True)
+        self.skip()
+        self.defs = defs
+
+    def externproto(self):
+        self.expect('EXTERNPROTO')
+        name = self.next()
+        self.interface(False)
+        self.value()
+        self.protos.setdefault(name, {})
+
+
+def parsestring(text, basedir=''):
+    '''
+    Parse VRML text and return the nodes at the top level
+    '''
+    return _Parser(text, basedir).parse()
+
+
+def parse(fname):
+    '''
+    Parse VRML file and return the nodes at the top level
+    '''
+    with profiling.stage('parse vrml', fname):
+        with archive.open(fname) as f:
+            return parsestring(f.read(), os.path.dirname(os.path.abspath(fname)))
+
+
+def _floats(v, default=None):
+    if v is None:
+        return default
+    if isinstance(v, (list, numpy.ndarray)):
+        return [float(x) for x in v]
+    return [float(v)]
+
+
+def _float(v, default):
+    v = _floats(v)
+    if v is None or len(v) == 0:
+        return default
+    return v[0]
+
+
+def _string(v, default=None):
+    if isinstance(v, list):
+        if len(v) == 0:
+            return default
+        v = v[0]
+    if v is None:
+        return default
+    return v
+
+
+def _points(v, n):
+    if v is None or len(v) == 0:
+        return numpy.zeros((0, n))
+    a = numpy.asarray(v, dtype=float)
+    return a[0:len(a) // n * n].reshape(-1, n)
+
+
+def _indices(v):
+    if v is None or len(v) == 0:
+        return numpy.zeros(0, dtype=int)
+    return numpy.asarray(v).astype(int)
+
+
+def _axis(v):
+    if isinstance(v, basestring):
+        return {'X': [1.0, 0.0, 0.0], 'Y': [0.0, 1.0, 0.0], 'Z': [0.0, 0.0, 1.0]}[v.upper()]
+    return _floats(v, [0.0, 0.0, 1.0])
+
+
+def _rotation(r):
+    if r is None or len(r) < 4 or r[3] == 0 or numpy.allclose(r[0:3], 0):
+        return numpy.identity(4)
+    return tf.rotation_matrix(r[3], r[0:3])
+
+
+def _matrix(node):
+    '''
+    Transformation matrix of the Transform (or Joint) node
+    '''
+    t = _floats(node.get('translation'), [0.0, 0.0, 0.0])
+    r = _floats(node.get('rotation'))
+    s = _floats(node.get('scale'), [1.0, 1.0, 1.0])
+    c = _floats(node.get('center'), [0.0, 0.0, 0.0])
+    so = _floats(node.get('scaleOrientation'))
+    m = numpy.dot(tf.translation_matrix(t), tf.translation_matrix(c))
+    m = numpy.dot(m, _rotation(r))
+    if not numpy.allclose(s, 1):
+        sr = _rotation(so)
+        m = numpy.dot(m, sr)
+        m = numpy.dot(m, numpy.diag(s + [1.0]))
+        m = numpy.dot(m, sr.T)
+    return numpy.dot(m, tf.translation_matrix([-x for x in c]))
+
+
+def _decompose(m):
+    '''
+    Get translation and rotation (axis and angle) of the matrix
+    '''
+    q = tf.quaternion_from_matrix(m)
+    angle = 2 * math.acos(max(-1.0, min(1.0, q[0])))
+    s = math.sqrt(max(0.0, 1 - q[0] * q[0]))
+    if s < 1e-9:
+        return list(m[0:3, 3]), [0.0, 0.0, 1.0, 0.0]
+    return list(m[0:3, 3]), [q[1] / s, q[2] / s, q[3] / s, angle]
+
+
+class _Info(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class BodyInfo(object):
+    '''
+    Body data in the same structure as OpenHRP BodyInfo
+    '''
+    def __init__(self):
+        self.name = ''
+        self.url = ''
+        self.links = []
+        self.shapes = []
+        self.appearances = []
+        self.materials = []
+        self.textures = []
+        self.extraJoints = []
+
+    def _get_name(self):
+        return self.name
+
+    def _get_url(self):
+        return self.url
+
+    def _get_links(self):
+        return self.links
+
+    def _get_shapes(self):
+        return self.shapes
+
+    def _get_appearances(self):
+        return self.appearances
+
+    def _get_materials(self):
+        return self.materials
+
+    def _get_textures(self):
+        return self.textures
+
+    def _get_extraJoints(self):
+        return self.extraJoints
+
+
+def _polygons(index):
+    '''
+    Get start positions and lengths of the polygons separated by -1
+    '''
+    if len(index) == 0 or index[-1] != -1:
+        index = numpy.append(index, -1)
+    ends = numpy.nonzero(index == -1)[0]
+    starts = numpy.concatenate([[0], ends[:-1] + 1])
+    return starts, ends - starts
+
+
+def _fan(starts, lengths):
+    '''
+    Triangulate convex polygons and return positions of the corners in
+    the index array and the polygon of each triangle
+    '''
+    ntri = numpy.maximum(lengths - 2, 0)
+    poly = numpy.repeat(numpy.arange(len(starts)), ntri)
+    k = numpy.arange(ntri.sum()) - numpy.repeat(numpy.cumsum(ntri) - ntri, ntri) + 1
+    s = starts[poly]
+    return numpy.column_stack([s, s + k, s + k + 1]), poly
+
+
+def _earclip(points):
+    '''
+    Triangulate (possibly concave) polygon and return the local indices
+    '''
+    n = len(points)
+    normal = numpy.zeros(3)
+    for i in range(n):
+        a = points[i]
+        b = points[(i + 1) % n]
+        normal = normal + numpy.cross(a, b)
+    if numpy.allclose(normal, 0):
+        return [(0, i, i + 1) for i in range(1, n - 1)]
+    normal = normal / numpy.linalg.norm(normal)
+    remaining = range(n)
+    triangles = []
+    while len(remaining) > 3:
+        m = len(remaining)
+        for j in range(m):
+            i0, i1, i2 = remaining[j - 1], remaining[j], remaining[(j + 1) % m]
+            a, b, c = points[i0], points[i1], points[i2]
+            if numpy.dot(numpy.cross(b - a, c - b), normal) <= 0:
+                continue
+            ear = True
+            for k in remaining:
+                if k in (i0, i1, i2):
+                    continue
+                p = points[k]
+                if numpy.dot(numpy.cross(b - a, p - a), normal) >= 0 and \
+                   numpy.dot(numpy.cross(c - b, p - b), normal) >= 0 and \
+                   numpy.dot(numpy.cross(a - c, p - c), normal) >= 0:
+                    ear = False
+                    break
+            if ear:
+                triangles.append((i0, i1, i2))
+                remaining.pop(j)
+                break
+        else:
+            # degenerated polygon
+            break
+    for j in range(1, len(remaining) - 1):
+        triangles.append((remaining[0], remaining[j], remaining[j + 1]))
+    return triangles
+
+
+def _triangulate(index, vertices, convex=True):
+    '''
+    Triangulate the polygons and return positions of the corners in the
+    index array and the polygon of each triangle
+    '''
+    starts, lengths = _polygons(index)
+    if convex or numpy.all(lengths <= 3):
+        return _fan(starts, lengths)
+    pos = []
+    poly = []
+    for p, (s, l) in enumerate(zip(starts, lengths)):
+        if l < 3:
+            continue
+        if l == 3:
+            tris = [(0, 1, 2)]
+        else:
+            tris = _earclip(vertices[index[s:s + l]])
+        for t in tris:
+            pos.append([s + t[0], s + t[1], s + t[2]])
+            poly.append(p)
+    return numpy.array(pos, dtype=int).reshape(-1, 3), numpy.array(poly, dtype=int)
+
+
+def _facenormals(vertices, triangles):
+    tri = vertices[triangles]
+    n = numpy.cross(tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0])
+    return n / numpy.maximum(numpy.sqrt((n * n).sum(axis=1)), 1e-12)[:, numpy.newaxis]
+
+
+def _smoothnormals(vertices, triangles, creaseangle):
+    '''
+    Get normal of each corner averaging normals of the faces sharing the
+    vertex within the crease angle
+    '''
+    fn = _facenormals(vertices, triangles)
+    corners = triangles.reshape(-1)
+    faces = numpy.repeat(numpy.arange(len(triangles)), 3)
+    order = numpy.argsort(corners, kind='mergesort')
+    sv = corners[order]
+    starts = numpy.concatenate([[0], numpy.nonzero(numpy.diff(sv))[0] + 1])
+    sizes = numpy.diff(numpy.concatenate([starts, [len(sv)]]))
+    size = numpy.repeat(sizes, sizes)
+    start = numpy.repeat(starts, sizes)
+    # pairs of the corners sharing the same vertex
+    a = numpy.repeat(numpy.arange(len(sv)), size)
+    b = numpy.repeat(start, size) + numpy.arange(size.sum()) - numpy.repeat(numpy.cumsum(size) - size, size)
+    na = fn[faces[order[a]]]
+    nb = fn[faces[order[b]]]
+    weight = ((na * nb).sum(axis=1) >= math.cos(creaseangle) - 1e-9)[:, numpy.newaxis]
+    normals = numpy.zeros((len(sv), 3))
+    numpy.add.at(normals, a, nb * weight)
+    normals = normals / numpy.maximum(numpy.sqrt((normals * normals).sum(axis=1)), 1e-12)[:, numpy.newaxis]
+    result = numpy.zeros((len(corners), 3))
+    result[order] = normals
+    return result
+
+
+def _box(size):
+    x, y, z = [s / 2.0 for s in size]
+    vertices = numpy.array([[-x, -y, -z], [x, -y, -z], [x, y, -z], [-x, y, -z],
+                            [-x, -y, z], [x, -y, z], [x, y, z], [-x, y, z]])
+    triangles = numpy.array([[0, 2, 1], [0, 3, 2], [4, 5, 6], [4, 6, 7], [0, 1, 5], [0, 5, 4],
+                             [1, 2, 6], [1, 6, 5], [2, 3, 7], [2, 7, 6], [3, 0, 4], [3, 4, 7]])
+    return vertices, triangles
+
+
+def _sphere(radius):
+    n = _DIVISION
+    th, ph = numpy.meshgrid(numpy.linspace(0, numpy.pi, n / 2 + 1), numpy.linspace(0, 2 * numpy.pi, n + 1))
+    vertices = numpy.column_stack([(numpy.sin(th) * numpy.sin(ph)).reshape(-1),
+                                   numpy.cos(th).reshape(-1),
+                                   (numpy.sin(th) * numpy.cos(ph)).reshape(-1)]) * radius
+    idx = numpy.arange(len(vertices)).reshape(n + 1, n / 2 + 1)
+    a = idx[:-1, :-1].reshape(-1)
+    b = idx[:-1, 1:].reshape(-1)
+    c = idx[1:, 1:].reshape(-1)
+    d = idx[1:, :-1].reshape(-1)
+    triangles = numpy.vstack([numpy.column_stack([a, b, c]), numpy.column_stack([a, c, d])])
+    return vertices, triangles
+
+
+def _cone(bottom, top, height, side=True, caps=(True, True)):
+    '''
+    Mesh of the cone or the cylinder along Y axis
+    '''
+    n = _DIVISION
+    ph = numpy.linspace(0, 2 * numpy.pi, n, endpoint=False)
+    h = height / 2.0
+    ring = lambda r, y: numpy.column_stack([r * numpy.sin(ph), numpy.repeat(y, n), r * numpy.cos(ph)])
+    vertices = numpy.vstack([ring(bottom, -h), ring(top, h), [[0, -h, 0], [0, h, 0]]])
+    i = numpy.arange(n)
+    j = (i + 1) % n
+    triangles = []
+    if side:
+        triangles.append(numpy.column_stack([i, j, j + n]))
+        if top > 0:
+            triangles.append(numpy.column_stack([i, j + n, i + n]))
+    if caps[0] and bottom > 0:
+        triangles.append(numpy.column_stack([numpy.repeat(2 * n, n), j, i]))
+    if caps[1] and top > 0:
+        triangles.append(numpy.column_stack([numpy.repeat(2 * n + 1, n), i + n, j + n]))
+    if len(triangles) == 0:
+        return vertices, numpy.zeros((0, 3), dtype=int)
+    return vertices, numpy.vstack(triangles)
+
+
+class _Builder(object):
+    '''
+    Build BodyInfo from the parsed nodes
+    '''
+    def __init__(self):
+        self.body = BodyInfo()
+        self._shapes = {}
+        self._materials = {}
+        self._textures = {}
+        self._inlines = {}
+        self._defaultmaterial = None
+
+    def build(self, nodes):
+        root = self.findroot(nodes)
+        if root is None:
+            raise Exception('no Joint node found in the model')
+        self.link(root, None, numpy.identity(4))
+        return self.body
+
+    def findroot(self, nodes):
+        root = None
+        for n in nodes:
+            if n is None:
+                continue
+            if n.type == 'ExtraJoint':
+                self.extrajoint(n)
+            elif n.type == 'Joint':
+                if root is None:
+                    root = n
+            elif n.type == 'Humanoid':
+                self.body.name = n.name or _string(n.get('name'), '')
+                r = self.findroot(n.get('humanoidBody') or [])
+                root = root or r
+            elif n.type in ['Transform'] + _groups:
+                r = self.findroot(n.get('children') or [])
+                root = root or r
+            elif n.type == 'Inline':
+                r = self.findroot(self.inline(n))
+                root = root or r
+        return root
+
+    def inline(self, n):
+        url = _string(n.get('url'))
+        if url is None:
+            return []
+        fname = self.resolve(n, url)
+        try:
+            return self._inlines[fname]
+        except KeyError:
+            pass
+        nodes = parse(fname)
+        self._inlines[fname] = nodes
+        return nodes
+
+    def resolve(self, n, url):
+        if url.startswith('file://'):
+            url = url[7:]
+        if os.path.isabs(url) or '://' in url:
+            return url
+        return os.path.join(n.basedir, url)
+
+    def link(self, j, parent, t):
+        l = _Info()
+        l.name = j.name or _string(j.get('name'), '')
+        l.jointType = _string(j.get('jointType'), '')
+        l.jointId = int(_float(j.get('jointId'), -1))
+        l.jointAxis = _axis(j.get('jointAxis'))
+        if numpy.allclose(t, numpy.identity(4)):
+            l.translation = _floats(j.get('translation'), [0.0, 0.0, 0.0])
+            l.rotation = _floats(j.get('rotation'), [0.0, 0.0, 1.0, 0.0])
+        else:
+            l.translation, l.rotation = _decompose(numpy.dot(t, _matrix(j)))
+        l.ulimit = _floats(j.get('ulimit'), [])
+        l.llimit = _floats(j.get('llimit'), [])
+        l.uvlimit = _floats(j.get('uvlimit'), [])
+        l.lvlimit = _floats(j.get('lvlimit'), [])
+        l.gearRatio = _float(j.get('gearRatio'), 1.0)
+        l.rotorInertia = _float(j.get('rotorInertia'), 0.0)
+        l.rotorResistor = _float(j.get('rotorResistor'), 0.0)
+        l.torqueConst = _float(j.get('torqueConst'), 1.0)
+        l.encoderPulse = _float(j.get('encoderPulse'), 1.0)
+        l.mass = 0.0
+        l.centerOfMass = [0.0, 0.0, 0.0]
+        l.inertia = [0.0] * 9
+        l.childIndices = []
+        l.sensors = []
+        l.shapeIndices = []
+        l.parentIndex = -1
+        l._segments = []
+        if parent is not None:
+            l.parentIndex = self.body.links.index(parent)
+            parent.childIndices.append(len(self.body.links))
+        self.body.links.append(l)
+        self.children(l, j.get('children') or [], numpy.identity(4))
+        self.massproperty(l)
+        del l._segments
+
+    def children(self, l, nodes, t):
+        for n in nodes:
+            if n is None:
+                continue
+            if n.type == 'Joint':
+                self.link(n, l, t)
+            elif n.type == 'Segment':
+                l._segments.append((n, t))
+                self.children(l, n.get('children') or [], t)
+            elif n.type == 'Transform':
+                self.children(l, n.get('children') or [], numpy.dot(t, _matrix(n)))
+            elif n.type in _groups:
+                self.children(l, n.get('children') or [], t)
+            elif n.type == 'Switch':
+                choice = n.get('choice') or []
+                which = int(_float(n.get('whichChoice'), -1))
+                if 0 <= which < len(choice):
+                    self.children(l, [choice[which]], t)
+            elif n.type == 'Inline':
+                self.children(l, self.inline(n), t)
+            elif n.type == 'Shape':
+                self.shape(l, n, t)
+            elif n.type in _sensortypes:
+                self.sensor(l, n, t)
+            elif n.type == 'ExtraJoint':
+                self.extrajoint(n)
+            elif isinstance(n.get('children'), list):
+                self.children(l, n.get('children'), t)
+
+    def massproperty(self, l):
+        '''
+        Sum up mass, center of mass and inertia of the segments in the link frame
+        '''
+        segments = []
+        for s, t in l._segments:
+            m = _float(s.get('mass'), 0.0)
+            c = _floats(s.get('centerOfMass'), [0.0, 0.0, 0.0])
+            i = _floats(s.get('momentsOfInertia'), [0.0] * 9)
+            if not numpy.allclose(t, numpy.identity(4)):
+                c = list(numpy.dot(t, c + [1.0])[0:3])
+                r = t[0:3, 0:3] / numpy.linalg.norm(t[0:3, 0:3], axis=0)
+                i = list(numpy.dot(numpy.dot(r, numpy.array(i).reshape(3, 3)), r.T).reshape(-1))
+            segments.append((m, c, i))
+        if len(segments) == 0:
+            return
+        if len(segments) == 1:
+            l.mass, l.centerOfMass, l.inertia = segments[0]
+            return
+        mass = sum([m for m, c, i in segments])
+        if mass > 0:
+            com = sum([m * numpy.array(c) for m, c, i in segments]) / mass
+        else:
+            com = numpy.zeros(3)
+        inertia = numpy.zeros((3, 3))
+        for m, c, i in segments:
+            d = numpy.array(c) - com
+            inertia = inertia + numpy.array(i).reshape(3, 3) + m * (numpy.dot(d, d) * numpy.identity(3) - numpy.outer(d, d))
+        l.mass = mass
+        l.centerOfMass = list(com)
+        l.inertia = list(inertia.reshape(-1))
+
+    def sensor(self, l, n, t):
+        s = _Info()
+        s.name = n.name or _string(n.get('name'), '')
+        s.type = _sensortypes[n.type]
+        s.id = int(_float(n.get('sensorId'), -1))
+        if numpy.allclose(t, numpy.identity(4)):
+            s.translation = _floats(n.get('translation'), [0.0, 0.0, 0.0])
+            s.rotation = _floats(n.get('rotation'), [0.0, 0.0, 1.0, 0.0])
+        else:
+            s.translation, s.rotation = _decompose(numpy.dot(t, _matrix(n)))
+        if s.type == 'Vision':
+            s.specValues = [_float(n.get('frontClipDistance'), 0.01),
+                            _float(n.get('backClipDistance'), 10.0),
+                            _float(n.get('fieldOfView'), 0.785398),
+                            _cameratypes.get(_string(n.get('type'), 'NONE'), 0),
+                            int(_float(n.get('width'), 320)),
+                            int(_float(n.get('height'), 240)),
+                            _float(n.get('frameRate'), 30.0)]
+        elif s.type == 'Range':
+            s.specValues = [_float(n.get('scanAngle'), 3.14159),
+                            _float(n.get('scanStep'), 0.1),
+                            _float(n.get('scanRate'), 10.0),
+                            _float(n.get('maxDistance'), 10.0)]
+        elif s.type == 'Force':
+            s.specValues = _floats(n.get('maxForce'), [-1.0] * 3) + _floats(n.get('maxTorque'), [-1.0] * 3)
+        elif s.type == 'RateGyro':
+            s.specValues = _floats(n.get('maxAngularVelocity'), [-1.0] * 3)
+        else:
+            s.specValues = _floats(n.get('maxAcceleration'), [-1.0] * 3)
+        l.sensors.append(s)
+
+    def extrajoint(self, n):
+        j = _Info()
+        j.name = n.name or ''
+        j.jointType = _string(n.get('jointType'), 'xyz')
+        j.axis = _axis(n.get('jointAxis'))
+        j.link = [_string(n.get('link1Name'), ''), _string(n.get('link2Name'), '')]
+        j.point = [_floats(n.get('link1LocalPos'), [0.0, 0.0, 0.0]), _floats(n.get('link2LocalPos'), [0.0, 0.0, 0.0])]
+        self.body.extraJoints.append(j)
+
+    def material(self, n):
+        if n is None:
+            if self._defaultmaterial is None:
+                self._defaultmaterial = self.material(Node('Material', {}, ''))
+            return self._defaultmaterial
+        try:
+            return self._materials[id(n)]
+        except KeyError:
+            pass
+        m = _Info()
+        m.ambientIntensity = _float(n.get('ambientIntensity'), 0.2)
+        m.diffuseColor = _floats(n.get('diffuseColor'), [0.8, 0.8, 0.8])
+        m.emissiveColor = _floats(n.get('emissiveColor'), [0.0, 0.0, 0.0])
+        m.shininess = _float(n.get('shininess'), 0.2)
+        m.specularColor = _floats(n.get('specularColor'), [0.0, 0.0, 0.0])
+        m.transparency = _float(n.get('transparency'), 0.0)
+        self.body.materials.append(m)
+        self._materials[id(n)] = len(self.body.materials) - 1
+        return self._materials[id(n)]
+
+    def texture(self, n):
+        if n is None or n.type != 'ImageTexture' or _string(n.get('url')) is None:
+            return -1
+        try:
+            return self._textures[id(n)]
+        except KeyError:
+            pass
+        t = _Info()
+        t.url = self.resolve(n, _string(n.get('url')))
+        t.repeatS = n.get('repeatS', True)
+        t.repeatT = n.get('repeatT', True)
+        self.body.textures.append(t)
+        self._textures[id(n)] = len(self.body.textures) - 1
+        return self._textures[id(n)]
+
+    def shape(self, l, n, t):
+        g = n.get('geometry')
+        if g is None:
+            return
+        a = n.get('appearance')
+        key = (id(g), id(a))
+        if key not in self._shapes:
+            with profiling.stage('triangulate', g.type):
+                s = self.geometry(g, a)
+            if s is None:
+                return
+            self.body.shapes.append(s)
+            self._shapes[key] = len(self.body.shapes) - 1
+        i = _Info()
+        i.shapeIndex = self._shapes[key]
+        i.transformMatrix = [float(x) for x in t[0:3].reshape(-1)]
+        l.shapeIndices.append(i)
+
+    def geometry(self, g, a):
+        s = _Info()
+        ap = _Info()
+        ap.materialIndex = self.material(a.get('material') if a is not None else None)
+        ap.textureIndex = -1
+        ap.textureCoordinate = numpy.zeros(0)
+        ap.textureCoordIndices = numpy.zeros(0, dtype=int)
+        ap.colors = numpy.zeros(0)
+        ap.colorIndices = numpy.zeros(0, dtype=int)
+        ap.solid = g.get('solid', True)
+        ap.creaseAngle = _float(g.get('creaseAngle'), 0.0)
+        s.primitiveParameters = []
+        if g.type == 'IndexedFaceSet':
+            s.primitiveType = SP_MESH
+            vertices, triangles = self.faceset(g, ap)
+            if ap.textureCoordinate.size > 0 and a is not None:
+                ap.textureIndex = self.texture(a.get('texture'))
+        elif g.type in ('Box', 'Sphere', 'Cylinder', 'Cone'):
+            if g.type == 'Box':
+                s.primitiveType = SP_BOX
+                s.primitiveParameters = _floats(g.get('size'), [2.0, 2.0, 2.0])
+                vertices, triangles = _box(s.primitiveParameters)
+            elif g.type == 'Sphere':
+                s.primitiveType = SP_SPHERE
+                s.primitiveParameters = [_float(g.get('radius'), 1.0)]
+                vertices, triangles = _sphere(s.primitiveParameters[0])
+            elif g.type == 'Cylinder':
+                s.primitiveType = SP_CYLINDER
+                r = _float(g.get('radius'), 1.0)
+                h = _float(g.get('height'), 2.0)
+                caps = (g.get('bottom', True), g.get('top', True))
+                s.primitiveParameters = [r, h, float(caps[1]), float(caps[0]), float(g.get('side', True))]
+                vertices, triangles = _cone(r, r, h, g.get('side', True), caps)
+            else:
+                s.primitiveType = SP_CONE
+                r = _float(g.get('bottomRadius'), 1.0)
+                h = _float(g.get('height'), 2.0)
+                s.primitiveParameters = [r, h, float(g.get('bottom', True)), float(g.get('side', True))]
+                vertices, triangles = _cone(r, 0.0, h, g.get('side', True), (g.get('bottom', True), False))
+            if g.type == 'Sphere':
+                ap.normalPerVertex = True
+                ap.normals = (vertices / max(s.primitiveParameters[0], 1e-12)).reshape(-1)
+                ap.normalIndices = numpy.zeros(0, dtype=int)
+            else:
+                ap.normalPerVertex = False
+                ap.normals = _facenormals(vertices, triangles).reshape(-1)
+                ap.normalIndices = numpy.zeros(0, dtype=int)
+        else:
+            logger.warning('unsupported geometry: %s (ignoring)' % g.type)
+            return None
+        s.vertices = vertices.reshape(-1)
+        s.triangles = triangles.reshape(-1)
+        self.body.appearances.append(ap)
+        s.appearanceIndex = len(self.body.appearances) - 1
+        return s
+
+    def faceset(self, g, ap):
+        coord = g.get('coord')
+        vertices = _points(coord.get('point') if coord is not None else None, 3)
+        index = _indices(g.get('coordIndex'))
+        pos, poly = _triangulate(index, vertices, g.get('convex', True))
+        if not g.get('ccw', True):
+            pos = pos[:, [0, 2, 1]]
+        triangles = index[pos]
+
+        normal = g.get('normal')
+        normalindex = _indices(g.get('normalIndex'))
+        ap.normalPerVertex = bool(g.get('normalPerVertex', True))
+        if normal is not None and len(_points(normal.get('vector'), 3)) > 0:
+            ap.normals = _points(normal.get('vector'), 3).reshape(-1)
+            if ap.normalPerVertex:
+                ap.normalIndices = normalindex[pos].reshape(-1) if len(normalindex) > 0 else numpy.zeros(0, dtype=int)
+            else:
+                ap.normalIndices = normalindex[poly] if len(normalindex) > 0 else poly
+        elif ap.creaseAngle > 0 and len(triangles) > 0:
+            ap.normalPerVertex = True
+            ap.normals = _smoothnormals(vertices, triangles, ap.creaseAngle).reshape(-1)
+            ap.normalIndices = numpy.arange(len(triangles) * 3)
+        else:
+            ap.normalPerVertex = False
+            ap.normals = _facenormals(vertices, triangles).reshape(-1)
+            ap.normalIndices = numpy.zeros(0, dtype=int)
+
+        texcoord = g.get('texCoord')
+        if texcoord is not None and len(_points(texcoord.get('point'), 2)) > 0:
+            ap.textureCoordinate = _points(texcoord.get('point'), 2).reshape(-1)
+            texindex = _indices(g.get('texCoordIndex'))
+            if len(texindex) > 0:
+                ap.textureCoordIndices = texindex[pos].reshape(-1)
+            else:
+                ap.textureCoordIndices = triangles.reshape(-1)
+        return vertices, triangles
+
+
+class ModelLoader(object):
+    '''
+    Loader of VRML models with the same interface as OpenHRP ModelLoader
+    '''
+    def loadBodyInfo(self, url):
+        '''
+        Load the model and return BodyInfo
+        '''
+        if url.startswith('file://'):
+            url = url[7:]
+        body = _Builder().build(parse(url))
+        body.url = url
+        return body
+
+
+def loadstring(text, basedir=''):
+    '''
+    Load the model given as VRML text and return BodyInfo
+    '''
+    return _Builder().build(parsestring(text, basedir))
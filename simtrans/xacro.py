@@ -0,0 +1,538 @@
+# -*- coding:utf-8 -*-
+
+"""In-process expansion of xacro files
+
+URDF models written in xacro (``.urdf.xacro``) are expanded without ROS
+installation. Properties (including block properties), macros (with
+default, forwarded ``^`` and block ``*``/``**`` parameters), includes,
+conditionals, ``${}`` math expressions and ``$(find)``, ``$(arg)``,
+``$(env)``, ``$(optenv)`` substitution args are supported.
+
+The parsed files and the macro definitions in them are cached in the
+process until the files are modified, so that batch conversions of the
+robots sharing the same macro files read and compile them only once.
+The cached documents are never modified; the expansion builds a new
+tree.
+
+:Organization:
+ AIST
+
+Requirements
+------------
+* lxml xml parser
+
+Examples
+--------
+
+Expand the model using the macro defined in the included file
+
+>>> import tempfile
+>>> d = tempfile.mkdtemp()
+>>> with open(os.path.join(d, 'macros.xacro'), 'w') as f:
+...     f.write('''<robot xmlns:xacro="http://www.ros.org/wiki/xacro">
+...   <xacro:property name="length" value="0.5"/>
+...   <xacro:macro name="arm" params="prefix reflect:=1 *origin">
+...     <link name="${prefix}_arm">
+...       <xacro:insert_block name="origin"/>
+...       <xacro:if value="${reflect == -1}"><mirrored/></xacro:if>
+...     </link>
+...   </xacro:macro>
+... </robot>''')
+>>> with open(os.path.join(d, 'robot.urdf.xacro'), 'w') as f:
+...     f.write('''<robot name="test" xmlns:xacro="http://www.ros.org/wiki/xacro">
+...   <xacro:arg name="base" default="base"/>
+...   <xacro:include filename="macros.xacro"/>
+...   <link name="$(arg base)"/>
+...   <xacro:arm prefix="left"><origin xyz="0 ${length/2} 0"/></xacro:arm>
+...   <xacro:arm prefix="right" reflect="-1"><origin xyz="0 ${-length/2} 0"/></xacro:arm>
+... </robot>''')
+>>> files = []
+>>> r = expand(os.path.join(d, 'robot.urdf.xacro'), files=files)
+>>> [(e.tag, e.get('name')) for e in r]
+[('link', 'base'), ('link', 'left_arm'), ('link', 'right_arm')]
+>>> [(c.tag, c.get('xyz')) for c in r[2]]
+[('origin', '0 -0.25 0'), ('mirrored', None)]
+>>> [os.path.basename(f) for f in files]
+['robot.urdf.xacro', 'macros.xacro']
+
+Parsed files are reused by the following expansions
+
+>>> clear()
+>>> r = expand(os.path.join(d, 'robot.urdf.xacro'), args={'base': 'body'})
+>>> r = expand(os.path.join(d, 'robot.urdf.xacro'), args={'base': 'body'})
+>>> r[0].get('name'), stats()['files'], stats()['filehits']
+('body', 2, 2)
+>>> import shutil
+>>> shutil.rmtree(d)
+"""
+
+import os
+import re
+import math
+import threading
+import lxml.etree
+from . import utils
+from . import cache
+from . import profiling
+from . import archive
+
+NAMESPACES = ['http://www.ros.org/wiki/xacro', 'http://ros.org/wiki/xacro']  #: Namespaces of xacro tags
+
+_lock = threading.RLock()
+_files = {}
+_expressions = {}
+_counts = {'hits': 0, 'misses': 0}
+
+_GLOBALS = {'__builtins__': {}, 'math': math,
+            'True': True, 'False': False, 'None': None,
+            'abs': abs, 'min': min, 'max': max, 'round': round, 'len': len,
+            'int': int, 'float': float, 'str': str, 'bool': bool,
+            'list': list, 'range': range, 'sum': sum}
+for _name in dir(math):
+    if not _name.startswith('_'):
+        _GLOBALS[_name] = getattr(math, _name)
+
+_substitution = re.compile(r'\$\$+[\{\(]|\$\{([^}]*)\}|\$\(([^)]*)\)')
+
+
+class _Macro(object):
+    def __init__(self, e):
+        self.name = e.get('name')
+        if self.name.startswith('xacro:'):
+            self.name = self.name[len('xacro:'):]
+        self.params = []
+        for p in e.get('params', '').split():
+            default = None
+            if ':=' in p:
+                p, default = p.split(':=', 1)
+            elif '=' in p:
+                p, default = p.split('=', 1)
+            if p.startswith('**'):
+                self.params.append((p[2:], '**', None))
+            elif p.startswith('*'):
+                self.params.append((p[1:], '*', None))
+            else:
+                self.params.append((p, '', default))
+        self.body = e
+
+
+class _File(object):
+    def __init__(self, fname):
+        self.root = lxml.etree.parse(archive.open(fname), base_url=fname).getroot()
+        # macro definitions are compiled once per file
+        self.macros = {}
+        for ns in NAMESPACES:
+            for e in self.root.iter('{%s}macro' % ns):
+                self.macros[e] = _Macro(e)
+
+
+class _Block(object):
+    def __init__(self, element, multi):
+        self.element = element
+        self.multi = multi
+
+
+class _Table(object):
+    '''
+    Scope of the properties evaluated on demand
+    '''
+    def __init__(self, parent=None, expander=None):
+        self.parent = parent
+        self.expander = expander or parent.expander
+        self.values = {}
+        self.raw = {}
+        self.evaluating = set()
+
+    def define(self, name, text):
+        self.values.pop(name, None)
+        self.raw[name] = text
+
+    def set(self, name, value):
+        self.raw.pop(name, None)
+        self.values[name] = value
+
+    def __contains__(self, name):
+        return name in self.values or name in self.raw or \
+            (self.parent is not None and name in self.parent)
+
+    def __getitem__(self, name):
+        try:
+            return self.values[name]
+        except KeyError:
+            pass
+        if name in self.raw:
+            if name in self.evaluating:
+                raise Exception('circular definition of property: %s' % name)
+            self.evaluating.add(name)
+            try:
+                value = _number(self.expander.evaluate(self.raw[name], self))
+            finally:
+                self.evaluating.discard(name)
+            self.set(name, value)
+            return value
+        if self.parent is not None:
+            return self.parent[name]
+        raise KeyError(name)
+
+    def __getattr__(self, name):
+        # access to the properties of the included namespace (e.g. ${ns.value})
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class _Macros(object):
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.macros = {}
+
+    def get(self, name):
+        m = self.macros.get(name)
+        if m is None and self.parent is not None:
+            return self.parent.get(name)
+        return m
+
+
+def _number(value):
+    if isinstance(value, basestring):
+        try:
+            return int(value)
+        except ValueError:
+            pass
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    return value
+
+
+def _boolean(value):
+    if isinstance(value, basestring):
+        if value in ('true', 'True', '1'):
+            return True
+        if value in ('false', 'False', '0'):
+            return False
+        raise Exception('not a boolean value: %s' % value)
+    return bool(value)
+
+
+def _localname(e):
+    if not isinstance(e.tag, basestring):
+        return None
+    if e.tag[0] == '{':
+        ns, name = e.tag[1:].split('}', 1)
+        if ns in NAMESPACES:
+            return name
+    return None
+
+
+def _appendtext(out, text):
+    if not text:
+        return
+    if len(out) == 0:
+        out.text = (out.text or '') + text
+    else:
+        out[-1].tail = (out[-1].tail or '') + text
+
+
+def load(fname):
+    '''
+    Parse the xacro file unless the same file is already parsed (the
+    parsed document is shared and should not be modified)
+    '''
+    fname = os.path.abspath(fname)
+    st = archive.stat(fname)
+    key = (fname, st.st_mtime, st.st_size)
+    with _lock:
+        f = _files.get(key)
+        if f is not None:
+            _counts['hits'] += 1
+            profiling.count('xacro cache hits')
+            return f
+    with profiling.stage('parse xacro', fname):
+        f = _File(fname)
+    with _lock:
+        _counts['misses'] += 1
+        _files[key] = f
+    return f
+
+
+def compileexpression(expr):
+    '''
+    Compile the python expression in ${} (compiled code is cached)
+    '''
+    with _lock:
+        try:
+            return _expressions[expr]
+        except KeyError:
+            pass
+    try:
+        code = compile(expr.strip(), '<xacro>', 'eval')
+    except SyntaxError, e:
+        raise Exception('invalid expression: ${%s} (%s)' % (expr, e))
+    with _lock:
+        _expressions[expr] = code
+    return code
+
+
+class Expander(object):
+    '''
+    Expander of the xacro file
+
+    :param args: values of the arguments (override the default values given by xacro:arg)
+    '''
+    def __init__(self, args=None):
+        self.args = dict(args or {})
+        self.files = []
+        self._current = []
+
+    def expand(self, fname):
+        '''
+        Expand the xacro file and return the root element of the result
+        '''
+        fname = utils.resolveFile(fname)
+        f = self._open(fname)
+        src = f.root
+        nsmap = dict([(k, v) for k, v in src.nsmap.items() if v not in NAMESPACES])
+        root = lxml.etree.Element(src.tag, nsmap=nsmap)
+        symbols = _Table(expander=self)
+        self._element(src, root, _Macros(), symbols)
+        self._current.pop()
+        return root
+
+    def _open(self, fname):
+        f = load(fname)
+        if os.path.abspath(fname) not in self.files:
+            self.files.append(os.path.abspath(fname))
+        self._current.append((os.path.dirname(os.path.abspath(fname)), f))
+        return f
+
+    def evaluate(self, text, symbols):
+        '''
+        Evaluate ${} expressions and $() substitution args in the text (the
+        value of the expression is returned as is if the text consists of one
+        expression)
+        '''
+        if text is None or '$' not in text:
+            return text
+        parts = []
+        pos = 0
+        for m in _substitution.finditer(text):
+            parts.append(text[pos:m.start()])
+            pos = m.end()
+            if m.group(1) is not None:
+                code = compileexpression(m.group(1))
+                try:
+                    parts.append(eval(code, _GLOBALS, symbols))
+                except NameError, e:
+                    raise Exception('undefined property in ${%s}: %s' % (m.group(1), e))
+            elif m.group(2) is not None:
+                parts.append(self.substitute(m.group(2)))
+            else:
+                # escaped $$ is replaced by $
+                parts.append(m.group(0)[1:])
+        parts.append(text[pos:])
+        if len(parts) == 3 and parts[0] == '' and parts[2] == '':
+            return parts[1]
+        return ''.join([unicode(p) if isinstance(p, unicode) else str(p) for p in parts])
+
+    def substitute(self, arg):
+        '''
+        Evaluate the substitution arg in $()
+        '''
+        words = arg.split()
+        if len(words) == 0:
+            raise Exception('empty substitution arg: $()')
+        command, params = words[0], words[1:]
+        if command == 'find' and len(params) == 1:
+            return cache.packagepath(params[0])
+        if command == 'arg' and len(params) == 1:
+            try:
+                return self.args[params[0]]
+            except KeyError:
+                raise Exception('undefined xacro argument: %s' % params[0])
+        if command == 'env' and len(params) == 1:
+            try:
+                return os.environ[params[0]]
+            except KeyError:
+                raise Exception('undefined environment variable: %s' % params[0])
+        if command == 'optenv' and len(params) >= 1:
+            return os.environ.get(params[0], ' '.join(params[1:]))
+        if command == 'dirname' and len(params) == 0:
+            return self._current[-1][0]
+        if command == 'cwd' and len(params) == 0:
+            return os.getcwd()
+        raise Exception('unsupported substitution arg: $(%s)' % arg)
+
+    def _string(self, text, symbols):
+        value = self.evaluate(text, symbols)
+        if isinstance(value, unicode):
+            return value
+        return str(value)
+
+    def _element(self, src, out, macros, symbols):
+        # expand the attributes and children of the element
+        for k, v in src.attrib.items():
+            if k[0] == '{' and k[1:].split('}', 1)[0] in NAMESPACES:
+                continue
+            out.set(k, self._string(v, symbols))
+        self._children(src, out, macros, symbols)
+
+    def _children(self, src, out, macros, symbols):
+        if src.text:
+            _appendtext(out, self._string(src.text, symbols))
+        for c in src:
+            self._node(c, out, macros, symbols)
+            if c.tail:
+                _appendtext(out, self._string(c.tail, symbols))
+
+    def _node(self, c, out, macros, symbols):
+        if not isinstance(c.tag, basestring):
+            if c.tag is lxml.etree.Comment:
+                out.append(lxml.etree.Comment(c.text))
+            return
+        name = _localname(c)
+        if name is None:
+            e = lxml.etree.SubElement(out, c.tag)
+            self._element(c, e, macros, symbols)
+        elif name == 'property':
+            self._property(c, symbols)
+        elif name == 'arg':
+            if c.get('name') not in self.args:
+                self.args[c.get('name')] = self._string(c.get('default', ''), symbols)
+        elif name == 'macro':
+            m = self._current[-1][1].macros.get(c)
+            if m is None:
+                m = _Macro(c)
+            macros.macros[m.name] = m
+        elif name == 'include':
+            self._include(c, out, macros, symbols)
+        elif name in ('if', 'unless'):
+            value = _boolean(self.evaluate(c.get('value'), symbols))
+            if value == (name == 'if'):
+                self._children(c, out, macros, symbols)
+        elif name == 'insert_block':
+            block = symbols[self._string(c.get('name'), symbols)]
+            if not isinstance(block, _Block):
+                raise Exception('not a block: %s' % c.get('name'))
+            if block.multi:
+                self._children(block.element, out, macros, symbols)
+            else:
+                self._node(block.element, out, macros, symbols)
+        elif name == 'element':
+            e = lxml.etree.SubElement(out, self._string(c.get('{%s}name' % c.tag[1:].split('}')[0]), symbols))
+            self._element(c, e, macros, symbols)
+        elif name == 'attribute':
+            out.set(self._string(c.get('name'), symbols), self._string(c.get('value'), symbols))
+        elif name == 'call':
+            self._call(self._string(c.get('macro'), symbols), c, out, macros, symbols, ['macro'])
+        else:
+            self._call(name, c, out, macros, symbols)
+
+    def _property(self, c, symbols):
+        name = c.get('name')
+        scope = c.get('scope')
+        if scope == 'parent' and symbols.parent is not None:
+            symbols = symbols.parent
+        elif scope == 'global':
+            while symbols.parent is not None:
+                symbols = symbols.parent
+        if 'value' in c.attrib:
+            symbols.define(name, c.get('value'))
+        elif 'default' in c.attrib:
+            if name not in symbols:
+                symbols.define(name, c.get('default'))
+        else:
+            # block property inserted by xacro:insert_block
+            symbols.set(name, _Block(c, True))
+
+    def _include(self, c, out, macros, symbols):
+        fname = self._string(c.get('filename'), symbols)
+        fname = utils.resolveFile(fname)
+        if not os.path.isabs(fname):
+            fname = os.path.join(self._current[-1][0], fname)
+        if not archive.exists(fname):
+            raise Exception('included file is not found: %s' % fname)
+        f = self._open(fname)
+        ns = c.get('ns')
+        if ns:
+            # definitions in the file are accessed by ns.name
+            nsmacros = _Macros(macros)
+            nssymbols = _Table(symbols)
+            self._children(f.root, out, nsmacros, nssymbols)
+            for k, v in nsmacros.macros.items():
+                macros.macros[ns + '.' + k] = v
+            symbols.set(ns, nssymbols)
+        else:
+            self._children(f.root, out, macros, symbols)
+        self._current.pop()
+
+    def _call(self, name, c, out, macros, symbols, ignored=[]):
+        m = macros.get(name)
+        if m is None:
+            raise Exception('unknown macro: xacro:%s' % name)
+        scope = _Table(symbols)
+        blocks = [e for e in c if isinstance(e.tag, basestring)]
+        attrs = [k for k in c.attrib.keys() if k not in ignored]
+        for p, kind, default in m.params:
+            if kind:
+                if len(blocks) == 0:
+                    raise Exception('block parameter %s of macro %s is not given' % (p, name))
+                scope.set(p, _Block(blocks.pop(0), kind == '**'))
+            elif p in c.attrib:
+                attrs.remove(p)
+                scope.set(p, _number(self.evaluate(c.get(p), symbols)))
+            elif default is not None and default.startswith('^'):
+                # forward the property of the outer scope
+                if p in symbols:
+                    scope.set(p, symbols[p])
+                elif default.startswith('^|'):
+                    scope.define(p, default[2:])
+                else:
+                    raise Exception('forwarded parameter %s of macro %s is not defined' % (p, name))
+            elif default is not None:
+                scope.define(p, default)
+            else:
+                raise Exception('parameter %s of macro %s is not given' % (p, name))
+        if len(attrs) > 0:
+            raise Exception('unknown parameters of macro %s: %s' % (name, ', '.join(attrs)))
+        self._children(m.body, out, _Macros(macros), scope)
+
+
+def expand(fname, args=None, files=None):
+    '''
+    Expand the xacro file and return the root element of the result
+
+    :param fname: path of the xacro file
+    :param args: values of the arguments (optional)
+    :param files: list to which the paths of the read files are appended (optional)
+    '''
+    e = Expander(args)
+    with profiling.stage('expand xacro', fname):
+        root = e.expand(fname)
+    if files is not None:
+        files.extend(e.files)
+    return root
+
+
+def stats():
+    '''
+    Get statistics of the cache of the parsed files
+    '''
+    with _lock:
+        return {'files': len(_files), 'expressions': len(_expressions),
+                'filehits': _counts['hits'], 'filemisses': _counts['misses']}
+
+
+def clear():
+    '''
+    Clear the cache of the parsed files
+    '''
+    with _lock:
+        _files.clear()
+        _expressions.clear()
+        _counts['hits'] = 0
+        _counts['misses'] = 0
@@ -2,17 +2,63 @@
 
 import doctest
 import simtrans.utils
+import simtrans.registry
 import simtrans.model
 import simtrans.collada
+import simtrans.decimate
+import simtrans.convex
+import simtrans.primitive
+import simtrans.cache
+import simtrans.profiling
+import simtrans.tracing
+import simtrans.memory
+import simtrans.stream
+import simtrans.pipeline
+import simtrans.sink
+import simtrans.archive
+import simtrans.batch
+import simtrans.daemon
+import simtrans.info
+import simtrans.project
+import simtrans.gltf
+import simtrans.stl
 import simtrans.urdf
+import simtrans.xacro
 import simtrans.sdf
 import simtrans.vrml
+import simtrans.vrmlparser
 import simtrans.graphviz
+import simtrans.manifest
+import simtrans.catxml
+import simtrans.gzfetch
 
 doctest.testmod(simtrans.utils)
+doctest.testmod(simtrans.registry)
 doctest.testmod(simtrans.model)
 doctest.testmod(simtrans.collada)
+doctest.testmod(simtrans.decimate)
+doctest.testmod(simtrans.convex)
+doctest.testmod(simtrans.primitive)
+doctest.testmod(simtrans.cache)
+doctest.testmod(simtrans.profiling)
+doctest.testmod(simtrans.tracing)
+doctest.testmod(simtrans.memory)
+doctest.testmod(simtrans.stream)
+doctest.testmod(simtrans.pipeline)
+doctest.testmod(simtrans.sink)
+doctest.testmod(simtrans.archive)
+doctest.testmod(simtrans.batch)
+doctest.testmod(simtrans.daemon)
+doctest.testmod(simtrans.info)
+doctest.testmod(simtrans.project)
+doctest.testmod(simtrans.gltf)
+doctest.testmod(simtrans.stl)
 doctest.testmod(simtrans.urdf)
+doctest.testmod(simtrans.xacro)
 doctest.testmod(simtrans.sdf)
 doctest.testmod(simtrans.vrml)
+doctest.testmod(simtrans.vrmlparser)
 doctest.testmod(simtrans.graphviz)
+doctest.testmod(simtrans.manifest)
+doctest.testmod(simtrans.catxml)
+doctest.testmod(simtrans.gzfetch)
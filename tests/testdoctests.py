@@ -1,18 +1,66 @@
 import unittest
 import doctest
 import simtrans.utils
+import simtrans.registry
 import simtrans.collada
+import simtrans.decimate
+import simtrans.convex
+import simtrans.primitive
+import simtrans.cache
+import simtrans.profiling
+import simtrans.tracing
+import simtrans.memory
+import simtrans.stream
+import simtrans.pipeline
+import simtrans.sink
+import simtrans.archive
+import simtrans.batch
+import simtrans.daemon
+import simtrans.info
+import simtrans.project
+import simtrans.gltf
+import simtrans.stl
 import simtrans.urdf
+import simtrans.xacro
 import simtrans.sdf
 import simtrans.vrml
+import simtrans.vrmlparser
 import simtrans.graphviz
+import simtrans.manifest
+import simtrans.catxml
+import simtrans.gzfetch
+import simtrans.cli
 
 
 def load_tests(loader, tests, ignore):
     tests.addTests(doctest.DocTestSuite(simtrans.utils))
+    tests.addTests(doctest.DocTestSuite(simtrans.registry))
     tests.addTests(doctest.DocTestSuite(simtrans.collada))
+    tests.addTests(doctest.DocTestSuite(simtrans.decimate))
+    tests.addTests(doctest.DocTestSuite(simtrans.convex))
+    tests.addTests(doctest.DocTestSuite(simtrans.primitive))
+    tests.addTests(doctest.DocTestSuite(simtrans.cache))
+    tests.addTests(doctest.DocTestSuite(simtrans.profiling))
+    tests.addTests(doctest.DocTestSuite(simtrans.tracing))
+    tests.addTests(doctest.DocTestSuite(simtrans.memory))
+    tests.addTests(doctest.DocTestSuite(simtrans.stream))
+    tests.addTests(doctest.DocTestSuite(simtrans.pipeline))
+    tests.addTests(doctest.DocTestSuite(simtrans.sink))
+    tests.addTests(doctest.DocTestSuite(simtrans.archive))
+    tests.addTests(doctest.DocTestSuite(simtrans.batch))
+    tests.addTests(doctest.DocTestSuite(simtrans.daemon))
+    tests.addTests(doctest.DocTestSuite(simtrans.info))
+    tests.addTests(doctest.DocTestSuite(simtrans.project))
+    tests.addTests(doctest.DocTestSuite(simtrans.gltf))
+    tests.addTests(doctest.DocTestSuite(simtrans.stl))
     tests.addTests(doctest.DocTestSuite(simtrans.urdf))
+    tests.addTests(doctest.DocTestSuite(simtrans.xacro))
     tests.addTests(doctest.DocTestSuite(simtrans.sdf))
     tests.addTests(doctest.DocTestSuite(simtrans.vrml))
+    tests.addTests(doctest.DocTestSuite(simtrans.vrmlparser))
     tests.addTests(doctest.DocTestSuite(simtrans.graphviz))
+    tests.addTests(doctest.DocTestSuite(simtrans.manifest))
+    tests.addTests(doctest.DocTestSuite(simtrans.catxml))
+    tests.addTests(doctest.DocTestSuite(simtrans.gzfetch))
+    tests.addTests(doctest.DocTestSuite(simtrans.cli))
     return tests